@@ -0,0 +1,530 @@
+#!/usr/bin/env python3
+"""
+DNS Tool benchmark harness.
+
+Starts local stand-ins for everything DNS Tool talks to -- a UDP/TCP DNS
+server with synthetic zones, an RDAP server and an MTA-STS HTTPS endpoint --
+then drives ``run_all_checks`` and the parallel batch mode against them and
+reports domains/sec, queries/sec and per-domain latency percentiles. The
+``startup`` scenario launches ``dnstool.py`` as a fresh process and times how
+long it takes for its first DNS query to reach the stand-in server.
+
+    python bench.py --domains 200 --jobs 16 --latency-ms 2 --loss 0.01
+    python bench.py --scenario startup --max-startup-ms 400
+    python bench.py --scenario checks --latency-ms 20 --max-queries-per-domain 40
+"""
+import argparse
+import contextlib
+import json
+import logging
+import math
+import multiprocessing
+import os
+import random
+import re
+import shutil
+import socket
+import subprocess
+import sys
+import tempfile
+import threading
+import time
+from concurrent.futures import ThreadPoolExecutor
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+
+import dns.message
+import dns.rcode
+import dns.rdatatype
+import dns.rrset
+
+import dnstool
+
+BENCH_TLD = "bench"
+BENCH_TTL = 300
+BENCH_SOA = f"ns1.{BENCH_TLD}. hostmaster.{BENCH_TLD}. 1 3600 600 86400 300"
+DNS_WORKERS = 256
+SCENARIOS = ("checks", "batch", "startup")
+STARTUP_TIMEOUT = 10.0
+# Median cold start to first query that fails the startup scenario. The
+# interpreter alone takes 15-70 ms to start, and dnspython's resolver
+# stack (which itself imports ssl and hashlib) another 90-130 ms. So 100 ms is
+# out of reach for any process that sends a query; 180-280 ms was measured
+# from a source checkout, which recompiles dnstool.py on every run.
+STARTUP_BUDGET_MS = 400.0
+# Mean DNS queries per synthetic domain that fails a scenario. A full check
+# sends about 23; sweeping the whole DKIM selector dictionary sent about 140
+# and queued every other domain behind it.
+QUERY_BUDGET_PER_DOMAIN = 40.0
+# Settings dnstool._size_pools() scales to each scenario's --jobs; they are
+# restored afterwards, and every scenario starts with fresh pools.
+POOL_SIZES = ("CHECK_WORKERS", "DKIM_WORKERS", "WAVE_WORKERS", "HEDGE_WORKERS", "AUTHORITATIVE_WORKERS",
+              "MAX_INFLIGHT_PER_RESOLVER")
+
+
+def bench_domains(count: int, offset: int = 0) -> list:
+    """Return ``count`` synthetic domain names starting at ``offset``."""
+    return [f"site{i}.{BENCH_TLD}" for i in range(offset, offset + count)]
+
+
+def _zone_names(i: int) -> dict:
+    """Return ``{label: {rdtype: [rdata]}}`` for synthetic domain number ``i``."""
+    apex = f"site{i}.{BENCH_TLD}."
+    ip = f"192.0.2.{i % 254 + 1}"
+    names = {
+        "": {
+            "NS": [f"ns1.{apex}", f"ns2.{apex}"],
+            "A": [ip],
+            "AAAA": [f"2001:db8::{i:x}"],
+            "MX": [f"10 mail.{apex}"],
+            "TXT": ['"v=spf1 mx -all"'],
+            "CAA": ['0 issue "letsencrypt.org"'],
+            "SOA": [BENCH_SOA],
+        },
+        "ns1": {"A": [ip]},
+        "ns2": {"A": [ip]},
+        "mail": {"A": [ip]},
+        "_dmarc": {"TXT": [f'"v=DMARC1; p=reject; rua=mailto:dmarc@{apex.rstrip(".")}"']},
+        "_mta-sts": {"TXT": ['"v=STSv1; id=20240101"']},
+    }
+    # Every other domain publishes DKIM, so both the selector fan-out and the
+    # _domainkey NXDOMAIN short-circuit are exercised.
+    if i % 2 == 0:
+        names["default._domainkey"] = {"TXT": ['"v=DKIM1; k=rsa; p=MIGfMA0GCSqGSIb3DQEBAQUAA4GNADCBiQKBgQC"']}
+    if i % 4 == 0:
+        names["default._bimi"] = {"TXT": [f'"v=BIMI1; l=https://{apex.rstrip(".")}/logo.svg"']}
+    return names
+
+
+def synthetic_records(name: str, rdtype: str):
+    """Return ``(records, exists, zone)`` for a query against the synthetic zones."""
+    m = re.match(r"^(\d+)\.2\.0\.192\.in-addr\.arpa\.$", name)
+    if m:
+        records = [f"mail.site{int(m.group(1)) - 1}.{BENCH_TLD}."] if rdtype == "PTR" else []
+        return records, True, "2.0.192.in-addr.arpa."
+    m = re.match(rf"^(?:(.+)\.)?site(\d+)\.{BENCH_TLD}\.$", name)
+    if not m:
+        return [], name == f"{BENCH_TLD}.", f"{BENCH_TLD}."
+    label, i = m.group(1) or "", int(m.group(2))
+    names = _zone_names(i)
+    zone = f"site{i}.{BENCH_TLD}."
+    if label in names:
+        return names[label].get(rdtype, []), True, zone
+    # Empty non-terminals such as _domainkey exist but hold no records.
+    exists = any(other.endswith(f".{label}") for other in names)
+    return [], exists, zone
+
+
+class FakeDNSServer:
+    """UDP and TCP DNS server on one local port answering from the synthetic zones.
+
+    Every answer is delayed by ``latency`` seconds and UDP queries are
+    dropped with probability ``loss``. Queries are counted in ``counter``, a
+    ``multiprocessing.Value`` so the count can be read from another process;
+    ``first_query`` likewise holds the wall-clock time of the first query
+    received since it was last reset to zero.
+    """
+
+    def __init__(self, latency: float = 0.0, loss: float = 0.0, counter=None, first_query=None):
+        self.latency = latency
+        self.loss = loss
+        self._counter = counter if counter is not None else multiprocessing.Value("q", 0)
+        self._first_query = first_query if first_query is not None else multiprocessing.Value("d", 0.0)
+        self._pool = ThreadPoolExecutor(max_workers=DNS_WORKERS, thread_name_prefix="bench-dns")
+        self.udp, self.tcp = self._bind()
+        self.port = self.udp.getsockname()[1]
+        threading.Thread(target=self._serve_udp, daemon=True).start()
+        threading.Thread(target=self._serve_tcp, daemon=True).start()
+
+    @staticmethod
+    def _bind():
+        """Bind a UDP and a TCP socket to the same free local port."""
+        for _ in range(20):
+            udp = socket.socket(socket.AF_INET, socket.SOCK_DGRAM)
+            udp.bind(("127.0.0.1", 0))
+            tcp = socket.socket(socket.AF_INET, socket.SOCK_STREAM)
+            try:
+                tcp.bind(("127.0.0.1", udp.getsockname()[1]))
+            except OSError:
+                udp.close()
+                tcp.close()
+                continue
+            tcp.listen(64)
+            return udp, tcp
+        raise OSError("no free port for the fake DNS server")
+
+    def answer(self, wire: bytes):
+        """Return the wire-format response to ``wire``, or ``None`` if it is not a query."""
+        try:
+            query = dns.message.from_wire(wire)
+        except Exception:
+            return None
+        with self._counter.get_lock():
+            self._counter.value += 1
+            if not self._first_query.value:
+                self._first_query.value = time.time()
+        response = dns.message.make_response(query)
+        question = query.question[0]
+        rdtype = dns.rdatatype.to_text(question.rdtype)
+        records, exists, zone = synthetic_records(question.name.to_text().lower(), rdtype)
+        if records:
+            response.answer.append(dns.rrset.from_text_list(question.name, BENCH_TTL, "IN", rdtype, records))
+        else:
+            if not exists:
+                response.set_rcode(dns.rcode.NXDOMAIN)
+            response.authority.append(dns.rrset.from_text(zone, BENCH_TTL, "IN", "SOA", BENCH_SOA))
+        return response.to_wire()
+
+    def _reply_udp(self, data: bytes, addr):
+        if self.loss and random.random() < self.loss:
+            return
+        if self.latency:
+            time.sleep(self.latency)
+        response = self.answer(data)
+        if response is not None:
+            with contextlib.suppress(OSError):
+                self.udp.sendto(response, addr)
+
+    def _serve_udp(self):
+        while True:
+            try:
+                data, addr = self.udp.recvfrom(65535)
+            except OSError:
+                return
+            self._pool.submit(self._reply_udp, data, addr)
+
+    def _serve_tcp(self):
+        while True:
+            try:
+                conn, _ = self.tcp.accept()
+            except OSError:
+                return
+            threading.Thread(target=self._serve_tcp_conn, args=(conn,), daemon=True).start()
+
+    def _serve_tcp_conn(self, conn):
+        with conn:
+            while True:
+                header = conn.recv(2)
+                if len(header) < 2:
+                    return
+                n = int.from_bytes(header, "big")
+                wire = b""
+                while len(wire) < n:
+                    chunk = conn.recv(n - len(wire))
+                    if not chunk:
+                        return
+                    wire += chunk
+                if self.latency:
+                    time.sleep(self.latency)
+                response = self.answer(wire)
+                if response is None:
+                    return
+                conn.sendall(len(response).to_bytes(2, "big") + response)
+
+    @property
+    def queries(self) -> int:
+        return self._counter.value
+
+    def close(self):
+        self.udp.close()
+        self.tcp.close()
+        self._pool.shutdown(wait=False)
+
+
+def _serve_dns_process(conn, latency: float, loss: float, counter, first_query):
+    """Child process body: run a FakeDNSServer until the parent says stop on ``conn``."""
+    server = FakeDNSServer(latency, loss, counter, first_query)
+    conn.send(server.port)
+    with contextlib.suppress(EOFError):
+        conn.recv()
+    server.close()
+
+
+class DNSServerProcess:
+    """A FakeDNSServer in a child process, so it does not compete with dnstool for the GIL."""
+
+    def __init__(self, latency: float = 0.0, loss: float = 0.0):
+        self._counter = multiprocessing.Value("q", 0)
+        self.first_query = multiprocessing.Value("d", 0.0)
+        self._conn, child = multiprocessing.Pipe()
+        self._proc = multiprocessing.Process(target=_serve_dns_process,
+                                             args=(child, latency, loss, self._counter, self.first_query),
+                                             daemon=True)
+        self._proc.start()
+        self.port = self._conn.recv()
+
+    @property
+    def queries(self) -> int:
+        return self._counter.value
+
+    def close(self):
+        with contextlib.suppress(OSError):
+            self._conn.send(None)
+        self._conn.close()
+        self._proc.join(timeout=5)
+        if self._proc.is_alive():
+            self._proc.terminate()
+
+
+class _BenchHTTPHandler(BaseHTTPRequestHandler):
+    """Serves RDAP ``/domain/<name>`` and ``/<name>/.well-known/mta-sts.txt``."""
+
+    protocol_version = "HTTP/1.1"
+
+    def do_GET(self):
+        parts = self.path.strip("/").split("/")
+        if len(parts) == 2 and parts[0] == "domain":
+            body = json.dumps({
+                "objectClassName": "domain",
+                "ldhName": parts[1],
+                "entities": [{"roles": ["registrar"], "vcardArray": ["vcard", [["fn", {}, "text", "Bench Registrar"]]]}],
+            }).encode()
+            ctype = "application/rdap+json"
+        elif parts[1:] == [".well-known", "mta-sts.txt"]:
+            body = f"version: STSv1\nmode: enforce\nmx: mail.{parts[0]}\nmax_age: 86400\n".encode()
+            ctype = "text/plain"
+        else:
+            self.send_error(404)
+            return
+        self.send_response(200)
+        self.send_header("Content-Type", ctype)
+        self.send_header("Content-Length", str(len(body)))
+        self.end_headers()
+        self.wfile.write(body)
+
+    def log_message(self, *args):
+        pass
+
+
+def _start_http(tls_context=None) -> ThreadingHTTPServer:
+    """Start the RDAP/MTA-STS stand-in, over TLS if ``tls_context`` is given."""
+    httpd = ThreadingHTTPServer(("127.0.0.1", 0), _BenchHTTPHandler)
+    httpd.daemon_threads = True
+    if tls_context is not None:
+        httpd.socket = tls_context.wrap_socket(httpd.socket, server_side=True)
+    threading.Thread(target=httpd.serve_forever, kwargs={"poll_interval": 0.05}, daemon=True).start()
+    return httpd
+
+
+def _self_signed_cert(directory: str):
+    """Return ``(cert, key)`` paths of a fresh certificate for 127.0.0.1, or ``None`` without openssl."""
+    if shutil.which("openssl") is None:
+        return None
+    cert, key = os.path.join(directory, "cert.pem"), os.path.join(directory, "key.pem")
+    subprocess.run(["openssl", "req", "-x509", "-newkey", "rsa:2048", "-nodes", "-days", "1",
+                    "-subj", "/CN=127.0.0.1", "-addext", "subjectAltName=IP:127.0.0.1",
+                    "-keyout", key, "-out", cert], check=True, capture_output=True)
+    return cert, key
+
+
+@contextlib.contextmanager
+def _patched(module, **values):
+    """Temporarily set attributes of ``module``."""
+    old = {name: getattr(module, name) for name in values}
+    for name, value in values.items():
+        setattr(module, name, value)
+    try:
+        yield
+    finally:
+        for name, value in old.items():
+            setattr(module, name, value)
+
+
+def percentile(values, pct: float) -> float:
+    """Return the nearest-rank ``pct`` percentile of ``values``."""
+    if not values:
+        return 0.0
+    ordered = sorted(values)
+    return ordered[max(0, math.ceil(pct / 100 * len(ordered)) - 1)]
+
+
+class BenchEnvironment:
+    """The stand-in servers plus the dnstool settings that point at them."""
+
+    def __init__(self, latency: float = 0.0, loss: float = 0.0):
+        self._tmp = tempfile.TemporaryDirectory(prefix="dnstool-bench-")
+        self.cache_dir = os.path.join(self._tmp.name, "cache")
+        self.dns = DNSServerProcess(latency, loss)
+        self.rdap = _start_http()
+        cert = _self_signed_cert(self._tmp.name)
+        if cert is not None:
+            import ssl
+            ctx = ssl.SSLContext(ssl.PROTOCOL_TLS_SERVER)
+            ctx.load_cert_chain(*cert)
+            self.mta_sts = _start_http(ctx)
+            self.ca_bundle, scheme = cert[0], "https"
+        else:
+            self.mta_sts = _start_http()
+            self.ca_bundle, scheme = None, "http"
+        self.mta_sts_url = f"{scheme}://127.0.0.1:{self.mta_sts.server_address[1]}/{{domain}}/.well-known/mta-sts.txt"
+
+    @contextlib.contextmanager
+    def configured(self, **extra):
+        """Point dnstool at the stand-ins, with fresh caches, for the duration of the block."""
+        env_ca = os.environ.get("REQUESTS_CA_BUNDLE")
+        if self.ca_bundle:
+            os.environ["REQUESTS_CA_BUNDLE"] = self.ca_bundle
+        try:
+            with _patched(
+                dnstool,
+                RESOLVERS=[f"dns://127.0.0.1:{self.dns.port}"],
+                QUERY_CACHE=dnstool.QueryCache(),
+                _HEALTH={},
+                _DKIM_HITS={},
+                IANA_RDAP_MAP={BENCH_TLD: [f"http://127.0.0.1:{self.rdap.server_address[1]}/"]},
+                _IANA_RDAP_LOADED=True,
+                RDAP_CACHE_MAX_AGE=0,
+                RDAP_RATE=1e9,
+                _RDAP_BUCKETS={},
+                MTA_STS_URL=self.mta_sts_url,
+                OUTPUT_FORMAT="text",
+                RESULTS_STORE=None,
+                SNAPSHOT_STORE=None,
+                **extra,
+            ):
+                yield
+        finally:
+            if self.ca_bundle:
+                if env_ca is None:
+                    os.environ.pop("REQUESTS_CA_BUNDLE", None)
+                else:
+                    os.environ["REQUESTS_CA_BUNDLE"] = env_ca
+
+    def close(self):
+        self.dns.close()
+        self.rdap.shutdown()
+        self.mta_sts.shutdown()
+        self._tmp.cleanup()
+
+
+def run_scenario(env: BenchEnvironment, scenario: str, domains: list, jobs: int = 1) -> dict:
+    """Check ``domains`` with ``scenario`` against ``env`` and return its measurements."""
+    latencies = []
+    check = dnstool.run_all_checks
+
+    def timed(domain, authoritative=False):
+        start = time.perf_counter()
+        try:
+            return check(domain, authoritative)
+        finally:
+            latencies.append(time.perf_counter() - start)
+
+    queries_before = env.dns.queries
+    sizes = {name: getattr(dnstool, name) for name in POOL_SIZES}
+    with env.configured(run_all_checks=timed, JOBS=jobs, STATS=dnstool.Stats(), _CHECK_POOL=None, _DKIM_POOL=None,
+                        _WAVE_POOL=None, _HEDGE_POOL=None, _AUTHORITATIVE_POOL=None, _RESOLVER_SLOTS={}, **sizes), \
+            open(os.devnull, "w") as devnull, contextlib.redirect_stdout(devnull):
+        dnstool._size_pools(jobs)
+        start = time.perf_counter()
+        if scenario == "batch":
+            dnstool._run_parallel_batch(iter(domains), jobs)
+        else:
+            for dm in domains:
+                dnstool.run_all_checks(dm)
+        elapsed = time.perf_counter() - start
+        checks = {label: h.total / h.count for (kind, label), h in dnstool.STATS.histograms.items()
+                  if kind == "check" and h.count}
+    queries = env.dns.queries - queries_before
+    slowest = max(checks, key=checks.get)
+    return {
+        "scenario": scenario,
+        "domains": len(domains),
+        "jobs": jobs if scenario == "batch" else 1,
+        "seconds": elapsed,
+        "domains_per_sec": len(domains) / elapsed if elapsed else 0.0,
+        "queries": queries,
+        "queries_per_sec": queries / elapsed if elapsed else 0.0,
+        "queries_per_domain": queries / len(domains) if domains else 0.0,
+        "p50_ms": percentile(latencies, 50) * 1000,
+        "p95_ms": percentile(latencies, 95) * 1000,
+        "p99_ms": percentile(latencies, 99) * 1000,
+        "slowest_check": slowest,
+        "slowest_check_ms": checks[slowest] * 1000,
+        "median_check_ms": percentile(list(checks.values()), 50) * 1000,
+    }
+
+
+def run_startup(env: BenchEnvironment, runs: int = 10) -> dict:
+    """Launch ``dnstool.py`` ``runs`` times and time each cold start to its first DNS query."""
+    script = os.path.join(os.path.dirname(os.path.abspath(__file__)), "dnstool.py")
+    child_env = dict(os.environ, XDG_CACHE_HOME=env.cache_dir)
+    samples = []
+    for i in range(runs):
+        env.dns.first_query.value = 0.0
+        start = time.time()
+        proc = subprocess.Popen([sys.executable, script, "-r", f"dns://127.0.0.1:{env.dns.port}",
+                                 bench_domains(1, offset=i)[0]],
+                                stdin=subprocess.DEVNULL, stdout=subprocess.DEVNULL, stderr=subprocess.DEVNULL,
+                                env=child_env)
+        try:
+            while not env.dns.first_query.value:
+                if proc.poll() is not None or time.time() - start > STARTUP_TIMEOUT:
+                    raise RuntimeError("dnstool exited or stalled before sending a DNS query")
+                time.sleep(0.0005)
+            samples.append(env.dns.first_query.value - start)
+        finally:
+            proc.kill()
+            proc.wait()
+    return {
+        "scenario": "startup",
+        "runs": runs,
+        "min_ms": min(samples) * 1000,
+        "p50_ms": percentile(samples, 50) * 1000,
+        "p95_ms": percentile(samples, 95) * 1000,
+    }
+
+
+def format_result(r: dict) -> str:
+    """Return one human-readable line for a scenario result."""
+    if r["scenario"] == "startup":
+        return (f"{r['scenario']:<7} {r['runs']:>5} runs     first query after  "
+                f"min {r['min_ms']:7.1f} ms  p50 {r['p50_ms']:7.1f} ms  p95 {r['p95_ms']:7.1f} ms")
+    return (f"{r['scenario']:<7} {r['domains']:>5} domains  jobs {r['jobs']:<3} "
+            f"{r['domains_per_sec']:8.1f} domains/s  {r['queries_per_sec']:9.1f} queries/s  "
+            f"p50 {r['p50_ms']:7.1f} ms  p95 {r['p95_ms']:7.1f} ms  p99 {r['p99_ms']:7.1f} ms  "
+            f"slowest check {r['slowest_check']} {r['slowest_check_ms']:.1f} ms (median {r['median_check_ms']:.1f} ms)")
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description="Benchmark DNS Tool against local stand-in servers.")
+    parser.add_argument("-n", "--domains", type=int, default=100, help="Synthetic domains per scenario")
+    parser.add_argument("-j", "--jobs", type=int, default=16, help="Parallel domains in the batch scenario")
+    parser.add_argument("--latency-ms", type=float, default=1.0, help="Added latency per DNS answer")
+    parser.add_argument("--loss", type=float, default=0.0, help="Fraction of UDP queries to drop")
+    parser.add_argument("--scenario", choices=SCENARIOS + ("all",), default="all", help="What to run")
+    parser.add_argument("--json", action="store_true", help="Print results as JSON lines")
+    parser.add_argument("--min-rate", type=float, default=0.0,
+                        help="Exit non-zero if any scenario checks fewer domains/sec than this")
+    parser.add_argument("--startup-runs", type=int, default=10, help="Process launches in the startup scenario")
+    parser.add_argument("--max-startup-ms", type=float, default=STARTUP_BUDGET_MS,
+                        help="Exit non-zero if the median cold start to first query is slower than this (0 disables)")
+    parser.add_argument("--max-queries-per-domain", type=float, default=QUERY_BUDGET_PER_DOMAIN,
+                        help="Exit non-zero if any scenario sends more DNS queries per domain than this (0 disables)")
+    args = parser.parse_args(argv)
+    logging.getLogger().setLevel(logging.CRITICAL)
+
+    env = BenchEnvironment(args.latency_ms / 1000, args.loss)
+    scenarios = SCENARIOS if args.scenario == "all" else (args.scenario,)
+    results = []
+    try:
+        for n, scenario in enumerate(scenarios):
+            if scenario == "startup":
+                result = run_startup(env, args.startup_runs)
+            else:
+                domains = bench_domains(args.domains, offset=n * args.domains)
+                result = run_scenario(env, scenario, domains, args.jobs)
+            results.append(result)
+            print(json.dumps(result) if args.json else format_result(result), flush=True)
+    finally:
+        env.close()
+    if any(r.get("domains_per_sec", args.min_rate) < args.min_rate for r in results):
+        sys.exit(1)
+    if args.max_startup_ms and any(r.get("p50_ms", 0.0) > args.max_startup_ms
+                                   for r in results if r["scenario"] == "startup"):
+        sys.exit(1)
+    if args.max_queries_per_domain and any(r.get("queries_per_domain", 0.0) > args.max_queries_per_domain
+                                           for r in results):
+        sys.exit(1)
+
+
+if __name__ == "__main__":
+    main()
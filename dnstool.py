@@ -1,721 +1,3005 @@
 #!/usr/bin/env python3
-  """
-  DNS Tool (Python Edition) + Prompt Toolkit arrow-key history
-  - Now using prompt_toolkit.formatted_text.ANSI for the domain prompt,
-    so \033[1m etc. are correctly interpreted instead of printing ^[[1m.
-  """
-  __version__ = "1.3.0"
-
-  import sys
-  import argparse
-  import os
-  import re
-  import subprocess
-  from pathlib import Path
-  import logging
-  import shutil
-
-  try:
-      import requests
-  except ImportError:  # pragma: no cover - environment lacks requests
-      print("Error: the 'requests' package is required.\nInstall it with 'pip install requests'.")
-      sys.exit(1)
-
-  try:
-      import dns.resolver
-      import dns.reversename
-      import dns.rdatatype
-      import dns.flags
-  except ImportError:  # pragma: no cover - environment lacks dnspython
-      print("Error: the 'dnspython' package is required.\nInstall it with 'pip install dnspython'.")
-      sys.exit(1)
-
-  try:
-      import idna
-      HAS_IDNA = True
-  except ImportError:
-      HAS_IDNA = False
-
-  try:
-      from prompt_toolkit import PromptSession
-      from prompt_toolkit.history import FileHistory
-      from prompt_toolkit.formatted_text import ANSI
-  except ImportError:  # pragma: no cover - environment lacks prompt_toolkit
-      print("Error: the 'prompt_toolkit' package is required.\nInstall it with 'pip install prompt_toolkit'.")
-      sys.exit(1)
-
-  RED = "\033[0;31m"
-  GREEN = "\033[0;32m"
-  YELLOW = "\033[1;33m"
-  BLUE = "\033[0;34m"
-  BOLD = "\033[1m"
-  NC = "\033[0m"
-
-  SYM_OK = "✅"
-  SYM_ERR = "❌"
-  SYM_WARN = "⚠️"
-
-  DNS_TIME = 3
-  DNS_TRIES = 2
-  RESOLVER_1 = "1.1.1.1"
-  RESOLVER_2 = "8.8.8.8"
-  RESOLVER_3 = "9.9.9.9"
-  DEFAULT_RESOLVERS = [RESOLVER_1, RESOLVER_2, RESOLVER_3]
-  RESOLVERS = DEFAULT_RESOLVERS.copy()
-
-  AUTHORITATIVE = False
-
-  DOMAIN_HISTORY_FILE = os.path.expanduser("~/.domain_history_rdap_interactive")
-  VERBOSE = False
-  IANA_RDAP_MAP = {}
-
-  logging.basicConfig(level=logging.ERROR, format="%(levelname)s: %(message)s")
-
-
-  def domain_to_ascii(domain: str) -> str:
-      """Convert Unicode domain names to ASCII using IDNA."""
-      domain = domain.rstrip(".")
-      if HAS_IDNA:
-          try:
-              return idna.encode(domain).decode("ascii")
-          except idna.IDNAError:
-              pass
-      return domain
-
-  def validate_domain(d: str) -> bool:
-      """Return ``True`` if ``d`` looks like a valid domain name."""
-      pattern = r"^[A-Za-z0-9._-]+\.[A-Za-z0-9-]{2,}$"
-      if not d or d.startswith(".") or d.endswith(".") or d.endswith("-"):
-          print(f"{SYM_ERR} {RED}Invalid domain:{NC} {d}")
-          return False
-      if not re.match(pattern, d):
-          print(f"{SYM_ERR} {RED}Invalid domain:{NC} {d}")
-          return False
-      return True
-
-  def whois_lookup_registrar(domain: str) -> str:
-      """Return registrar name using the ``whois`` command."""
-      if not shutil.which("whois"):
-          return ""
-      try:
-          out = subprocess.check_output(["whois", domain], stderr=subprocess.DEVNULL, timeout=5)
-          lines = out.decode(errors="replace").splitlines()
-          for ln in lines:
-              if re.search(r"(?i)registrar:", ln) or re.search(r"(?i)sponsoring registrar:", ln):
-                  parts = ln.split(":", 1)
-                  if len(parts) == 2:
-                      return parts[1].strip()
-          return ""
-      except subprocess.TimeoutExpired:
-          return ""
-      except Exception:
-          return ""
-
-  def fetch_iana_rdap_data():
-      """Populate ``IANA_RDAP_MAP`` with TLD to RDAP endpoint mappings."""
-      global IANA_RDAP_MAP
-      url = "https://data.iana.org/rdap/dns.json"
-      try:
-          r = requests.get(url, timeout=5)
-          r.raise_for_status()
-          j = r.json()
-          for svc in j.get("services", []):
-              if len(svc) != 2:
-                  continue
-              tlds, endpoints = svc
-              if tlds and endpoints:
-                  for tld in tlds:
-                      IANA_RDAP_MAP[tld.lower()] = endpoints
-      except Exception as e:
-          logging.error("Failed to fetch IANA RDAP data: %s", e)
-
-  def get_tld(domain: str) -> str:
-      """Return the top-level domain from ``domain`` in lowercase."""
-      return domain.rsplit(".", 1)[-1].lower()
-
-  def rdap_lookup(domain: str) -> dict:
-      """Return RDAP JSON data for ``domain`` using IANA endpoints."""
-      t = get_tld(domain)
-      endpoints = IANA_RDAP_MAP.get(t, [])
-      for ep in endpoints:
-          url = f"{ep.rstrip('/')}/domain/{domain}"
-          try:
-              resp = requests.get(url, timeout=5)
-              if resp.status_code < 400:
-                  data = resp.json()
-                  if "errorCode" not in data:
-                      return data
-          except Exception as e:
-              logging.error("RDAP lookup error: %s", e)
-      url = f"https://rdap.org/domain/{domain}"
-      try:
-          resp = requests.get(url, timeout=5)
-          if resp.status_code < 400:
-              data = resp.json()
-              if "errorCode" not in data:
-                  return data
-      except Exception as e:
-          logging.error("RDAP fallback lookup error: %s", e)
-      return {}
-
-  def dns_query(rdtype, domain):
-      """Query ``domain`` for record type ``rdtype`` using several resolvers."""
-      if not domain or not rdtype:
-          return []
-      for r in RESOLVERS:
-          resolver = dns.resolver.Resolver(configure=False)
-          resolver.nameservers = [r]
-          resolver.timeout = DNS_TIME
-          resolver.lifetime = DNS_TIME * DNS_TRIES
-          try:
-              ans = resolver.resolve(domain, rdtype)
-              out = [str(rr) for rr in ans]
-              if out:
-                  return out
-          except Exception as e:
-              logging.error("DNS query error: %s", e)
-      return []
-
-
-  def _resolve_ns_ips(ns_hosts):
-      """Resolve A and AAAA records for a list of nameserver hostnames."""
-      ns_ips = []
-      for host in ns_hosts:
-          h = host.rstrip(".")
-          ns_ips.extend(dns_query("A", h))
-          ns_ips.extend(dns_query("AAAA", h))
-      return ns_ips
-
-
-  def _query_authoritative(ns_ip, domain, rdtypes, results):
-      """Query a single authoritative nameserver for all record types."""
-      resolver = dns.resolver.Resolver(configure=False)
-      resolver.nameservers = [ns_ip]
-      resolver.timeout = DNS_TIME
-      resolver.lifetime = DNS_TIME * DNS_TRIES
-      for typ in rdtypes:
-          try:
-              ans = resolver.resolve(domain, typ)
-              for rr in [str(r) for r in ans]:
-                  if rr not in results[typ]:
-                      results[typ].append(rr)
-          except Exception as e:  # pragma: no cover - network dependent
-              logging.error("Authoritative DNS query error: %s", e)
-
-
-  def authoritative_lookup(domain: str, rdtypes=None) -> dict:
-      """Return DNS records queried directly from authoritative nameservers."""
-      if rdtypes is None:
-          rdtypes = ("A", "AAAA", "MX", "TXT")
-      results = {t: [] for t in rdtypes}
-      ns_hosts = dns_query("NS", domain)
-      if not ns_hosts:
-          return results
-      ns_ips = _resolve_ns_ips(ns_hosts)
-      for ip in ns_ips:
-          _query_authoritative(ip, domain, rdtypes, results)
-      return results
-
-
-  def print_authoritative_results(domain: str, rdtypes=None):
-      """Display a concise Authoritative result block."""
-      records = authoritative_lookup(domain, rdtypes)
-      print(f"\n{BLUE}🔍 Authoritative result:{NC}")
-      for typ in records:
-          data = records[typ]
-          if data:
-              print(f"{SYM_OK} {typ}: {', '.join(data)}")
-          else:
-              print(f"{SYM_ERR} {typ}: none")
-
-
-  def _extract_registrar_from_rdap(rdap_data: dict) -> str:
-      """Extract registrar name from RDAP response entities."""
-      entities = rdap_data.get("entities", [])
-      for ent in entities:
-          roles = ent.get("roles", [])
-          if not roles or "registrar" not in [r.lower() for r in roles]:
-              continue
-          name = _extract_vcard_fn(ent)
-          if not name:
-              name = ent.get("handle") or ent.get("name") or ""
-          if name:
-              return name
-      return ""
-
-
-  def _extract_vcard_fn(entity: dict) -> str:
-      """Extract the 'fn' field from an RDAP entity vCard."""
-      vcard = entity.get("vcardArray", [])
-      if len(vcard) != 2 or not isinstance(vcard[1], list):
-          return ""
-      for item in vcard[1]:
-          if len(item) == 4 and item[0] == "fn":
-              return item[3]
-      return ""
-
-
-  def _print_registrar(registrar_name: str, domain: str):
-      """Print registrar information, falling back to WHOIS if needed."""
-      if registrar_name.isdigit():
-          fw = whois_lookup_registrar(domain)
-          if fw:
-              label = f"Registrar (WHOIS fallback): {GREEN}{fw}{NC}"
-          else:
-              label = f"Registrar (RDAP handle): {YELLOW}{registrar_name}{NC}"
-          print(f"{SYM_OK} {label}")
-      else:
-          print(f"{SYM_OK} Registrar (RDAP): {GREEN}{registrar_name}{NC}")
-
-
-  def get_registrar(domain: str):
-      """Print registrar information obtained via RDAP or WHOIS."""
-      print(f"\n{BLUE}🔍 Registrar & RDAP Info:{NC}")
-      rdap_data = rdap_lookup(domain)
-      if not rdap_data:
-          print(f"{SYM_WARN} No RDAP data. Checking WHOIS...")
-          w = whois_lookup_registrar(domain)
-          if w:
-              print(f"{SYM_OK} Registrar (WHOIS fallback): {GREEN}{w}{NC}")
-          else:
-              print(f"{SYM_ERR} {RED}No registrar found (RDAP/WHOIS both empty).{NC}")
-          return
-
-      registrar_name = _extract_registrar_from_rdap(rdap_data)
-      if not registrar_name:
-          print(f"{SYM_WARN} Registrar not found in RDAP. Checking WHOIS...")
-          fb = whois_lookup_registrar(domain)
-          if fb:
-              print(f"{SYM_OK} Registrar (WHOIS fallback): {GREEN}{fb}{NC}")
-          else:
-              print(f"{SYM_ERR} {RED}No registrar found in RDAP or WHOIS.{NC}")
-          return
-      _print_registrar(registrar_name, domain)
-
-
-  def _classify_dns_records(records, valid_prefix, label):
-      """Classify DNS TXT records into valid and invalid categories."""
-      valid_lines = []
-      invalid_lines = []
-      for line in records:
-          low = line.lower()
-          if valid_prefix in low:
-              valid_lines.append(line)
-          elif label in low:
-              invalid_lines.append(line)
-      return valid_lines, invalid_lines
-
-
-  def _print_no_valid_record(invalid_lines, record_type):
-      """Print messaging when no valid record is found."""
-      if invalid_lines:
-          print(f"{SYM_WARN} Found {len(invalid_lines)} '{record_type}-like' line(s) that are not valid. "
-                f"{SYM_ERR} Required for mail deliverability and DMARC compliance.:\n")
-          for s in invalid_lines:
-              print(f'   "{s}"')
-          print(f"{SYM_ERR} No valid {record_type.upper()} record. (These appear incorrect.) "
-                f"{SYM_ERR} Required for mail deliverability and DMARC compliance.")
-      else:
-          print(f"{SYM_ERR} No {record_type.upper()} record found. "
-                f"({SYM_ERR} Required for mail deliverability and DMARC compliance.)")
-
-
-  def get_spf_record(domain: str):
-      """Display the SPF record for ``domain`` if present."""
-      print(f"\n{BLUE}🔍 SPF (Sender Policy Framework):{NC}")
-      all_txt = dns_query("TXT", domain)
-      if not all_txt:
-          print(f"{SYM_ERR} No TXT => no SPF record! ({SYM_ERR} Required for mail deliverability and DMARC compliance.)")
-          return
-      valid_spf_lines, spfish_lines = _classify_dns_records(all_txt, "v=spf1", "spf")
-      count_valid = len(valid_spf_lines)
-      if count_valid == 0:
-          _print_no_valid_record(spfish_lines, "spf")
-      elif count_valid == 1:
-          print(f'{SYM_OK} SPF found => "Good, there is only one!"')
-          print(valid_spf_lines[0])
-      else:
-          print(f'{SYM_WARN} Multiple valid SPF lines => "There can be only one!"\n')
-          for s in valid_spf_lines:
-              print(f"   {s}")
-
-
-  def _print_dmarc_policy(line: str):
-      """Print the DMARC policy assessment for a single valid record."""
-      lowered = line.lower()
-      if "p=none" in lowered:
-          print(f'{SYM_WARN} DMARC p=none => "Your work\'s not done!"')
-      elif "p=reject" in lowered:
-          print(f"{SYM_OK} DMARC p=reject => Great anti-spoof!")
-      elif "p=quarantine" in lowered:
-          print(f"{SYM_OK} DMARC p=quarantine => Not as strong as reject, but still good!")
-      else:
-          print(f"{SYM_OK} DMARC record found (p=?).")
-      print(line)
-
-
-  def get_dmarc_record(domain: str):
-      """Display the DMARC policy for ``domain``."""
-      print(f"\n{BLUE}🔍 DMARC:{NC}")
-      recs = dns_query("TXT", f"_dmarc.{domain}")
-      if not recs:
-          print(f"{SYM_ERR} No DMARC record found. (Helps prevent spoofing. Required for mail deliverability.)")
-          return
-      valid_dmarc_lines, dmarc_like = _classify_dns_records(recs, "v=dmarc1", "dmarc")
-      count_valid = len(valid_dmarc_lines)
-      if count_valid == 0:
-          if dmarc_like:
-              print(f"{SYM_WARN} Found DMARC-like lines, but not 'v=DMARC1':\n")
-              for x in dmarc_like:
-                  print(f'   "{x}"')
-              print(f"{SYM_ERR} No valid DMARC record (these appear incorrect). "
-                    f"{SYM_ERR} Required for mail deliverability and DMARC compliance.")
-          else:
-              print(f"{SYM_ERR} No valid DMARC record found. (Required for mail deliverability.)")
-      elif count_valid > 1:
-          print(f'{SYM_WARN} Multiple DMARC lines => "There can be only one!"\n')
-          for x in valid_dmarc_lines:
-              print(f"   {x}")
-      else:
-          _print_dmarc_policy(valid_dmarc_lines[0])
-
-  def get_dkim_record(domain: str):
-      """Check common DKIM selectors for ``domain``."""
-      print(f"\n{BLUE}🔍 DKIM (common selectors):{NC}")
-      sels = ["default._domainkey", "google._domainkey", "selector1._domainkey", "selector2._domainkey"]
-      found_any = False
-      for s in sels:
-          recs = dns_query("TXT", f"{s}.{domain}")
-          if recs:
-              print(f"   {SYM_OK} DKIM at {s}")
-              for rr in recs:
-                  print(f"   {rr}")
-              found_any = True
-      if not found_any:
-          print(f"{SYM_WARN} No DKIM found among default selectors.")
-
-  def get_dane_records(domain: str):
-      """Display DANE TLSA records for SMTP and HTTPS."""
-      print(f"\n{BLUE}🔍 DANE (TLSA):{NC}")
-      s25 = dns_query("TLSA", f"_25._tcp.{domain}")
-      if s25:
-          print(f"{SYM_OK} SMTP TLSA found:")
-          for rr in s25:
-              print(rr)
-      else:
-          print(f"{SYM_ERR} No SMTP TLSA record (port 25).")
-      s443 = dns_query("TLSA", f"_443._tcp.{domain}")
-      if s443:
-          print(f"{SYM_OK} HTTPS TLSA found:")
-          for rr in s443:
-              print(rr)
-      else:
-          print(f"{SYM_ERR} No HTTPS TLSA record (port 443).")
-
-  def get_bimi_record(domain: str):
-      """Show BIMI TXT records for ``domain``."""
-      print(f"\n{BLUE}🔍 BIMI:{NC}")
-      recs = dns_query("TXT", f"default._bimi.{domain}")
-      if recs:
-          print(f"{SYM_OK} BIMI found:")
-          for rr in recs:
-              print(rr)
-      else:
-          print(f"{SYM_ERR} No default._bimi record.")
-
-  def get_mta_sts(domain: str):
-      """Check MTA-STS TXT record and policy file."""
-      print(f"\n{BLUE}🔍 MTA-STS:{NC}")
-      txt = dns_query("TXT", f"_mta-sts.{domain}")
-      if txt:
-          print(f'{SYM_OK} _mta-sts.{domain} TXT => "{txt[0]}"')
-      else:
-          print(f"{SYM_ERR} No _mta-sts.{domain} TXT record.")
-      url = f"https://mta-sts.{domain}/.well-known/mta-sts.txt"
-      print(f"   Checking policy file: {url}")
-      try:
-          r = requests.get(url, timeout=5)
-          if r.status_code == 200:
-              print(f"   {SYM_OK} Policy file found (HTTP 200).")
-          else:
-              print(f"   {SYM_ERR} No policy file (HTTP {r.status_code}).")
-      except Exception as e:
-          logging.error("MTA-STS policy fetch error: %s", e)
-          print(f"   {SYM_ERR} No policy file (HTTP 000).")
-
-  def get_dnssec_status(domain: str):
-      """Check whether DNSSEC signatures are present."""
-      print(f"\n{BLUE}🔍 DNSSEC:{NC}")
-      resolver = dns.resolver.Resolver(configure=False)
-      resolver.nameservers = [RESOLVERS[0]]
-      resolver.use_edns(0, dns.flags.DO, 1232)
-      resolver.timeout = DNS_TIME
-      resolver.lifetime = DNS_TIME * DNS_TRIES
-      try:
-          ans = resolver.resolve(domain, "A", raise_on_no_answer=False)
-          if ans.response and any(rr.rdtype == dns.rdatatype.RRSIG for rr in ans.response.answer):
-              print(f"{SYM_OK} DNSSEC signatures present (RRSIG).")
-          else:
-              print(f"{SYM_ERR} DNSSEC not detected or not validated.")
-      except Exception as e:
-          logging.error("DNSSEC check error: %s", e)
-          print(f"{SYM_ERR} DNSSEC not detected or no A record to check.")
-
-  def get_ns_records(domain: str):
-      """Display NS records for ``domain``."""
-      print(f"\n{BLUE}🔍 NS Records:{NC}")
-      recs = dns_query("NS", domain)
-      if recs:
-          print(f"{SYM_OK} Found NS:")
-          for rr in recs:
-              print(rr)
-      else:
-          print(f"{SYM_ERR} No NS records found.")
-
-  def get_mx_records(domain: str):
-      """Show MX records and flag deprecated Google lines."""
-      print(f"\n{BLUE}🔍 MX Records:{NC}")
-      mx_out = dns_query("MX", domain)
-      if not mx_out:
-          print(f"{SYM_ERR} No MX records found.\n{RED}(Likely why email is failing—this is big trouble!){NC}")
-          return
-      print(f"{SYM_OK} Found MX:")
-      for line in mx_out:
-          print(f"   {line}")
-      uses_aspmx2 = any("aspmx2.googlemail.com" in x.lower() for x in mx_out)
-      uses_aspmx3 = any("aspmx3.googlemail.com" in x.lower() for x in mx_out)
-      if uses_aspmx2 or uses_aspmx3:
-          print(f"{SYM_WARN} We see older Google MX lines (aspmx2/aspmx3).")
-          print("   Google's newer recommended config typically does not need them.")
-          print("   For Google Workspace, recommended lines are more like smtp.google.com / altX.")
-
-  def get_txt_records(domain: str):
-      """Print all TXT records for ``domain``."""
-      print(f"\n{BLUE}🔍 TXT Records:{NC}")
-      out = dns_query("TXT", domain)
-      if not out:
-          print(f"{SYM_ERR} No TXT records found.")
-      else:
-          print(f"{SYM_OK} Found TXT:")
-          for rr in out:
-              print(f'"{rr}"')
-
-  def get_a_record(domain: str):
-      """Display the A record (IPv4) for ``domain``."""
-      print(f"\n{BLUE}🔍 A (IPv4) Record:{NC}")
-      a = dns_query("A", domain)
-      if not a:
-          print(f"{SYM_ERR} No A record found.")
-      else:
-          print(f"{SYM_OK} Found A:")
-          for rr in a:
-              print(rr)
-
-  def get_aaaa_record(domain: str):
-      """Display the AAAA record (IPv6) for ``domain``."""
-      print(f"\n{BLUE}🔍 AAAA (IPv6) Record:{NC}")
-      out = dns_query("AAAA", domain)
-      if not out:
-          print(f"{SYM_ERR} No AAAA record found.")
-      else:
-          print(f"{SYM_OK} Found AAAA:")
-          for rr in out:
-              print(rr)
-
-  def get_caa_record(domain: str):
-      """Display CAA records if they exist."""
-      print(f"\n{BLUE}🔍 CAA (Certificate Authority Authorization):{NC}")
-      out = dns_query("CAA", domain)
-      if not out:
-          print(f"{SYM_WARN} No CAA record found. (Optional but recommended to limit cert issuers.)")
-      else:
-          print(f"{SYM_OK} Found CAA:")
-          for rr in out:
-              print(rr)
-
-  def get_soa_record(domain: str):
-      """Show the SOA record for ``domain``."""
-      print(f"\n{BLUE}🔍 SOA (Start of Authority):{NC}")
-      recs = dns_query("SOA", domain)
-      if recs:
-          print(f"{SYM_OK} Found SOA:")
-          for rr in recs:
-              print(rr)
-      else:
-          print(f"{SYM_ERR} No SOA record found.")
-
-  def ptr_lookup(ip: str) -> list:
-      """Return PTR records for an IPv4 or IPv6 address."""
-      try:
-          rev_name = dns.reversename.from_address(ip)
-      except Exception as e:
-          logging.error("PTR lookup prepare error: %s", e)
-          return []
-      for r in RESOLVERS:
-          res = dns.resolver.Resolver(configure=False)
-          res.nameservers = [r]
-          res.timeout = DNS_TIME
-          res.lifetime = DNS_TIME * DNS_TRIES
-          try:
-              ans = res.resolve(rev_name, "PTR")
-              return [str(rr).rstrip(".") for rr in ans]
-          except Exception as e:
-              logging.error("PTR lookup error with resolver %s: %s", r, e)
-      return []
-
-
-  def _detect_mail_provider(domain: str) -> str:
-      """Detect if the domain uses Google or Microsoft mail infrastructure."""
-      mx_lc = [x.lower() for x in dns_query("MX", domain)]
-      txt_lc = [x.lower() for x in dns_query("TXT", domain)]
-      if any("google" in x for x in mx_lc) or any("_spf.google.com" in x for x in txt_lc):
-          return "Google"
-      if any("outlook" in x or "microsoft" in x for x in mx_lc) or \
-         any("spf.protection.outlook.com" in x for x in txt_lc):
-          return "Microsoft"
-      return ""
-
-
-  def get_ptr_record(domain: str):
-      """Resolve PTR records for all A records of ``domain``."""
-      a_recs = dns_query("A", domain)
-      if not a_recs:
-          print(f"\n{RED}No A record => no PTR check.{NC}")
-          return
-      provider = _detect_mail_provider(domain)
-      for ip in a_recs:
-          print(f"\n{BLUE}🔍 PTR for {ip}:{NC}")
-          ptrs = ptr_lookup(ip)
-          if ptrs:
-              for p in ptrs:
-                  print(p)
-          elif provider:
-              print(f"{SYM_OK} No PTR found, but domain likely on shared {provider} IP => normal.")
-          else:
-              print(f"{SYM_ERR} No PTR found for {ip}.")
-
-  def run_all_checks(domain: str, authoritative: bool = False):
-      """Run all DNS and RDAP checks for ``domain``."""
-      ascii_domain = domain_to_ascii(domain)
-      if not validate_domain(ascii_domain):
-          return
-
-      print(f"\n{BLUE}{'='*42}{NC}")
-      print(f"{BLUE}🔍 DNS / RDAP checks for:{NC} {YELLOW}{ascii_domain}{NC}")
-      print(f"{BLUE}{'='*42}{NC}")
-
-      if authoritative:
-          print_authoritative_results(ascii_domain)
-
-      get_registrar(ascii_domain)
-      get_ns_records(ascii_domain)
-      get_mx_records(ascii_domain)
-      get_txt_records(ascii_domain)
-      get_dmarc_record(ascii_domain)
-      get_spf_record(ascii_domain)
-      get_dkim_record(ascii_domain)
-      get_mta_sts(ascii_domain)
-      get_dane_records(ascii_domain)
-      get_bimi_record(ascii_domain)
-      get_dnssec_status(ascii_domain)
-      get_a_record(ascii_domain)
-      get_aaaa_record(ascii_domain)
-      get_caa_record(ascii_domain)
-      get_soa_record(ascii_domain)
-      get_ptr_record(ascii_domain)
-
-      print(f"\n{GREEN}✅ Done with {ascii_domain}.{NC}")
-
-  def load_domain_history():
-      """Return a list of previously used domains from history file."""
-      if not os.path.isfile(DOMAIN_HISTORY_FILE):
-          return []
-      lines = []
-      with open(DOMAIN_HISTORY_FILE, "r", encoding="utf-8", errors="ignore") as f:
-          for line in f:
-              line = line.strip()
-              if line and line not in lines:
-                  lines.append(line)
-      return lines
-
-  def append_domain_history(domain: str):
-      """Append ``domain`` to the domain history file."""
-      with open(DOMAIN_HISTORY_FILE, "a", encoding="utf-8") as f:
-          f.write(domain + "\n")
-
-
-  def _run_batch_mode(domain_list: list):
-      """Run DNS checks for a list of domains and exit."""
-      for dm in domain_list:
-          run_all_checks(dm, AUTHORITATIVE)
-      sys.exit(0)
-
-
-  def _run_interactive_mode():
-      """Run the interactive prompt loop for DNS checks."""
-      print(f"{YELLOW}Interactive Mode. Type a domain and press Enter to run checks immediately.{NC}")
-      print(f"{YELLOW}Type 'exit' or press Enter on a blank line to quit.{NC}")
-      Path(DOMAIN_HISTORY_FILE).touch(exist_ok=True)
-      session = PromptSession(history=FileHistory(DOMAIN_HISTORY_FILE))
-      while True:
-          try:
-              dom = session.prompt(ANSI(f"\n{BOLD}Domain:{NC} ")).strip()
-          except (EOFError, KeyboardInterrupt):
-              print("\nExiting DNS Tool...")
-              break
-          if not dom or dom.lower() == "exit":
-              print("Exiting DNS Tool...")
-              break
-          run_all_checks(dom, AUTHORITATIVE)
-          append_domain_history(dom)
-
-
-  def _collect_domains(args) -> list:
-      """Collect domains from file and/or command-line arguments."""
-      domain_list = []
-      if args.file:
-          if not os.path.isfile(args.file):
-              print(f"{RED}File not found:{NC} {args.file}")
-              sys.exit(1)
-          with open(args.file, "r", encoding="utf-8", errors="ignore") as f:
-              for line in f:
-                  line = line.strip()
-                  if line:
-                      domain_list.append(line)
-      if args.domains:
-          domain_list.extend(args.domains)
-      return domain_list
-
-
-  def main():
-      """Entry point for the command-line interface."""
-      global VERBOSE, RESOLVERS, AUTHORITATIVE
-      parser = argparse.ArgumentParser(
-          description="DNS Tool (Python Edition) + Prompt Toolkit arrow-key history, with ANSI prompt fix."
-      )
-      parser.add_argument("-v", "--verbose", action="store_true", help="Verbose/debug output")
-      parser.add_argument("-f", "--file", type=str, help="Read domains from file")
-      parser.add_argument("-r", "--resolver", action="append", help="Specify resolver IP (can be repeated)")
-      parser.add_argument("-a", "--authoritative", action="store_true", help="Query authoritative nameservers directly")
-      parser.add_argument("domains", nargs="*", help="Domains to check")
-      parser.add_argument('--version', action='version', version=__version__, help="show program's version number and exit")
-      args = parser.parse_args()
-
-      log_level = logging.ERROR if args.verbose else logging.CRITICAL
-      logging.getLogger().setLevel(log_level)
-
-      VERBOSE = args.verbose
-      if args.resolver:
-          RESOLVERS = args.resolver
-      AUTHORITATIVE = args.authoritative
-      fetch_iana_rdap_data()
-
-      domain_list = _collect_domains(args)
-      if domain_list:
-          _run_batch_mode(domain_list)
-      else:
-          _run_interactive_mode()
-
-  if __name__ == "__main__":
-      main()
-  
\ No newline at end of file
+"""
+DNS Tool (Python Edition) + Prompt Toolkit arrow-key history
+- Now using prompt_toolkit.formatted_text.ANSI for the domain prompt,
+  so \033[1m etc. are correctly interpreted instead of printing ^[[1m.
+"""
+__version__ = "1.3.0"
+
+import sys
+import argparse
+import bisect
+import contextlib
+import copy
+import hashlib
+import io
+import json
+import os
+import re
+import selectors
+import socket
+import ssl
+import threading
+import time
+from collections import OrderedDict
+from concurrent.futures import FIRST_COMPLETED, Future, ThreadPoolExecutor, as_completed, wait
+from concurrent.futures import TimeoutError as FutureTimeoutError
+from pathlib import Path
+import logging
+import sqlite3
+from http import HTTPStatus
+from urllib.parse import parse_qs, urlsplit
+
+# requests, prompt_toolkit, asyncio and http.server are imported by the
+# features that use them, so a batch run of DNS-only checks starts without
+# paying for modules it never touches.
+
+try:
+    import dns.resolver
+    import dns.reversename
+    import dns.rdatatype
+    import dns.flags
+    import dns.inet
+    import dns.nameserver
+    import dns.message
+    import dns.query
+    import dns.exception
+except ImportError:  # pragma: no cover - environment lacks dnspython
+    print("Error: the 'dnspython' package is required.\nInstall it with 'pip install dnspython'.")
+    sys.exit(1)
+
+try:
+    import idna
+    HAS_IDNA = True
+except ImportError:
+    HAS_IDNA = False
+
+RED = "\033[0;31m"
+GREEN = "\033[0;32m"
+YELLOW = "\033[1;33m"
+BLUE = "\033[0;34m"
+BOLD = "\033[1m"
+NC = "\033[0m"
+
+SYM_OK = "✅"
+SYM_ERR = "❌"
+SYM_WARN = "⚠️"
+
+DNS_TIME = 3
+DNS_TRIES = 2
+RESOLVER_1 = "1.1.1.1"
+RESOLVER_2 = "8.8.8.8"
+RESOLVER_3 = "9.9.9.9"
+DEFAULT_RESOLVERS = [RESOLVER_1, RESOLVER_2, RESOLVER_3]
+RESOLVERS = DEFAULT_RESOLVERS.copy()
+
+AUTHORITATIVE = False
+JOBS = 1
+OUTPUT_FORMAT = "text"
+OUTPUT_FORMATS = ("text", "jsonl")
+CHECK_NAMES = ("registrar", "ns", "mx", "txt", "dmarc", "spf", "dkim", "mta_sts", "dane", "bimi", "dnssec",
+               "a", "aaaa", "caa", "soa", "ptr")
+CHECK_PROFILES = {
+    "mail": ("mx", "spf", "dmarc", "dkim", "mta_sts", "dane", "bimi", "ptr"),
+    "dns": ("ns", "soa", "a", "aaaa", "txt", "caa", "dnssec"),
+    "registrar": ("registrar",),
+    "security": ("dmarc", "spf", "mta_sts", "dane", "dnssec", "caa"),
+}
+CHECKS = None
+# What each check looks up, as (kind, name) pairs. Upper-case kinds are DNS
+# record types, lower-case ones are other network calls. Names with a
+# placeholder depend on a first-wave answer: ``{a}`` and ``{ns}`` stand for
+# each address and nameserver host of the domain, ``{selector}`` for every
+# DKIM selector once ``_domainkey`` is known to exist.
+CHECK_LOOKUPS = {
+    "authoritative": (("NS", "{domain}"), ("A", "{ns}"), ("AAAA", "{ns}"), ("authoritative", "{domain}")),
+    "registrar": (("rdap", "{domain}"), ("whois", "{domain}")),
+    "ns": (("NS", "{domain}"),),
+    "mx": (("MX", "{domain}"),),
+    "txt": (("TXT", "{domain}"),),
+    "dmarc": (("TXT", "_dmarc.{domain}"),),
+    "spf": (("TXT", "{domain}"),),
+    "dkim": (("TXT", "_domainkey.{domain}"), ("TXT", "{selector}._domainkey.{domain}")),
+    "mta_sts": (("TXT", "_mta-sts.{domain}"), ("https", "mta-sts.{domain}")),
+    "dane": (("TLSA", "_25._tcp.{domain}"), ("TLSA", "_443._tcp.{domain}")),
+    "bimi": (("TXT", "default._bimi.{domain}"),),
+    "dnssec": (("dnssec", "{domain}"),),
+    "a": (("A", "{domain}"),),
+    "aaaa": (("AAAA", "{domain}"),),
+    "caa": (("CAA", "{domain}"),),
+    "soa": (("SOA", "{domain}"),),
+    "ptr": (("A", "{domain}"), ("PTR", "{a}"), ("MX", "{domain}"), ("TXT", "{domain}")),
+}
+INFLIGHT_PER_DOMAIN = 32
+MAX_INFLIGHT_PER_RESOLVER = INFLIGHT_PER_DOMAIN
+QUERY_CACHE_SIZE = 10000
+NEGATIVE_CACHE_TTL = 300
+MAX_IDLE_SOCKETS = 64
+QUERY_MODE = "sequential"
+QUERY_MODES = ("sequential", "hedged", "race")
+TRANSPORT = "udp"
+TRANSPORTS = ("udp", "dot", "doh")
+DOT_PORT = 853
+DOT_CONNECTIONS = 2
+DOH_CONNECTIONS = 4
+DOH_URLS = {
+    "1.1.1.1": "https://cloudflare-dns.com/dns-query",
+    "8.8.8.8": "https://dns.google/dns-query",
+    "9.9.9.9": "https://dns.quad9.net/dns-query",
+}
+DNS_TLS_CAFILE = None
+QUERY_OK = "ok"
+QUERY_NXDOMAIN = "nxdomain"
+QUERY_NOANSWER = "noanswer"
+QUERY_SERVFAIL = "servfail"
+QUERY_TIMEOUT = "timeout"
+QUERY_ERROR = "error"
+QUERY_FAILURES = (QUERY_SERVFAIL, QUERY_TIMEOUT, QUERY_ERROR)
+HEDGE_WORKERS_PER_DOMAIN = 128
+HEDGE_WORKERS = HEDGE_WORKERS_PER_DOMAIN
+AUTHORITATIVE_WORKERS_PER_DOMAIN = 32
+AUTHORITATIVE_WORKERS = AUTHORITATIVE_WORKERS_PER_DOMAIN
+HEDGE_MIN_DELAY = 0.05
+HEDGE_RTT_FACTOR = 3
+RTT_EWMA_ALPHA = 0.125
+RTT_VAR_ALPHA = 0.25
+INITIAL_RTT = 0.1
+MIN_DNS_TIMEOUT = 0.3
+BREAKER_THRESHOLD = 5
+BREAKER_COOLDOWN = 30.0
+
+DOMAIN_HISTORY_FILE = os.path.expanduser("~/.domain_history_rdap_interactive")
+CACHE_DIR = os.path.join(os.environ.get("XDG_CACHE_HOME") or os.path.expanduser("~/.cache"), "dnstool")
+VERBOSE = False
+IANA_RDAP_URL = "https://data.iana.org/rdap/dns.json"
+IANA_RDAP_CACHE_FILE = os.path.join(CACHE_DIR, "iana_rdap.json")
+IANA_RDAP_MAX_AGE = 86400
+IANA_RDAP_RETRY_INTERVAL = 300
+IANA_RDAP_MAP = {}
+RDAP_CACHE_FILE = os.path.join(CACHE_DIR, "rdap_cache.sqlite3")
+RDAP_CACHE_MAX_AGE = 86400
+RDAP_RATE = 5.0
+RDAP_BURST = 5
+RDAP_MAX_RETRY_WAIT = 30
+RDAP_MAX_RETRIES = 3
+RESULTS_STORE_FILE = os.path.join(CACHE_DIR, "results.sqlite3")
+RESULTS_BATCH_SIZE = 100
+RESULTS_FLUSH_INTERVAL = 2.0
+RESUME_MAX_AGE = 86400
+RESULTS_STORE = None
+SNAPSHOT_FILE = os.path.join(CACHE_DIR, "snapshots.sqlite3")
+SNAPSHOT_MAX_AGE = 86400
+SNAPSHOT_COMMIT_EVERY = 500
+SNAPSHOT_STORE = None
+WHOIS_IANA_SERVER = "whois.iana.org"
+WHOIS_PORT = 43
+WHOIS_TIMEOUT = 5
+WHOIS_MAX_REFERRALS = 2
+WHOIS_MAX_RESPONSE = 1 << 20
+WHOIS_MAX_CONCURRENCY = 16
+WHOIS_PER_SERVER = 2
+WHOIS_CACHE_TTL = 86400
+DKIM_ROUND = 16
+DKIM_WORKERS = DKIM_ROUND
+WAVE_WORKERS_PER_DOMAIN = 32
+WAVE_WORKERS = WAVE_WORKERS_PER_DOMAIN
+CHECK_WORKERS = len(CHECK_NAMES) + 1
+DKIM_SELECTORS = [
+    "default", "google", "selector1", "selector2", "k1", "k2", "k3", "s1", "s2", "dkim", "mail",
+    "email", "smtp", "mx", "mandrill", "mxvault", "everlytickey1", "everlytickey2", "eversrv", "sendgrid",
+    "smtpapi", "sm", "mailjet", "mailgun", "mg", "pic", "krs", "amazonses", "ses", "zendesk1", "zendesk2",
+    "hs1", "hs2", "hubspot", "cm", "createsend", "mcsv", "mc", "mailchimp", "intercom", "turbo-smtp",
+    "sparkpost", "scph0118", "pm", "postmark", "20150623", "20161025", "20210112", "20230601",
+    "protonmail", "protonmail2", "protonmail3", "zoho", "zmail", "fm1", "fm2", "fm3", "mesmtp", "yandex",
+    "mail-in", "key1", "key2", "dk", "domk", "dkim1", "dkim2", "sig1", "mailo", "gmx", "ovh", "ionos",
+    "strato", "mimecast", "mimecast20190104", "proofpoint", "pp", "ppe", "barracuda", "sophos", "symantec",
+    "cisco", "iport", "salesforce", "sf", "sf1", "sf2", "exacttarget", "et", "marketo", "m1", "eloqua",
+    "pardot", "constantcontact", "ctct1", "ctct2", "aweber", "getresponse", "gr", "sendinblue", "sib",
+    "brevo1", "brevo2", "klaviyo", "kl", "kl2", "braze", "iterable", "customerio", "cio", "freshdesk",
+    "fd", "fd2", "helpscout", "atlassian", "atlassian1", "atlassian2", "github", "shopify", "shopify2",
+    "squarespace", "wix", "godaddy", "secureserver", "dreamhost", "bluehost", "hostgator", "namecheap",
+    "privateemail", "fastmail", "rackspace", "emailsrvr", "office365", "microsoft", "outlook", "yahoo",
+    "ymail", "aol", "apple", "icloud", "sig", "qq", "alibaba", "aliyun", "mailru", "mail2", "smtp2",
+    "smtpout", "out", "outbound", "relay", "bulk", "news", "newsletter", "marketing", "transactional",
+    "notify", "alerts", "support", "info", "noreply", "bounce", "list", "lists", "mta", "mta1", "mta2",
+    "s1024", "s2048", "rsa", "rsa1", "rsa2", "ed25519", "ed", "dkimrsa", "dkim-rsa", "dkim-ed25519",
+] + [f"s{i}" for i in range(3, 21)] + [f"k{i}" for i in range(4, 11)] + [
+    f"selector{i}" for i in range(3, 11)
+] + [f"dkim{i}" for i in range(3, 11)] + [f"{y}{m:02d}" for y in range(2018, 2027) for m in (1, 4, 7, 10)]
+MTA_STS_URL = "https://mta-sts.{domain}/.well-known/mta-sts.txt"
+STATS_BUCKETS = (0.001, 0.0025, 0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0)
+SHOW_STATS = False
+METRICS_ADDR = "127.0.0.1"
+SERVE_ADDR = "127.0.0.1"
+SERVE_MAX_ACTIVE = 32
+SERVE_MAX_QUEUE = 256
+HTTP_TIMEOUT = 5
+HTTP_POOL_CONNECTIONS = 16
+HTTP_POOL_MAXSIZE = 32
+
+logging.basicConfig(level=logging.ERROR, format="%(levelname)s: %(message)s")
+
+_OUTPUT = threading.local()
+_RESOLVER_SLOTS = {}
+_RESOLVER_SLOTS_LOCK = threading.Lock()
+_RESOLVER_POOL = {}
+_RESOLVER_POOL_LOCK = threading.Lock()
+_DOT_POOL = {}
+_DOT_LOCK = threading.Lock()
+_DOH_CLIENT = None
+_DOH_LOCK = threading.Lock()
+_HEDGE_POOL = None
+_HEDGE_LOCK = threading.Lock()
+_DKIM_POOL = None
+_DKIM_HITS = {}
+_DKIM_LOCK = threading.Lock()
+_WAVE_POOL = None
+_WAVE_LOCK = threading.Lock()
+_CHECK_POOL = None
+_CHECK_LOCK = threading.Lock()
+_AUTHORITATIVE_POOL = None
+_AUTHORITATIVE_LOCK = threading.Lock()
+_HEALTH = {}
+_HEALTH_LOCK = threading.Lock()
+_IANA_RDAP_LOADED = False
+_IANA_RDAP_FAILED_AT = None
+_IANA_RDAP_LOCK = threading.Lock()
+_HTTP_SESSIONS = {}
+_HTTP_SESSIONS_LOCK = threading.Lock()
+_RDAP_BUCKETS = {}
+_RDAP_BUCKETS_LOCK = threading.Lock()
+_RDAP_CACHE_DB = None
+_RDAP_CACHE_LOCK = threading.Lock()
+_WHOIS_LIMIT = threading.BoundedSemaphore(WHOIS_MAX_CONCURRENCY)
+_WHOIS_SLOTS = {}
+_WHOIS_SERVERS = {}
+_WHOIS_LOCK = threading.Lock()
+
+
+def _print(*args, **kwargs):
+    """Print to the calling thread's capture buffer, or stdout if none is set."""
+    buf = getattr(_OUTPUT, "buffer", None)
+    if buf is not None and "file" not in kwargs:
+        kwargs["file"] = buf
+    print(*args, **kwargs)
+
+
+def _capture_output(func, *args) -> str:
+    """Call ``func`` and return everything it printed via ``_print``."""
+    previous = getattr(_OUTPUT, "buffer", None)
+    buf = io.StringIO()
+    _OUTPUT.buffer = buf
+    try:
+        func(*args)
+    finally:
+        _OUTPUT.buffer = previous
+    return buf.getvalue()
+
+
+
+def domain_to_ascii(domain: str) -> str:
+    """Convert Unicode domain names to ASCII using IDNA."""
+    domain = domain.rstrip(".")
+    if HAS_IDNA:
+        try:
+            return idna.encode(domain).decode("ascii")
+        except idna.IDNAError:
+            pass
+    return domain
+
+def _is_valid_domain(d: str) -> bool:
+    """Return ``True`` if ``d`` looks like a valid domain name, without printing."""
+    pattern = r"^[A-Za-z0-9._-]+\.[A-Za-z0-9-]{2,}$"
+    if not d or d.startswith(".") or d.endswith(".") or d.endswith("-"):
+        return False
+    return bool(re.match(pattern, d))
+
+def validate_domain(d: str) -> bool:
+    """Return ``True`` if ``d`` looks like a valid domain name."""
+    if not _is_valid_domain(d):
+        _print(f"{SYM_ERR} {RED}Invalid domain:{NC} {d}")
+        return False
+    return True
+
+def _whois_slot(server: str) -> threading.BoundedSemaphore:
+    """Return the semaphore bounding concurrent connections to a WHOIS ``server``."""
+    with _WHOIS_LOCK:
+        slot = _WHOIS_SLOTS.get(server)
+        if slot is None:
+            slot = threading.BoundedSemaphore(WHOIS_PER_SERVER)
+            _WHOIS_SLOTS[server] = slot
+        return slot
+
+
+def _whois_address(server: str):
+    """Split a ``host[:port]`` WHOIS server into a connect address."""
+    host, sep, port = server.rpartition(":")
+    if sep and port.isdigit() and ":" not in host:
+        return host, int(port)
+    return server, WHOIS_PORT
+
+
+def _whois_query(server: str, query: str) -> str:
+    """Send ``query`` to ``server`` (``host[:port]``) and return the full reply."""
+    chunks = []
+    size = 0
+    start = time.perf_counter()
+    # Queue on the server's own slot first so waiters never pin global ones.
+    with _whois_slot(server), _WHOIS_LIMIT:
+        with socket.create_connection(_whois_address(server), timeout=WHOIS_TIMEOUT) as sock:
+            sock.sendall(f"{query}\r\n".encode("ascii", errors="ignore"))
+            while size < WHOIS_MAX_RESPONSE:
+                data = sock.recv(4096)
+                if not data:
+                    break
+                chunks.append(data)
+                size += len(data)
+    STATS.observe("whois", server, time.perf_counter() - start)
+    return b"".join(chunks).decode(errors="replace")
+
+
+def _whois_field(text: str, *names: str) -> str:
+    """Return the value of the first ``name: value`` line matching one of ``names``."""
+    wanted = {n.lower() for n in names}
+    for ln in text.splitlines():
+        parts = ln.split(":", 1)
+        if len(parts) == 2 and parts[0].strip().lower() in wanted and parts[1].strip():
+            return parts[1].strip()
+    return ""
+
+
+def _parse_whois_registrar(text: str) -> str:
+    """Extract the registrar name from a WHOIS reply."""
+    for ln in text.splitlines():
+        if re.search(r"(?i)registrar:", ln) or re.search(r"(?i)sponsoring registrar:", ln):
+            parts = ln.split(":", 1)
+            if len(parts) == 2 and parts[1].strip():
+                return parts[1].strip()
+    return ""
+
+
+def _whois_referral(text: str) -> str:
+    """Return the WHOIS server (``host[:port]``) a reply refers to, without scheme."""
+    server = _whois_field(text, "refer", "whois", "registrar whois server", "whois server", "referralserver")
+    return re.sub(r"(?i)^r?whois://", "", server).split("/", 1)[0]
+
+
+def _whois_server_for_tld(tld: str) -> str:
+    """Return the registry WHOIS server for ``tld``, asking IANA the first time."""
+    with _WHOIS_LOCK:
+        if tld in _WHOIS_SERVERS:
+            return _WHOIS_SERVERS[tld]
+    try:
+        server = _whois_referral(_whois_query(WHOIS_IANA_SERVER, tld))
+    except OSError as e:
+        logging.error("WHOIS IANA lookup error for %s: %s", tld, e)
+        return ""
+    with _WHOIS_LOCK:
+        _WHOIS_SERVERS[tld] = server
+    return server
+
+
+def _whois_registrar_uncached(domain: str):
+    """Return ``(registrar, ttl)`` by following WHOIS referrals from the registry."""
+    server = _whois_server_for_tld(get_tld(domain))
+    seen = set()
+    for _ in range(WHOIS_MAX_REFERRALS + 1):
+        if not server or server.lower() in seen:
+            break
+        seen.add(server.lower())
+        try:
+            text = _whois_query(server, domain)
+        except OSError as e:
+            logging.error("WHOIS lookup error with %s: %s", server, e)
+            return [""], NEGATIVE_CACHE_TTL
+        name = _parse_whois_registrar(text)
+        if name:
+            return [name], WHOIS_CACHE_TTL
+        server = _whois_referral(text)
+    return [""], NEGATIVE_CACHE_TTL
+
+
+def whois_lookup_registrar(domain: str) -> str:
+    """Return registrar name using WHOIS over port 43, following referrals."""
+    return WHOIS_CACHE.lookup(("whois", domain.lower()), lambda: _whois_registrar_uncached(domain))[0]
+
+def _requests():
+    """Import ``requests`` the first time an HTTP feature needs it."""
+    try:
+        import requests
+    except ImportError:  # pragma: no cover - environment lacks requests
+        raise ImportError("the 'requests' package is required for RDAP, MTA-STS and DoH; "
+                          "install it with 'pip install requests'") from None
+    return requests
+
+def _http_session(kind: str):
+    """Return the shared keep-alive ``requests.Session`` for ``kind`` of traffic.
+
+    RDAP and MTA-STS use separate sessions so the many one-off MTA-STS hosts
+    do not evict the warm connections to the few RDAP servers. The session's
+    urllib3 pools are thread-safe and sized for concurrent batch workers.
+    """
+    with _HTTP_SESSIONS_LOCK:
+        session = _HTTP_SESSIONS.get(kind)
+        if session is None:
+            requests = _requests()
+            session = requests.Session()
+            adapter = requests.adapters.HTTPAdapter(
+                pool_connections=HTTP_POOL_CONNECTIONS, pool_maxsize=HTTP_POOL_MAXSIZE
+            )
+            session.mount("https://", adapter)
+            session.mount("http://", adapter)
+            session.headers["User-Agent"] = f"dnstool/{__version__}"
+            _HTTP_SESSIONS[kind] = session
+        return session
+
+
+def _parse_iana_services(data: dict) -> dict:
+    """Flatten the IANA bootstrap ``services`` list into a TLD to endpoints map."""
+    out = {}
+    for svc in data.get("services", []):
+        if len(svc) != 2:
+            continue
+        tlds, endpoints = svc
+        if tlds and endpoints:
+            for tld in tlds:
+                out[tld.lower()] = endpoints
+    return out
+
+
+def _load_iana_cache() -> dict:
+    """Return the cached bootstrap entry from disk, or ``{}`` if unusable."""
+    try:
+        with open(IANA_RDAP_CACHE_FILE, "r", encoding="utf-8") as f:
+            return json.load(f)
+    except (OSError, ValueError):
+        return {}
+
+
+def _save_iana_cache(entry: dict):
+    """Atomically write the bootstrap cache ``entry`` to disk."""
+    tmp = f"{IANA_RDAP_CACHE_FILE}.{os.getpid()}.tmp"
+    try:
+        os.makedirs(os.path.dirname(IANA_RDAP_CACHE_FILE), exist_ok=True)
+        with open(tmp, "w", encoding="utf-8") as f:
+            json.dump(entry, f, separators=(",", ":"))
+        os.replace(tmp, IANA_RDAP_CACHE_FILE)
+    except OSError as e:
+        logging.error("Failed to write IANA RDAP cache: %s", e)
+
+
+def fetch_iana_rdap_data():
+    """Populate ``IANA_RDAP_MAP`` with TLD to RDAP endpoint mappings.
+
+    The map is read from the on-disk cache and only revalidated against IANA
+    (with ``If-None-Match``/``If-Modified-Since``) once it is older than
+    ``IANA_RDAP_MAX_AGE``. A stale copy is still used if IANA is unreachable.
+    Return False if the map could not be fetched or revalidated.
+    """
+    cached = _load_iana_cache()
+    if cached.get("map") and time.time() - cached.get("fetched", 0) < IANA_RDAP_MAX_AGE:
+        IANA_RDAP_MAP.update(cached["map"])
+        return True
+    ok = False
+    headers = {}
+    if cached.get("map") and cached.get("etag"):
+        headers["If-None-Match"] = cached["etag"]
+    if cached.get("map") and cached.get("last_modified"):
+        headers["If-Modified-Since"] = cached["last_modified"]
+    try:
+        r = _http_session("rdap").get(IANA_RDAP_URL, timeout=HTTP_TIMEOUT, headers=headers)
+        if r.status_code == 304 and cached.get("map"):
+            cached["fetched"] = time.time()
+        else:
+            r.raise_for_status()
+            cached = {
+                "fetched": time.time(),
+                "etag": r.headers.get("ETag"),
+                "last_modified": r.headers.get("Last-Modified"),
+                "map": _parse_iana_services(r.json()),
+            }
+        _save_iana_cache(cached)
+        ok = True
+    except Exception as e:
+        logging.error("Failed to fetch IANA RDAP data: %s", e)
+    IANA_RDAP_MAP.update(cached.get("map", {}))
+    return ok
+
+
+def _iana_rdap_due() -> bool:
+    """Return True if the bootstrap map still needs loading and no recent attempt failed."""
+    if _IANA_RDAP_LOADED:
+        return False
+    return _IANA_RDAP_FAILED_AT is None or time.monotonic() - _IANA_RDAP_FAILED_AT >= IANA_RDAP_RETRY_INTERVAL
+
+
+def _ensure_iana_rdap_data():
+    """Load the IANA bootstrap map the first time an RDAP lookup needs it.
+
+    A failed fetch is retried by the first lookup ``IANA_RDAP_RETRY_INTERVAL``
+    seconds later, so a long-running ``--serve`` process recovers from a
+    network failure at startup.
+    """
+    global _IANA_RDAP_LOADED, _IANA_RDAP_FAILED_AT
+    if not _iana_rdap_due():
+        return
+    with _IANA_RDAP_LOCK:
+        if not _iana_rdap_due():
+            return
+        if fetch_iana_rdap_data():
+            _IANA_RDAP_LOADED = True
+        else:
+            _IANA_RDAP_FAILED_AT = time.monotonic()
+
+def get_tld(domain: str) -> str:
+    """Return the top-level domain from ``domain`` in lowercase."""
+    return domain.rsplit(".", 1)[-1].lower()
+
+class _TokenBucket:
+    """Token-bucket rate limiter that can also be paused by ``Retry-After``."""
+
+    def __init__(self, rate: float, burst: int):
+        self.rate = rate
+        self.burst = burst
+        self.tokens = float(burst)
+        self.updated = time.monotonic()
+        self.paused_until = 0.0
+        self._lock = threading.Lock()
+
+    def acquire(self):
+        """Block until a request may be sent."""
+        while True:
+            with self._lock:
+                now = time.monotonic()
+                self.tokens = min(self.burst, self.tokens + (now - self.updated) * self.rate)
+                self.updated = now
+                if now < self.paused_until:
+                    delay = self.paused_until - now
+                elif self.tokens >= 1:
+                    self.tokens -= 1
+                    return
+                else:
+                    delay = (1 - self.tokens) / self.rate
+            time.sleep(delay)
+
+    def pause(self, seconds: float):
+        """Hold every request for ``seconds``, as asked by a 429 response."""
+        with self._lock:
+            self.paused_until = max(self.paused_until, time.monotonic() + seconds)
+            self.tokens = 0.0
+
+
+def _rdap_bucket(host: str) -> _TokenBucket:
+    """Return the rate limiter for the RDAP server at ``host``."""
+    with _RDAP_BUCKETS_LOCK:
+        bucket = _RDAP_BUCKETS.get(host)
+        if bucket is None:
+            bucket = _TokenBucket(RDAP_RATE, RDAP_BURST)
+            _RDAP_BUCKETS[host] = bucket
+        return bucket
+
+
+def _retry_after_seconds(value) -> float:
+    """Parse a ``Retry-After`` header given as seconds or an HTTP date."""
+    if not value:
+        return 1.0
+    try:
+        return max(float(value), 0.0)
+    except ValueError:
+        pass
+    from email.utils import parsedate_to_datetime
+    try:
+        return max(parsedate_to_datetime(value).timestamp() - time.time(), 0.0)
+    except (TypeError, ValueError):
+        return 1.0
+
+
+def _rdap_get(url: str):
+    """GET ``url`` within its server's rate limit, waiting out short 429 back-offs.
+
+    At most ``RDAP_MAX_RETRIES`` back-offs are waited out. A ``Retry-After``
+    longer than ``RDAP_MAX_RETRY_WAIT`` returns the 429 at once, without
+    pausing the server's bucket, so the caller can fall back to WHOIS.
+    """
+    host = urlsplit(url).netloc.lower()
+    bucket = _rdap_bucket(host)
+    for attempt in range(RDAP_MAX_RETRIES + 1):
+        bucket.acquire()
+        resp = STATS.call("rdap", host, _http_session("rdap").get, url, timeout=HTTP_TIMEOUT)
+        if resp.status_code != 429:
+            return resp
+        STATS.count("rdap_throttled", host)
+        wait_for = _retry_after_seconds(resp.headers.get("Retry-After"))
+        if wait_for > RDAP_MAX_RETRY_WAIT or attempt == RDAP_MAX_RETRIES:
+            return resp
+        bucket.pause(wait_for)
+        logging.error("RDAP rate limited by %s, retrying in %.1fs", url, wait_for)
+
+
+def _rdap_cache_db():
+    """Return the RDAP response cache connection, opening it on first use."""
+    global _RDAP_CACHE_DB
+    if _RDAP_CACHE_DB is None:
+        os.makedirs(os.path.dirname(RDAP_CACHE_FILE), exist_ok=True)
+        db = sqlite3.connect(RDAP_CACHE_FILE, check_same_thread=False)
+        db.execute("PRAGMA journal_mode=WAL")
+        db.execute("CREATE TABLE IF NOT EXISTS rdap (domain TEXT PRIMARY KEY, fetched REAL, data TEXT)")
+        _RDAP_CACHE_DB = db
+    return _RDAP_CACHE_DB
+
+
+def _rdap_cache_get(domain: str) -> dict:
+    """Return cached RDAP data for ``domain`` if fresher than ``RDAP_CACHE_MAX_AGE``."""
+    if RDAP_CACHE_MAX_AGE <= 0:
+        return {}
+    try:
+        with _RDAP_CACHE_LOCK:
+            row = _rdap_cache_db().execute(
+                "SELECT data FROM rdap WHERE domain = ? AND fetched > ?",
+                (domain.lower(), time.time() - RDAP_CACHE_MAX_AGE),
+            ).fetchone()
+    except (OSError, sqlite3.Error) as e:
+        logging.error("RDAP cache read error: %s", e)
+        return {}
+    return json.loads(row[0]) if row else {}
+
+
+def _rdap_cache_put(domain: str, data: dict):
+    """Store RDAP ``data`` for ``domain`` in the response cache."""
+    if RDAP_CACHE_MAX_AGE <= 0:
+        return
+    try:
+        with _RDAP_CACHE_LOCK:
+            db = _rdap_cache_db()
+            db.execute(
+                "INSERT OR REPLACE INTO rdap (domain, fetched, data) VALUES (?, ?, ?)",
+                (domain.lower(), time.time(), json.dumps(data, separators=(",", ":"))),
+            )
+            db.commit()
+    except (OSError, sqlite3.Error) as e:
+        logging.error("RDAP cache write error: %s", e)
+
+
+def rdap_lookup(domain: str) -> dict:
+    """Return RDAP JSON data for ``domain`` using IANA endpoints."""
+    cached = _rdap_cache_get(domain)
+    STATS.count("rdap_cache", "hit" if cached else "miss")
+    if cached:
+        return cached
+    _ensure_iana_rdap_data()
+    t = get_tld(domain)
+    endpoints = IANA_RDAP_MAP.get(t, [])
+    for ep in endpoints:
+        url = f"{ep.rstrip('/')}/domain/{domain}"
+        try:
+            resp = _rdap_get(url)
+            if resp.status_code < 400:
+                data = resp.json()
+                if "errorCode" not in data:
+                    _rdap_cache_put(domain, data)
+                    return data
+        except Exception as e:
+            logging.error("RDAP lookup error: %s", e)
+    url = f"https://rdap.org/domain/{domain}"
+    try:
+        resp = _rdap_get(url)
+        if resp.status_code < 400:
+            data = resp.json()
+            if "errorCode" not in data:
+                _rdap_cache_put(domain, data)
+                return data
+    except Exception as e:
+        logging.error("RDAP fallback lookup error: %s", e)
+    return {}
+
+class QueryCache:
+    """Thread-safe LRU cache of DNS answers that expire with their TTL.
+
+    Concurrent lookups of the same key are coalesced so only one of them
+    reaches the network; the others wait for its answer.
+    """
+
+    def __init__(self, maxsize: int = QUERY_CACHE_SIZE):
+        self.maxsize = maxsize
+        self.hits = 0
+        self.misses = 0
+        self._entries = OrderedDict()
+        self._inflight = {}
+        self._lock = threading.Lock()
+
+    def lookup(self, key, fetch) -> list:
+        """Return the cached answer for ``key`` or store the result of ``fetch()``.
+
+        ``fetch`` must return a ``(records, ttl)`` tuple; a TTL of zero or less
+        means the answer is not cached.
+        """
+        with self._lock:
+            entry = self._entries.get(key)
+            if entry is not None:
+                expires, records = entry
+                if expires > time.monotonic():
+                    self._entries.move_to_end(key)
+                    self.hits += 1
+                    return copy.copy(records)
+                del self._entries[key]
+            fut = self._inflight.get(key)
+            owner = fut is None
+            if owner:
+                fut = Future()
+                self._inflight[key] = fut
+                self.misses += 1
+            else:
+                self.hits += 1
+        if not owner:
+            return copy.copy(fut.result())
+        try:
+            records, ttl = fetch()
+        except BaseException as e:
+            with self._lock:
+                del self._inflight[key]
+            fut.set_exception(e)
+            raise
+        with self._lock:
+            del self._inflight[key]
+            if ttl > 0 and self.maxsize > 0:
+                self._entries[key] = (time.monotonic() + ttl, records)
+                self._entries.move_to_end(key)
+                while len(self._entries) > self.maxsize:
+                    self._entries.popitem(last=False)
+        fut.set_result(records)
+        return copy.copy(records)
+
+    def clear(self):
+        """Drop every cached answer and reset the counters."""
+        with self._lock:
+            self._entries.clear()
+            self.hits = 0
+            self.misses = 0
+
+    def stats(self) -> dict:
+        """Return hit/miss counters and the current number of entries."""
+        with self._lock:
+            total = self.hits + self.misses
+            return {
+                "hits": self.hits,
+                "misses": self.misses,
+                "size": len(self._entries),
+                "hit_rate": self.hits / total if total else 0.0,
+            }
+
+
+QUERY_CACHE = QueryCache()
+WHOIS_CACHE = QueryCache()
+
+
+class Histogram:
+    """Latency histogram over ``STATS_BUCKETS`` (seconds) plus count, sum and max."""
+
+    def __init__(self):
+        self.buckets = [0] * (len(STATS_BUCKETS) + 1)
+        self.count = 0
+        self.total = 0.0
+        self.max = 0.0
+
+    def observe(self, seconds: float):
+        """Add one sample; the caller holds the stats lock."""
+        self.buckets[bisect.bisect_left(STATS_BUCKETS, seconds)] += 1
+        self.count += 1
+        self.total += seconds
+        if seconds > self.max:
+            self.max = seconds
+
+    def quantile(self, q: float) -> float:
+        """Return the upper bound of the bucket holding quantile ``q`` (``max`` for the last)."""
+        rank = q * self.count
+        seen = 0
+        for bound, n in zip(STATS_BUCKETS, self.buckets):
+            seen += n
+            if n and seen >= rank:
+                return min(bound, self.max)
+        return self.max
+
+
+class Stats:
+    """Run-wide timing histograms and counters, keyed by ``(kind, label)``.
+
+    ``kind`` groups related measurements (``check``, ``resolver``,
+    ``rdtype``, ``rdap``, ``whois``, ``http``); ``label`` names the check,
+    resolver, record type or endpoint. Recording is a perf_counter call and
+    one short lock, so it is always on.
+    """
+
+    def __init__(self):
+        self.started = time.monotonic()
+        self.histograms = {}
+        self.counters = {}
+        self._lock = threading.Lock()
+
+    def observe(self, kind: str, label: str, seconds: float):
+        """Record one ``seconds`` sample under ``(kind, label)``."""
+        with self._lock:
+            hist = self.histograms.get((kind, label))
+            if hist is None:
+                hist = self.histograms[(kind, label)] = Histogram()
+            hist.observe(seconds)
+
+    def count(self, name: str, label: str = "", n: int = 1):
+        """Add ``n`` to the counter ``(name, label)``."""
+        with self._lock:
+            self.counters[(name, label)] = self.counters.get((name, label), 0) + n
+
+    def call(self, kind: str, label: str, func, *args, **kwargs):
+        """Return ``func(*args, **kwargs)``, timing it under ``(kind, label)`` even if it raises."""
+        start = time.perf_counter()
+        try:
+            return func(*args, **kwargs)
+        finally:
+            self.observe(kind, label, time.perf_counter() - start)
+
+    def total(self, name: str) -> int:
+        """Return the sum of counter ``name`` across all labels."""
+        with self._lock:
+            return sum(v for (n, _), v in self.counters.items() if n == name)
+
+
+STATS = Stats()
+
+
+def _metric_label(value: str) -> str:
+    """Escape ``value`` for use inside an OpenMetrics label."""
+    return value.replace("\\", "\\\\").replace('"', '\\"').replace("\n", "\\n")
+
+
+def render_metrics(stats: Stats) -> str:
+    """Return ``stats`` and the cache counters in the OpenMetrics text format."""
+    with stats._lock:
+        histograms = {key: (list(h.buckets), h.count, h.total) for key, h in stats.histograms.items()}
+        counters = dict(stats.counters)
+    out = []
+
+    def family(name, kind, help_text):
+        out.append(f"# TYPE {name} {kind}")
+        out.append(f"# HELP {name} {help_text}")
+
+    def histogram(name, kind, label, help_text):
+        family(name, "histogram", help_text)
+        for (k, value), (buckets, count, total) in sorted(histograms.items()):
+            if k != kind:
+                continue
+            labels = f'{label}="{_metric_label(value)}",' if label else ""
+            cumulative = 0
+            for bound, n in zip(STATS_BUCKETS, buckets):
+                cumulative += n
+                out.append(f'{name}_bucket{{{labels}le="{bound}"}} {cumulative}')
+            out.append(f'{name}_bucket{{{labels}le="+Inf"}} {count}')
+            selector = f"{{{labels.rstrip(',')}}}" if labels else ""
+            out.append(f"{name}_sum{selector} {total}")
+            out.append(f"{name}_count{selector} {count}")
+
+    def labelled(name, kind, counter, help_text):
+        family(name, kind, help_text)
+        suffix = "_total" if kind == "counter" else ""
+        for (n, value), v in sorted(counters.items()):
+            if n == counter:
+                out.append(f'{name}{suffix}{{resolver="{_metric_label(value)}"}} {v}')
+
+    family("dnstool_domains_completed", "counter", "Domains whose checks have finished.")
+    out.append(f"dnstool_domains_completed_total {counters.get(('domains', ''), 0)}")
+    labelled("dnstool_queries_in_flight", "gauge", "inflight", "DNS queries currently waiting on each resolver.")
+    family("dnstool_resolver_queries", "counter", "DNS queries sent to each resolver.")
+    for (k, value), (_, count, _) in sorted(histograms.items()):
+        if k == "resolver":
+            out.append(f'dnstool_resolver_queries_total{{resolver="{_metric_label(value)}"}} {count}')
+    labelled("dnstool_resolver_timeouts", "counter", "timeouts", "DNS queries that timed out, per resolver.")
+    labelled("dnstool_resolver_servfails", "counter", "servfails", "DNS queries answered SERVFAIL, per resolver.")
+    histogram("dnstool_resolver_query_duration_seconds", "resolver", "resolver", "Time per query to each resolver.")
+    histogram("dnstool_dns_query_duration_seconds", "dns_query", "rdtype", "dns_query() latency, cache included.")
+    histogram("dnstool_rdap_lookup_duration_seconds", "rdap_lookup", "", "rdap_lookup() latency, cache included.")
+    family("dnstool_dns_cache_hits", "counter", "DNS answers served from the query cache.")
+    out.append(f"dnstool_dns_cache_hits_total {QUERY_CACHE.hits}")
+    family("dnstool_dns_cache_misses", "counter", "DNS answers that had to be fetched.")
+    out.append(f"dnstool_dns_cache_misses_total {QUERY_CACHE.misses}")
+    lookups = QUERY_CACHE.hits + QUERY_CACHE.misses
+    family("dnstool_dns_cache_hit_ratio", "gauge", "Share of DNS lookups served from the query cache.")
+    out.append(f"dnstool_dns_cache_hit_ratio {QUERY_CACHE.hits / lookups if lookups else 0.0}")
+    out.append("# EOF")
+    return "\n".join(out) + "\n"
+
+
+def start_metrics_server(port: int, addr: str = METRICS_ADDR) -> "ThreadingHTTPServer":
+    """Serve OpenMetrics text on ``addr:port`` from a background thread."""
+    from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+
+    class _MetricsHandler(BaseHTTPRequestHandler):
+        """Serves ``render_metrics(STATS)`` on every GET."""
+
+        def do_GET(self):
+            body = render_metrics(STATS).encode()
+            self.send_response(200)
+            self.send_header("Content-Type", "application/openmetrics-text; version=1.0.0; charset=utf-8")
+            self.send_header("Content-Length", str(len(body)))
+            self.end_headers()
+            self.wfile.write(body)
+
+        def log_message(self, *args):
+            pass
+
+    server = ThreadingHTTPServer((addr, port), _MetricsHandler)
+    server.daemon_threads = True
+    threading.Thread(target=server.serve_forever, name="dnstool-metrics", daemon=True).start()
+    return server
+
+
+class _SocketPool:
+    """Idle DNS TCP connections that can be handed to the next query."""
+
+    def __init__(self):
+        self._idle = {}
+        self._lock = threading.Lock()
+
+    def acquire(self, key):
+        """Return an idle socket for ``key`` or ``None`` if there is none."""
+        with self._lock:
+            idle = self._idle.get(key)
+            return idle.pop() if idle else None
+
+    def release(self, key, sock):
+        """Keep ``sock`` for reuse, closing it if the pool for ``key`` is full."""
+        with self._lock:
+            idle = self._idle.setdefault(key, [])
+            if len(idle) < MAX_IDLE_SOCKETS:
+                idle.append(sock)
+                return
+        sock.close()
+
+
+_SOCKET_POOL = _SocketPool()
+
+
+class _PooledNameserver(dns.nameserver.Do53Nameserver):
+    """Do53 nameserver that reuses TCP connections across queries.
+
+    UDP queries keep dnspython's fresh socket per query, so each one leaves
+    from a new random source port, which makes spoofed answers harder to
+    land.
+    """
+
+    def query(self, request, timeout, source, source_port, max_size,
+              one_rr_per_rrset=False, ignore_trailing=False):
+        if max_size:
+            af = dns.inet.af_for_address(self.address)
+            return self._tcp_query(af, request, timeout, one_rr_per_rrset, ignore_trailing)
+        return super().query(request, timeout, source, source_port, max_size,
+                             one_rr_per_rrset=one_rr_per_rrset, ignore_trailing=ignore_trailing)
+
+    def _tcp_query(self, af, request, timeout, one_rr_per_rrset, ignore_trailing):
+        """Send ``request`` over a kept-alive TCP connection, reconnecting if it was closed.
+
+        A connection that fails in any way, including a timeout, is closed
+        rather than pooled, so a late reply cannot reach a later query.
+        """
+        key = ("tcp", self.address, self.port)
+        sock = _SOCKET_POOL.acquire(key)
+        if sock is not None:
+            try:
+                response = dns.query.tcp(request, self.address, timeout=timeout, port=self.port,
+                                         one_rr_per_rrset=one_rr_per_rrset,
+                                         ignore_trailing=ignore_trailing, sock=sock)
+            except (OSError, EOFError):
+                sock.close()  # closed by the server while idle; reconnect below
+            except BaseException:
+                sock.close()
+                raise
+            else:
+                _SOCKET_POOL.release(key, sock)
+                return response
+        sock = socket.socket(af, socket.SOCK_STREAM)
+        try:
+            sock.settimeout(timeout)
+            sock.connect((self.address, self.port))
+            sock.setblocking(False)
+            response = dns.query.tcp(request, self.address, timeout=timeout, port=self.port,
+                                     one_rr_per_rrset=one_rr_per_rrset,
+                                     ignore_trailing=ignore_trailing, sock=sock)
+        except BaseException:
+            sock.close()
+            raise
+        _SOCKET_POOL.release(key, sock)
+        return response
+
+
+def _tls_context() -> ssl.SSLContext:
+    """Return a verifying TLS context, trusting ``DNS_TLS_CAFILE`` if set."""
+    return ssl.create_default_context(cafile=DNS_TLS_CAFILE)
+
+
+class _DoTConnection:
+    """One TLS connection to a DoT server carrying many queries at once.
+
+    Queries are pipelined (RFC 7766): callers queue their messages and one
+    I/O thread, the only user of the TLS socket, writes them and hands
+    every response to the caller waiting on its message ID, so answers may
+    arrive in any order.
+    """
+
+    def __init__(self, address: str, port: int, hostname: str, timeout: float):
+        sock = socket.create_connection((address, port), timeout=timeout)
+        try:
+            self._sock = _tls_context().wrap_socket(sock, server_hostname=hostname)
+        except BaseException:
+            sock.close()
+            raise
+        self._sock.setblocking(False)
+        self._wake_r, self._wake_w = socket.socketpair()
+        self._wake_r.setblocking(False)
+        self._wake_w.setblocking(False)
+        self._lock = threading.Lock()
+        self._pending = {}
+        self._outbox = []
+        self.closed = False
+        threading.Thread(target=self._io_loop, name="dnstool-dot", daemon=True).start()
+
+    def query(self, request, timeout: float) -> bytes:
+        """Send ``request`` and return the wire-format response."""
+        fut = Future()
+        with self._lock:
+            if self.closed:
+                raise ConnectionError("DoT connection closed")
+            while request.id in self._pending:
+                request.id = int.from_bytes(os.urandom(2), "big")
+            self._pending[request.id] = fut
+            wire = request.to_wire()
+            self._outbox.append(len(wire).to_bytes(2, "big") + wire)
+        try:
+            with contextlib.suppress(BlockingIOError):
+                self._wake_w.send(b"\0")
+            return fut.result(timeout)
+        except FutureTimeoutError:
+            raise dns.exception.Timeout(timeout=timeout)
+        finally:
+            with self._lock:
+                if self._pending.get(request.id) is fut:
+                    del self._pending[request.id]
+
+    def _deliver(self, inbuf: bytes) -> bytes:
+        """Hand every complete response in ``inbuf`` to its query; return the leftover bytes."""
+        while len(inbuf) >= 2 and len(inbuf) >= 2 + int.from_bytes(inbuf[:2], "big"):
+            n = int.from_bytes(inbuf[:2], "big")
+            wire, inbuf = inbuf[2:2 + n], inbuf[2 + n:]
+            if len(wire) < 2:
+                continue
+            with self._lock:
+                fut = self._pending.pop(int.from_bytes(wire[:2], "big"), None)
+            if fut is not None:
+                fut.set_result(wire)
+        return inbuf
+
+    def _io_loop(self):
+        """Write queued queries and deliver responses until the connection drops.
+
+        However the loop ends, the connection is marked closed and every
+        waiting query fails at once instead of running into its timeout.
+        """
+        inbuf = outbuf = b""
+        sel = selectors.DefaultSelector()
+        try:
+            sel.register(self._wake_r, selectors.EVENT_READ)
+            sel.register(self._sock, selectors.EVENT_READ)
+            writing = False
+            while True:
+                with self._lock:
+                    outbuf += b"".join(self._outbox)
+                    self._outbox.clear()
+                if writing != bool(outbuf):
+                    writing = bool(outbuf)
+                    sel.modify(self._sock, selectors.EVENT_READ | (selectors.EVENT_WRITE if writing else 0))
+                for key, _ in sel.select():
+                    if key.fileobj is self._wake_r:
+                        with contextlib.suppress(BlockingIOError):
+                            self._wake_r.recv(4096)
+                if outbuf:
+                    with contextlib.suppress(ssl.SSLWantReadError, ssl.SSLWantWriteError):
+                        outbuf = outbuf[self._sock.send(outbuf):]
+                # Drain everything TLS has decrypted; the selector cannot see its buffer.
+                while True:
+                    try:
+                        data = self._sock.recv(65536)
+                    except (ssl.SSLWantReadError, ssl.SSLWantWriteError):
+                        break
+                    if not data:
+                        raise EOFError("DoT connection closed by server")
+                    inbuf = self._deliver(inbuf + data)
+        except Exception as e:
+            logging.error("DoT connection error: %s", e)
+        finally:
+            with self._lock:
+                self.closed = True
+                pending, self._pending = self._pending, {}
+            for fut in pending.values():
+                fut.set_exception(ConnectionError("DoT connection closed"))
+            sel.close()
+            for sock in (self._sock, self._wake_r, self._wake_w):
+                sock.close()
+
+
+def _dot_connection(address: str, port: int, hostname: str, timeout: float) -> _DoTConnection:
+    """Return one of the ``DOT_CONNECTIONS`` shared connections to a DoT server.
+
+    The pool holds live connections and futures for ones still handshaking.
+    Handshakes run outside ``_DOT_LOCK``, so a slow server does not hold up
+    connections to the others.
+    """
+    key = (address, port, hostname)
+    with _DOT_LOCK:
+        entries = [e for e in _DOT_POOL.get(key, []) if not getattr(e, "closed", False)]
+        _DOT_POOL[key] = entries
+        if len(entries) >= DOT_CONNECTIONS:
+            live = [e for e in entries if isinstance(e, _DoTConnection)]
+            if live:
+                return min(live, key=lambda c: len(c._pending))
+            connecting, fut = entries[0], None
+        else:
+            connecting, fut = None, Future()
+            entries.append(fut)
+    if connecting is not None:
+        try:
+            return connecting.result(timeout)
+        except FutureTimeoutError:
+            raise dns.exception.Timeout(timeout=timeout)
+    try:
+        conn = _DoTConnection(address, port, hostname, timeout)
+    except BaseException as e:
+        with _DOT_LOCK:
+            _DOT_POOL[key].remove(fut)
+        fut.set_exception(e)
+        raise
+    with _DOT_LOCK:
+        entries = _DOT_POOL[key]
+        entries[entries.index(fut)] = conn
+    fut.set_result(conn)
+    return conn
+
+
+class _PipelinedDoTNameserver(dns.nameserver.DoTNameserver):
+    """DoT nameserver that shares a few pipelined TLS connections across all queries."""
+
+    def query(self, request, timeout, source, source_port, max_size=False,
+              one_rr_per_rrset=False, ignore_trailing=False):
+        conn = _dot_connection(self.address, self.port, self.hostname or self.address, timeout)
+        wire = conn.query(request, timeout)
+        response = dns.message.from_wire(wire, keyring=request.keyring, request_mac=request.mac,
+                                         one_rr_per_rrset=one_rr_per_rrset, ignore_trailing=ignore_trailing)
+        if not request.is_response(response):
+            raise dns.query.BadResponse
+        return response
+
+
+def _doh_client():
+    """Return the shared HTTP/2 DoH client, or ``None`` if httpx/h2 are not installed."""
+    global _DOH_CLIENT
+    with _DOH_LOCK:
+        if _DOH_CLIENT is None:
+            try:
+                import httpx
+                import h2  # noqa: F401 - httpx needs it for HTTP/2
+            except ImportError:
+                _DOH_CLIENT = False
+            else:
+                _DOH_CLIENT = httpx.Client(http2=True, verify=_tls_context(),
+                                           limits=httpx.Limits(max_connections=DOH_CONNECTIONS))
+        return _DOH_CLIENT or None
+
+
+class _SharedDoHNameserver(dns.nameserver.DoHNameserver):
+    """DoH nameserver that multiplexes queries over a shared client.
+
+    With httpx and h2 installed every query is a stream on a few HTTP/2
+    connections; otherwise the pooled ``requests`` session keeps HTTP/1.1
+    connections alive instead.
+    """
+
+    def query(self, request, timeout, source, source_port, max_size=False,
+              one_rr_per_rrset=False, ignore_trailing=False):
+        client = _doh_client()
+        if client is not None:
+            return dns.query.https(request, self.url, timeout=timeout, session=client,
+                                   one_rr_per_rrset=one_rr_per_rrset, ignore_trailing=ignore_trailing)
+        requests = _requests()
+        try:
+            resp = _http_session("doh").post(
+                self.url, data=request.to_wire(), timeout=timeout, verify=DNS_TLS_CAFILE or True,
+                headers={"Content-Type": "application/dns-message", "Accept": "application/dns-message"},
+            )
+        except requests.Timeout:
+            raise dns.exception.Timeout(timeout=timeout)
+        resp.raise_for_status()
+        response = dns.message.from_wire(resp.content, keyring=request.keyring, request_mac=request.mac,
+                                         one_rr_per_rrset=one_rr_per_rrset, ignore_trailing=ignore_trailing)
+        if not request.is_response(response):
+            raise dns.query.BadResponse
+        return response
+
+
+def _nameserver_for(spec: str):
+    """Return the nameserver object for a resolver spec.
+
+    ``https://`` URLs use DoH, ``tls://host[:port]`` uses DoT,
+    ``dns://host[:port]`` is Do53 on another port and anything else is a
+    plain Do53 address.
+    """
+    if spec.startswith("https://"):
+        return _SharedDoHNameserver(spec)
+    if spec.startswith("tls://"):
+        u = urlsplit(spec)
+        return _PipelinedDoTNameserver(u.hostname, u.port or DOT_PORT, u.hostname)
+    if spec.startswith("dns://"):
+        u = urlsplit(spec)
+        return _PooledNameserver(u.hostname, u.port or 53)
+    return _PooledNameserver(spec)
+
+
+def _with_transport(resolvers, transport: str) -> list:
+    """Return ``resolvers`` as DoT or DoH specs for ``transport``; URLs are kept."""
+    if transport == "udp":
+        return list(resolvers)
+    specs = []
+    for r in resolvers:
+        host = f"[{r}]" if ":" in r and "://" not in r else r
+        if "://" in r:
+            specs.append(r)
+        elif transport == "dot":
+            specs.append(f"tls://{host}")
+        else:
+            specs.append(DOH_URLS.get(r, f"https://{host}/dns-query"))
+    return specs
+
+
+class ResolverHealth:
+    """Observed latency and failure rates for one resolver.
+
+    RTT is smoothed the way TCP does it (RFC 6298) and the query timeout is
+    derived from it. After ``BREAKER_THRESHOLD`` consecutive failures the
+    circuit breaker opens and the resolver is skipped for ``BREAKER_COOLDOWN``
+    seconds, after which the next query acts as a probe.
+    """
+
+    def __init__(self, nameserver: str):
+        self.nameserver = nameserver
+        self.samples = 0
+        self.srtt = INITIAL_RTT
+        self.rttvar = INITIAL_RTT / 2
+        self.timeout_rate = 0.0
+        self.servfail_rate = 0.0
+        self.queries = 0
+        self.timeouts = 0
+        self.servfails = 0
+        self.consecutive_failures = 0
+        self.open_until = 0.0
+
+    def record_success(self, rtt: float):
+        """Fold a completed query's round-trip time into the averages."""
+        with _HEALTH_LOCK:
+            self.queries += 1
+            if self.samples == 0:
+                self.srtt = rtt
+                self.rttvar = rtt / 2
+            else:
+                self.rttvar += RTT_VAR_ALPHA * (abs(self.srtt - rtt) - self.rttvar)
+                self.srtt += RTT_EWMA_ALPHA * (rtt - self.srtt)
+            self.samples += 1
+            self.timeout_rate -= RTT_EWMA_ALPHA * self.timeout_rate
+            self.servfail_rate -= RTT_EWMA_ALPHA * self.servfail_rate
+            self.consecutive_failures = 0
+            self.open_until = 0.0
+
+    def record_failure(self, kind: str):
+        """Count a failed query; ``kind`` is ``timeout``, ``servfail`` or ``error``."""
+        with _HEALTH_LOCK:
+            self.queries += 1
+            is_timeout = kind == "timeout"
+            is_servfail = kind == "servfail"
+            self.timeouts += is_timeout
+            self.servfails += is_servfail
+            self.timeout_rate += RTT_EWMA_ALPHA * (is_timeout - self.timeout_rate)
+            self.servfail_rate += RTT_EWMA_ALPHA * (is_servfail - self.servfail_rate)
+            self.consecutive_failures += 1
+            if self.consecutive_failures >= BREAKER_THRESHOLD:
+                self.open_until = time.monotonic() + BREAKER_COOLDOWN
+
+    def available(self) -> bool:
+        """Return ``False`` while the circuit breaker is open."""
+        return time.monotonic() >= self.open_until
+
+    def timeout(self) -> float:
+        """Return the timeout for one attempt, derived from the measured RTT.
+
+        Like TCP's retransmission timeout it follows the resolver's round
+        trip, between ``MIN_DNS_TIMEOUT`` and ``DNS_TIME``. An attempt that
+        runs out is retried within the query's fixed lifetime, so an uncached
+        lookup waiting on a slow authoritative server is resent, not failed.
+        """
+        if self.samples == 0:
+            return DNS_TIME
+        return min(max(self.srtt + 4 * self.rttvar, MIN_DNS_TIMEOUT), DNS_TIME)
+
+
+def _health_for(nameserver: str) -> ResolverHealth:
+    """Return the health record for ``nameserver``, creating it on first use."""
+    with _HEALTH_LOCK:
+        health = _HEALTH.get(nameserver)
+        if health is None:
+            health = ResolverHealth(nameserver)
+            _HEALTH[nameserver] = health
+        return health
+
+
+def _ranked_resolvers() -> list:
+    """Return ``RESOLVERS`` fastest first, with tripped resolvers skipped.
+
+    Resolvers without measurements keep their configured position ahead of
+    measured ones so they get sampled. If every resolver is tripped they are
+    all returned so lookups still have somewhere to go.
+    """
+    healths = [_health_for(r) for r in RESOLVERS]
+    usable = [h for h in healths if h.available()] or healths
+    usable.sort(key=lambda h: h.srtt if h.samples else 0.0)
+    return [h.nameserver for h in usable]
+
+
+def _resolver_for(nameserver: str, dnssec: bool = False):
+    """Return the shared resolver for ``nameserver``, creating it on first use."""
+    key = (nameserver, dnssec)
+    with _RESOLVER_POOL_LOCK:
+        resolver = _RESOLVER_POOL.get(key)
+        if resolver is None:
+            resolver = dns.resolver.Resolver(configure=False)
+            resolver.nameservers = [_nameserver_for(nameserver)]
+            if dnssec:
+                resolver.use_edns(0, dns.flags.DO, 1232)
+            resolver.timeout = DNS_TIME
+            resolver.lifetime = DNS_TIME * DNS_TRIES
+            _RESOLVER_POOL[key] = resolver
+        return resolver
+
+
+def _resolver_slot(nameserver: str) -> threading.BoundedSemaphore:
+    """Return the semaphore bounding in-flight queries to ``nameserver``."""
+    with _RESOLVER_SLOTS_LOCK:
+        slot = _RESOLVER_SLOTS.get(nameserver)
+        if slot is None:
+            slot = threading.BoundedSemaphore(MAX_INFLIGHT_PER_RESOLVER)
+            _RESOLVER_SLOTS[nameserver] = slot
+        return slot
+
+
+def _negative_ttl(exc) -> int:
+    """Return the negative-caching TTL from the SOA in an NXDOMAIN/NoAnswer reply."""
+    if isinstance(exc, dns.resolver.NXDOMAIN):
+        responses = list(exc.kwargs.get("responses", {}).values())
+    else:
+        responses = [exc.kwargs.get("response")]
+    for resp in responses:
+        for rrset in getattr(resp, "authority", []):
+            if rrset.rdtype == dns.rdatatype.SOA:
+                return min(rrset.ttl, rrset[0].minimum)
+    return NEGATIVE_CACHE_TTL
+
+
+class DNSResult(list):
+    """Records from a DNS query, plus ``status`` saying how the query ended.
+
+    ``status`` is one of the ``QUERY_*`` outcomes, so an empty result can
+    tell NXDOMAIN and NoAnswer apart from SERVFAIL, timeouts and errors.
+    """
+
+    def __init__(self, records=(), status=None):
+        super().__init__(records)
+        self.status = status or (QUERY_OK if self else QUERY_NOANSWER)
+
+    @property
+    def failed(self) -> bool:
+        """True if no resolver gave a definitive answer."""
+        return self.status in QUERY_FAILURES
+
+
+def dns_query(rdtype, domain):
+    """Query ``domain`` for record type ``rdtype`` using several resolvers.
+
+    Returns a :class:`DNSResult`, which is a plain list of records that also
+    carries the query outcome.
+    """
+    if not domain or not rdtype:
+        return DNSResult(status=QUERY_ERROR)
+    key = (domain.lower().rstrip("."), str(rdtype).upper())
+    return STATS.call("dns_query", key[1], _cached_query, key, lambda: _query_resolvers(domain, rdtype, str))
+
+
+def _cached_query(key, fetch) -> list:
+    """Answer ``key`` from the query cache, then the snapshot store, then ``fetch()``."""
+    if SNAPSHOT_STORE is None:
+        return QUERY_CACHE.lookup(key, fetch)
+    return QUERY_CACHE.lookup(key, lambda: SNAPSHOT_STORE.answer(key, fetch))
+
+
+def _attempt_query(nameserver, qname, rdtype, convert):
+    """Ask one resolver for ``qname`` and return ``(DNSResult, ttl)``.
+
+    NXDOMAIN and NoAnswer are definitive and come back empty with the
+    negative-caching TTL; failures come back empty with a TTL of zero.
+    """
+    resolver = _resolver_for(nameserver)
+    health = _health_for(nameserver)
+    start = time.monotonic()
+    try:
+        with _resolver_slot(nameserver):
+            STATS.count("inflight", nameserver)
+            try:
+                resolver.timeout = health.timeout()
+                ans = resolver.resolve(qname, rdtype, lifetime=DNS_TIME * DNS_TRIES)
+            finally:
+                elapsed = time.monotonic() - start
+                STATS.count("inflight", nameserver, -1)
+                STATS.observe("resolver", nameserver, elapsed)
+                STATS.observe("rdtype", str(rdtype).upper(), elapsed)
+        health.record_success(elapsed)
+        return DNSResult(convert(rr) for rr in ans), ans.rrset.ttl
+    except (dns.resolver.NXDOMAIN, dns.resolver.NoAnswer) as e:
+        health.record_success(time.monotonic() - start)
+        logging.error("DNS query error with resolver %s: %s", nameserver, e)
+        status = QUERY_NXDOMAIN if isinstance(e, dns.resolver.NXDOMAIN) else QUERY_NOANSWER
+        return DNSResult(status=status), _negative_ttl(e)
+    except dns.exception.Timeout as e:
+        health.record_failure("timeout")
+        STATS.count("timeouts", nameserver)
+        logging.error("DNS query timeout with resolver %s: %s", nameserver, e)
+        status = QUERY_TIMEOUT
+    except dns.resolver.NoNameservers as e:
+        health.record_failure("servfail")
+        STATS.count("servfails", nameserver)
+        logging.error("DNS query SERVFAIL with resolver %s: %s", nameserver, e)
+        status = QUERY_SERVFAIL
+    except Exception as e:
+        health.record_failure("error")
+        logging.error("DNS query error with resolver %s: %s", nameserver, e)
+        status = QUERY_ERROR
+    return DNSResult(status=status), 0
+
+
+def _query_resolvers(qname, rdtype, convert):
+    """Return ``(DNSResult, ttl)`` for ``qname`` using ``RESOLVERS`` per ``QUERY_MODE``.
+
+    Resolvers are tried in turn until one returns records or NXDOMAIN; the
+    result of a query no resolver could answer carries the last failure.
+    """
+    if QUERY_MODE != "sequential":
+        return _hedged_query(qname, rdtype, convert, race=QUERY_MODE == "race")
+    result = (DNSResult(status=QUERY_ERROR), 0)
+    for n, r in enumerate(_ranked_resolvers()):
+        if n:
+            STATS.count("retries", r)
+        attempt = _attempt_query(r, qname, rdtype, convert)
+        if attempt[0] or attempt[0].status == QUERY_NXDOMAIN:
+            return attempt
+        if not attempt[0].failed or result[0].failed:
+            result = attempt
+    return result
+
+
+def _hedged_query(qname, rdtype, convert, race=False):
+    """Query ``RESOLVERS`` in parallel and return the first definitive answer.
+
+    Without ``race`` the next resolver is only asked once the current ones
+    have been silent for ``_hedge_delay()`` or have failed outright.
+    """
+    resolvers = _ranked_resolvers()
+    pool = _hedge_pool()
+    pending = set()
+    launched = 0
+
+    def launch():
+        nonlocal launched
+        if launched:
+            STATS.count("retries", resolvers[launched])
+        pending.add(pool.submit(_attempt_query, resolvers[launched], qname, rdtype, convert))
+        launched += 1
+
+    launch()
+    while race and launched < len(resolvers):
+        launch()
+    result = (DNSResult(status=QUERY_ERROR), 0)
+    while pending:
+        timeout = _hedge_delay(resolvers[launched - 1]) if launched < len(resolvers) else None
+        done, pending = wait(pending, timeout=timeout, return_when=FIRST_COMPLETED)
+        for fut in done:
+            result = fut.result()
+            if not result[0].failed:
+                for other in pending:
+                    other.cancel()
+                return result
+        if launched < len(resolvers):
+            launch()
+    return result
+
+
+def _hedge_pool() -> ThreadPoolExecutor:
+    """Return the shared executor used for hedged queries."""
+    global _HEDGE_POOL
+    with _HEDGE_LOCK:
+        if _HEDGE_POOL is None:
+            _HEDGE_POOL = ThreadPoolExecutor(max_workers=HEDGE_WORKERS, thread_name_prefix="dnstool-hedge")
+        return _HEDGE_POOL
+
+
+def _hedge_delay(nameserver: str) -> float:
+    """Return how long to wait on ``nameserver`` before asking the next resolver."""
+    health = _health_for(nameserver)
+    return min(max(HEDGE_MIN_DELAY, health.srtt * HEDGE_RTT_FACTOR), health.timeout())
+
+
+def _query_authoritative(ns_ip, domain, rdtype):
+    """Query a single authoritative nameserver; return its records or ``None`` on failure."""
+    resolver = _resolver_for(ns_ip)
+    try:
+        with _resolver_slot(ns_ip):
+            ans = resolver.resolve(domain, rdtype)
+        return [str(r) for r in ans]
+    except (dns.resolver.NXDOMAIN, dns.resolver.NoAnswer):
+        return []
+    except Exception as e:  # pragma: no cover - network dependent
+        logging.error("Authoritative DNS query error: %s", e)
+        return None
+
+
+def _authoritative_pool() -> ThreadPoolExecutor:
+    """Return the shared executor that queries authoritative nameservers."""
+    global _AUTHORITATIVE_POOL
+    with _AUTHORITATIVE_LOCK:
+        if _AUTHORITATIVE_POOL is None:
+            _AUTHORITATIVE_POOL = ThreadPoolExecutor(max_workers=AUTHORITATIVE_WORKERS,
+                                                     thread_name_prefix="dnstool-authoritative")
+        return _AUTHORITATIVE_POOL
+
+
+def authoritative_answers(domain: str, rdtypes=None) -> dict:
+    """Return ``{rdtype: {ns_ip: records}}`` from each authoritative nameserver.
+
+    Nameserver addresses are resolved concurrently and every (address, rdtype)
+    query is started as soon as its address is known. Servers that did not
+    answer are left out.
+    """
+    if rdtypes is None:
+        rdtypes = ("A", "AAAA", "MX", "TXT")
+    answers = {t: {} for t in rdtypes}
+    ns_hosts = dns_query("NS", domain)
+    if not ns_hosts:
+        return answers
+    pool = _authoritative_pool()
+    lookups = [pool.submit(dns_query, fam, host.rstrip(".")) for host in ns_hosts for fam in ("A", "AAAA")]
+    queries = {}
+    for fut in as_completed(lookups):
+        for ip in fut.result():
+            for typ in rdtypes:
+                if (ip, typ) not in queries:
+                    queries[(ip, typ)] = pool.submit(_query_authoritative, ip, domain, typ)
+    for fut in lookups:
+        for ip in fut.result():
+            for typ in rdtypes:
+                records = queries[(ip, typ)].result()
+                if records is not None:
+                    answers[typ][ip] = records
+    return answers
+
+
+def _merge_answers(by_server: dict) -> list:
+    """Merge per-server answers into one list without duplicates."""
+    seen = set()
+    merged = []
+    for records in by_server.values():
+        for rr in records:
+            if rr not in seen:
+                seen.add(rr)
+                merged.append(rr)
+    return merged
+
+
+def authoritative_lookup(domain: str, rdtypes=None) -> dict:
+    """Return DNS records queried directly from authoritative nameservers."""
+    answers = authoritative_answers(domain, rdtypes)
+    return {typ: _merge_answers(by_server) for typ, by_server in answers.items()}
+
+
+def print_authoritative_results(domain: str, rdtypes=None, data=None):
+    """Display a concise Authoritative result block."""
+    answers = data if data is not None else authoritative_answers(domain, rdtypes)
+    _print(f"\n{BLUE}🔍 Authoritative result:{NC}")
+    for typ, by_server in answers.items():
+        records = _merge_answers(by_server)
+        if records:
+            _print(f"{SYM_OK} {typ}: {', '.join(records)}")
+        else:
+            _print(f"{SYM_ERR} {typ}: none")
+        if len({frozenset(recs) for recs in by_server.values()}) > 1:
+            _print(f"{SYM_WARN} {typ}: nameservers disagree:")
+            for ip, recs in by_server.items():
+                _print(f"   {ip}: {', '.join(recs) or 'none'}")
+
+
+def _extract_registrar_from_rdap(rdap_data: dict) -> str:
+    """Extract registrar name from RDAP response entities."""
+    entities = rdap_data.get("entities", [])
+    for ent in entities:
+        roles = ent.get("roles", [])
+        if not roles or "registrar" not in [r.lower() for r in roles]:
+            continue
+        name = _extract_vcard_fn(ent)
+        if not name:
+            name = ent.get("handle") or ent.get("name") or ""
+        if name:
+            return name
+    return ""
+
+
+def _extract_vcard_fn(entity: dict) -> str:
+    """Extract the 'fn' field from an RDAP entity vCard."""
+    vcard = entity.get("vcardArray", [])
+    if len(vcard) != 2 or not isinstance(vcard[1], list):
+        return ""
+    for item in vcard[1]:
+        if len(item) == 4 and item[0] == "fn":
+            return item[3]
+    return ""
+
+
+def collect_registrar(domain: str) -> dict:
+    """Return registrar details from RDAP, falling back to WHOIS.
+
+    ``source`` is ``rdap``, ``whois``, ``rdap-handle`` (a numeric RDAP handle
+    WHOIS could not resolve) or an empty string when nothing was found.
+    """
+    rdap_data = STATS.call("rdap_lookup", "", rdap_lookup, domain)
+    rdap_name = _extract_registrar_from_rdap(rdap_data) if rdap_data else ""
+    data = {
+        "rdap_found": bool(rdap_data),
+        "rdap_registrar": rdap_name,
+        "registrar": rdap_name,
+        "source": "rdap" if rdap_name else "",
+    }
+    if not rdap_name or rdap_name.isdigit():
+        whois_name = whois_lookup_registrar(domain)
+        if whois_name:
+            data.update(registrar=whois_name, source="whois")
+        elif rdap_name:
+            data["source"] = "rdap-handle"
+    return data
+
+
+def _print_registrar(data: dict):
+    """Print the registrar found in RDAP, or its WHOIS replacement for numeric handles."""
+    if data["source"] == "whois":
+        label = f"Registrar (WHOIS fallback): {GREEN}{data['registrar']}{NC}"
+    elif data["source"] == "rdap-handle":
+        label = f"Registrar (RDAP handle): {YELLOW}{data['registrar']}{NC}"
+    else:
+        label = f"Registrar (RDAP): {GREEN}{data['registrar']}{NC}"
+    _print(f"{SYM_OK} {label}")
+
+
+def get_registrar(domain: str, data=None):
+    """Print registrar information obtained via RDAP or WHOIS."""
+    _print(f"\n{BLUE}🔍 Registrar & RDAP Info:{NC}")
+    data = data if data is not None else collect_registrar(domain)
+    if not data["rdap_found"]:
+        _print(f"{SYM_WARN} No RDAP data. Checking WHOIS...")
+        if data["registrar"]:
+            _print(f"{SYM_OK} Registrar (WHOIS fallback): {GREEN}{data['registrar']}{NC}")
+        else:
+            _print(f"{SYM_ERR} {RED}No registrar found (RDAP/WHOIS both empty).{NC}")
+        return
+
+    if not data["rdap_registrar"]:
+        _print(f"{SYM_WARN} Registrar not found in RDAP. Checking WHOIS...")
+        if data["registrar"]:
+            _print(f"{SYM_OK} Registrar (WHOIS fallback): {GREEN}{data['registrar']}{NC}")
+        else:
+            _print(f"{SYM_ERR} {RED}No registrar found in RDAP or WHOIS.{NC}")
+        return
+    _print_registrar(data)
+
+
+def _classify_dns_records(records, valid_prefix, label):
+    """Classify DNS TXT records into valid and invalid categories."""
+    valid_lines = []
+    invalid_lines = []
+    for line in records:
+        low = line.lower()
+        if valid_prefix in low:
+            valid_lines.append(line)
+        elif label in low:
+            invalid_lines.append(line)
+    return valid_lines, invalid_lines
+
+
+def _print_no_valid_record(invalid_lines, record_type):
+    """Print messaging when no valid record is found."""
+    if invalid_lines:
+        _print(f"{SYM_WARN} Found {len(invalid_lines)} '{record_type}-like' line(s) that are not valid. "
+              f"{SYM_ERR} Required for mail deliverability and DMARC compliance.:\n")
+        for s in invalid_lines:
+            _print(f'   "{s}"')
+        _print(f"{SYM_ERR} No valid {record_type.upper()} record. (These appear incorrect.) "
+              f"{SYM_ERR} Required for mail deliverability and DMARC compliance.")
+    else:
+        _print(f"{SYM_ERR} No {record_type.upper()} record found. "
+              f"({SYM_ERR} Required for mail deliverability and DMARC compliance.)")
+
+
+def collect_spf(domain: str) -> dict:
+    """Return the apex TXT records split into valid and SPF-like invalid lines."""
+    records = dns_query("TXT", domain)
+    valid, invalid = _classify_dns_records(records, "v=spf1", "spf")
+    return {"records": records, "valid": valid, "invalid": invalid}
+
+
+def get_spf_record(domain: str, data=None):
+    """Display the SPF record for ``domain`` if present."""
+    _print(f"\n{BLUE}🔍 SPF (Sender Policy Framework):{NC}")
+    data = data if data is not None else collect_spf(domain)
+    if not data["records"]:
+        _print(f"{SYM_ERR} No TXT => no SPF record! ({SYM_ERR} Required for mail deliverability and DMARC compliance.)")
+        return
+    valid_spf_lines, spfish_lines = data["valid"], data["invalid"]
+    count_valid = len(valid_spf_lines)
+    if count_valid == 0:
+        _print_no_valid_record(spfish_lines, "spf")
+    elif count_valid == 1:
+        _print(f'{SYM_OK} SPF found => "Good, there is only one!"')
+        _print(valid_spf_lines[0])
+    else:
+        _print(f'{SYM_WARN} Multiple valid SPF lines => "There can be only one!"\n')
+        for s in valid_spf_lines:
+            _print(f"   {s}")
+
+
+def _dmarc_policy(line: str) -> str:
+    """Return the DMARC ``p=`` policy of a record, or an empty string."""
+    lowered = line.lower()
+    for policy in ("none", "reject", "quarantine"):
+        if f"p={policy}" in lowered:
+            return policy
+    return ""
+
+
+def _print_dmarc_policy(line: str):
+    """Print the DMARC policy assessment for a single valid record."""
+    policy = _dmarc_policy(line)
+    if policy == "none":
+        _print(f'{SYM_WARN} DMARC p=none => "Your work\'s not done!"')
+    elif policy == "reject":
+        _print(f"{SYM_OK} DMARC p=reject => Great anti-spoof!")
+    elif policy == "quarantine":
+        _print(f"{SYM_OK} DMARC p=quarantine => Not as strong as reject, but still good!")
+    else:
+        _print(f"{SYM_OK} DMARC record found (p=?).")
+    _print(line)
+
+
+def collect_dmarc(domain: str) -> dict:
+    """Return the ``_dmarc`` TXT records, their classification and the policy."""
+    records = dns_query("TXT", f"_dmarc.{domain}")
+    valid, invalid = _classify_dns_records(records, "v=dmarc1", "dmarc")
+    policy = _dmarc_policy(valid[0]) if len(valid) == 1 else ""
+    return {"records": records, "valid": valid, "invalid": invalid, "policy": policy}
+
+
+def get_dmarc_record(domain: str, data=None):
+    """Display the DMARC policy for ``domain``."""
+    _print(f"\n{BLUE}🔍 DMARC:{NC}")
+    data = data if data is not None else collect_dmarc(domain)
+    if not data["records"]:
+        _print(f"{SYM_ERR} No DMARC record found. (Helps prevent spoofing. Required for mail deliverability.)")
+        return
+    valid_dmarc_lines, dmarc_like = data["valid"], data["invalid"]
+    count_valid = len(valid_dmarc_lines)
+    if count_valid == 0:
+        if dmarc_like:
+            _print(f"{SYM_WARN} Found DMARC-like lines, but not 'v=DMARC1':\n")
+            for x in dmarc_like:
+                _print(f'   "{x}"')
+            _print(f"{SYM_ERR} No valid DMARC record (these appear incorrect). "
+                  f"{SYM_ERR} Required for mail deliverability and DMARC compliance.")
+        else:
+            _print(f"{SYM_ERR} No valid DMARC record found. (Required for mail deliverability.)")
+    elif count_valid > 1:
+        _print(f'{SYM_WARN} Multiple DMARC lines => "There can be only one!"\n')
+        for x in valid_dmarc_lines:
+            _print(f"   {x}")
+    else:
+        _print_dmarc_policy(valid_dmarc_lines[0])
+
+def _dkim_pool() -> ThreadPoolExecutor:
+    """Return the shared executor used to probe DKIM selectors."""
+    global _DKIM_POOL
+    with _DKIM_LOCK:
+        if _DKIM_POOL is None:
+            _DKIM_POOL = ThreadPoolExecutor(max_workers=DKIM_WORKERS, thread_name_prefix="dnstool-dkim")
+        return _DKIM_POOL
+
+
+def _ranked_selectors() -> list:
+    """Return ``DKIM_SELECTORS`` with the selectors found most often so far first."""
+    with _DKIM_LOCK:
+        hits = dict(_DKIM_HITS)
+    return sorted(DKIM_SELECTORS, key=lambda s: -hits.get(s, 0))
+
+
+def _name_missing(qname: str, rdtype: str = "TXT") -> bool:
+    """Return True if resolvers answer NXDOMAIN for ``qname``.
+
+    An empty non-terminal such as ``_domainkey.<domain>`` answers NoAnswer
+    when names exist below it, so only NXDOMAIN proves the subtree is empty.
+    """
+    return getattr(dns_query(rdtype, qname), "status", QUERY_OK) == QUERY_NXDOMAIN
+
+
+def collect_dkim(domain: str) -> dict:
+    """Return DKIM records found at known selectors, keyed by selector.
+
+    Selectors are probed in rounds of ``DKIM_ROUND``, the ones found most
+    often first, and the scan ends with the first round that finds a key.
+    A domain thus holds at most one round of the shared DKIM pool, and a
+    typical domain costs one round instead of the whole dictionary.
+    """
+    if _name_missing(f"_domainkey.{domain}"):
+        return {"selectors": {}}
+    sels = _ranked_selectors()
+    found = {}
+    for i in range(0, len(sels), DKIM_ROUND):
+        batch = sels[i:i + DKIM_ROUND]
+        futures = [_dkim_pool().submit(dns_query, "TXT", f"{s}._domainkey.{domain}") for s in batch]
+        found = {s: recs for s, recs in zip(batch, (fut.result() for fut in futures)) if recs}
+        if found:
+            break
+    with _DKIM_LOCK:
+        for s in found:
+            _DKIM_HITS[s] = _DKIM_HITS.get(s, 0) + 1
+    return {"selectors": {f"{s}._domainkey": found[s] for s in DKIM_SELECTORS if s in found}}
+
+def get_dkim_record(domain: str, data=None):
+    """Check common DKIM selectors for ``domain``."""
+    _print(f"\n{BLUE}🔍 DKIM ({len(DKIM_SELECTORS)} known selectors):{NC}")
+    data = data if data is not None else collect_dkim(domain)
+    for s, recs in data["selectors"].items():
+        _print(f"   {SYM_OK} DKIM at {s}")
+        for rr in recs:
+            _print(f"   {rr}")
+    if not data["selectors"]:
+        _print(f"{SYM_WARN} No DKIM found among known selectors.")
+
+def collect_dane(domain: str) -> dict:
+    """Return TLSA records for SMTP (port 25) and HTTPS (port 443)."""
+    return {
+        "smtp": dns_query("TLSA", f"_25._tcp.{domain}"),
+        "https": dns_query("TLSA", f"_443._tcp.{domain}"),
+    }
+
+def get_dane_records(domain: str, data=None):
+    """Display DANE TLSA records for SMTP and HTTPS."""
+    _print(f"\n{BLUE}🔍 DANE (TLSA):{NC}")
+    data = data if data is not None else collect_dane(domain)
+    if data["smtp"]:
+        _print(f"{SYM_OK} SMTP TLSA found:")
+        for rr in data["smtp"]:
+            _print(rr)
+    else:
+        _print(f"{SYM_ERR} No SMTP TLSA record (port 25).")
+    if data["https"]:
+        _print(f"{SYM_OK} HTTPS TLSA found:")
+        for rr in data["https"]:
+            _print(rr)
+    else:
+        _print(f"{SYM_ERR} No HTTPS TLSA record (port 443).")
+
+def collect_bimi(domain: str) -> dict:
+    """Return the ``default._bimi`` TXT records."""
+    return {"records": dns_query("TXT", f"default._bimi.{domain}")}
+
+def get_bimi_record(domain: str, data=None):
+    """Show BIMI TXT records for ``domain``."""
+    _print(f"\n{BLUE}🔍 BIMI:{NC}")
+    data = data if data is not None else collect_bimi(domain)
+    if data["records"]:
+        _print(f"{SYM_OK} BIMI found:")
+        for rr in data["records"]:
+            _print(rr)
+    else:
+        _print(f"{SYM_ERR} No default._bimi record.")
+
+def collect_mta_sts(domain: str) -> dict:
+    """Return the ``_mta-sts`` TXT records and the policy file's HTTP status (0 on error)."""
+    txt = dns_query("TXT", f"_mta-sts.{domain}")
+    url = MTA_STS_URL.format(domain=domain)
+    try:
+        status = STATS.call("http", "mta-sts", _http_session("mta-sts").get, url,
+                            timeout=HTTP_TIMEOUT).status_code
+    except Exception as e:
+        logging.error("MTA-STS policy fetch error: %s", e)
+        status = 0
+    return {"records": txt, "policy_url": url, "policy_status": status}
+
+def get_mta_sts(domain: str, data=None):
+    """Check MTA-STS TXT record and policy file."""
+    _print(f"\n{BLUE}🔍 MTA-STS:{NC}")
+    data = data if data is not None else collect_mta_sts(domain)
+    txt = data["records"]
+    if txt:
+        _print(f'{SYM_OK} _mta-sts.{domain} TXT => "{txt[0]}"')
+    else:
+        _print(f"{SYM_ERR} No _mta-sts.{domain} TXT record.")
+    _print(f"   Checking policy file: {data['policy_url']}")
+    if data["policy_status"] == 200:
+        _print(f"   {SYM_OK} Policy file found (HTTP 200).")
+    else:
+        _print(f"   {SYM_ERR} No policy file (HTTP {data['policy_status']:03d}).")
+
+def collect_dnssec(domain: str) -> dict:
+    """Return whether the apex A answer carries RRSIGs.
+
+    ``status`` is ``signed``, ``unsigned`` or ``error`` when the query failed.
+    """
+    nameserver = _ranked_resolvers()[0]
+    resolver = _resolver_for(nameserver, dnssec=True)
+    try:
+        with _resolver_slot(nameserver):
+            ans = resolver.resolve(domain, "A", raise_on_no_answer=False)
+        if ans.response and any(rr.rdtype == dns.rdatatype.RRSIG for rr in ans.response.answer):
+            return {"status": "signed"}
+        return {"status": "unsigned"}
+    except Exception as e:
+        logging.error("DNSSEC check error: %s", e)
+        return {"status": "error"}
+
+def get_dnssec_status(domain: str, data=None):
+    """Check whether DNSSEC signatures are present."""
+    _print(f"\n{BLUE}🔍 DNSSEC:{NC}")
+    data = data if data is not None else collect_dnssec(domain)
+    if data["status"] == "signed":
+        _print(f"{SYM_OK} DNSSEC signatures present (RRSIG).")
+    elif data["status"] == "unsigned":
+        _print(f"{SYM_ERR} DNSSEC not detected or not validated.")
+    else:
+        _print(f"{SYM_ERR} DNSSEC not detected or no A record to check.")
+
+def collect_ns(domain: str) -> dict:
+    """Return the NS records for ``domain``."""
+    return {"records": dns_query("NS", domain)}
+
+def get_ns_records(domain: str, data=None):
+    """Display NS records for ``domain``."""
+    _print(f"\n{BLUE}🔍 NS Records:{NC}")
+    data = data if data is not None else collect_ns(domain)
+    if data["records"]:
+        _print(f"{SYM_OK} Found NS:")
+        for rr in data["records"]:
+            _print(rr)
+    else:
+        _print(f"{SYM_ERR} No NS records found.")
+
+def collect_mx(domain: str) -> dict:
+    """Return MX records and whether deprecated Google aspmx2/aspmx3 hosts are used."""
+    mx_out = dns_query("MX", domain)
+    uses_aspmx2 = any("aspmx2.googlemail.com" in x.lower() for x in mx_out)
+    uses_aspmx3 = any("aspmx3.googlemail.com" in x.lower() for x in mx_out)
+    return {"records": mx_out, "deprecated_google": uses_aspmx2 or uses_aspmx3}
+
+def get_mx_records(domain: str, data=None):
+    """Show MX records and flag deprecated Google lines."""
+    _print(f"\n{BLUE}🔍 MX Records:{NC}")
+    data = data if data is not None else collect_mx(domain)
+    if not data["records"]:
+        _print(f"{SYM_ERR} No MX records found.\n{RED}(Likely why email is failing—this is big trouble!){NC}")
+        return
+    _print(f"{SYM_OK} Found MX:")
+    for line in data["records"]:
+        _print(f"   {line}")
+    if data["deprecated_google"]:
+        _print(f"{SYM_WARN} We see older Google MX lines (aspmx2/aspmx3).")
+        _print("   Google's newer recommended config typically does not need them.")
+        _print("   For Google Workspace, recommended lines are more like smtp.google.com / altX.")
+
+def collect_txt(domain: str) -> dict:
+    """Return all apex TXT records for ``domain``."""
+    return {"records": dns_query("TXT", domain)}
+
+def get_txt_records(domain: str, data=None):
+    """Print all TXT records for ``domain``."""
+    _print(f"\n{BLUE}🔍 TXT Records:{NC}")
+    data = data if data is not None else collect_txt(domain)
+    if not data["records"]:
+        _print(f"{SYM_ERR} No TXT records found.")
+    else:
+        _print(f"{SYM_OK} Found TXT:")
+        for rr in data["records"]:
+            _print(f'"{rr}"')
+
+def collect_a(domain: str) -> dict:
+    """Return the A records for ``domain``."""
+    return {"records": dns_query("A", domain)}
+
+def get_a_record(domain: str, data=None):
+    """Display the A record (IPv4) for ``domain``."""
+    _print(f"\n{BLUE}🔍 A (IPv4) Record:{NC}")
+    data = data if data is not None else collect_a(domain)
+    if not data["records"]:
+        _print(f"{SYM_ERR} No A record found.")
+    else:
+        _print(f"{SYM_OK} Found A:")
+        for rr in data["records"]:
+            _print(rr)
+
+def collect_aaaa(domain: str) -> dict:
+    """Return the AAAA records for ``domain``."""
+    return {"records": dns_query("AAAA", domain)}
+
+def get_aaaa_record(domain: str, data=None):
+    """Display the AAAA record (IPv6) for ``domain``."""
+    _print(f"\n{BLUE}🔍 AAAA (IPv6) Record:{NC}")
+    data = data if data is not None else collect_aaaa(domain)
+    if not data["records"]:
+        _print(f"{SYM_ERR} No AAAA record found.")
+    else:
+        _print(f"{SYM_OK} Found AAAA:")
+        for rr in data["records"]:
+            _print(rr)
+
+def collect_caa(domain: str) -> dict:
+    """Return the CAA records for ``domain``."""
+    return {"records": dns_query("CAA", domain)}
+
+def get_caa_record(domain: str, data=None):
+    """Display CAA records if they exist."""
+    _print(f"\n{BLUE}🔍 CAA (Certificate Authority Authorization):{NC}")
+    data = data if data is not None else collect_caa(domain)
+    if not data["records"]:
+        _print(f"{SYM_WARN} No CAA record found. (Optional but recommended to limit cert issuers.)")
+    else:
+        _print(f"{SYM_OK} Found CAA:")
+        for rr in data["records"]:
+            _print(rr)
+
+def collect_soa(domain: str) -> dict:
+    """Return the SOA record for ``domain``."""
+    return {"records": dns_query("SOA", domain)}
+
+def get_soa_record(domain: str, data=None):
+    """Show the SOA record for ``domain``."""
+    _print(f"\n{BLUE}🔍 SOA (Start of Authority):{NC}")
+    data = data if data is not None else collect_soa(domain)
+    if data["records"]:
+        _print(f"{SYM_OK} Found SOA:")
+        for rr in data["records"]:
+            _print(rr)
+    else:
+        _print(f"{SYM_ERR} No SOA record found.")
+
+def ptr_lookup(ip: str) -> list:
+    """Return PTR records for an IPv4 or IPv6 address."""
+    try:
+        rev_name = dns.reversename.from_address(ip)
+    except Exception as e:
+        logging.error("PTR lookup prepare error: %s", e)
+        return DNSResult(status=QUERY_ERROR)
+    return _cached_query((str(rev_name).lower(), "PTR"),
+                         lambda: _query_resolvers(rev_name, "PTR", lambda rr: str(rr).rstrip(".")))
+
+
+def _detect_mail_provider(domain: str) -> str:
+    """Detect if the domain uses Google or Microsoft mail infrastructure."""
+    mx_lc = [x.lower() for x in dns_query("MX", domain)]
+    txt_lc = [x.lower() for x in dns_query("TXT", domain)]
+    if any("google" in x for x in mx_lc) or any("_spf.google.com" in x for x in txt_lc):
+        return "Google"
+    if any("outlook" in x or "microsoft" in x for x in mx_lc) or \
+       any("spf.protection.outlook.com" in x for x in txt_lc):
+        return "Microsoft"
+    return ""
+
+
+def collect_ptr(domain: str) -> dict:
+    """Return PTR records for each A record of ``domain`` and its mail provider."""
+    a_recs = dns_query("A", domain)
+    if not a_recs:
+        return {"addresses": {}, "provider": ""}
+    return {
+        "addresses": {ip: ptr_lookup(ip) for ip in a_recs},
+        "provider": _detect_mail_provider(domain),
+    }
+
+
+def get_ptr_record(domain: str, data=None):
+    """Resolve PTR records for all A records of ``domain``."""
+    data = data if data is not None else collect_ptr(domain)
+    if not data["addresses"]:
+        _print(f"\n{RED}No A record => no PTR check.{NC}")
+        return
+    provider = data["provider"]
+    for ip, ptrs in data["addresses"].items():
+        _print(f"\n{BLUE}🔍 PTR for {ip}:{NC}")
+        if ptrs:
+            for p in ptrs:
+                _print(p)
+        elif provider:
+            _print(f"{SYM_OK} No PTR found, but domain likely on shared {provider} IP => normal.")
+        else:
+            _print(f"{SYM_ERR} No PTR found for {ip}.")
+
+def _check_table(authoritative: bool = False) -> list:
+    """Return ``(name, collector, renderer)`` for every check, in display order."""
+    table = [
+        ("registrar", collect_registrar, get_registrar),
+        ("ns", collect_ns, get_ns_records),
+        ("mx", collect_mx, get_mx_records),
+        ("txt", collect_txt, get_txt_records),
+        ("dmarc", collect_dmarc, get_dmarc_record),
+        ("spf", collect_spf, get_spf_record),
+        ("dkim", collect_dkim, get_dkim_record),
+        ("mta_sts", collect_mta_sts, get_mta_sts),
+        ("dane", collect_dane, get_dane_records),
+        ("bimi", collect_bimi, get_bimi_record),
+        ("dnssec", collect_dnssec, get_dnssec_status),
+        ("a", collect_a, get_a_record),
+        ("aaaa", collect_aaaa, get_aaaa_record),
+        ("caa", collect_caa, get_caa_record),
+        ("soa", collect_soa, get_soa_record),
+        ("ptr", collect_ptr, get_ptr_record),
+    ]
+    if CHECKS is not None:
+        table = [row for row in table if row[0] in CHECKS]
+    if authoritative:
+        table.insert(0, ("authoritative", authoritative_answers, print_authoritative_results))
+    return table
+
+
+def plan_lookups(checks, domain: str) -> list:
+    """Return the deduplicated ``(kind, name)`` lookups ``checks`` need for ``domain``, in first-use order.
+
+    Dependent names keep their ``{a}``, ``{ns}`` or ``{selector}`` placeholder.
+    """
+    plan = {}
+    for check in checks:
+        for kind, template in CHECK_LOOKUPS[check]:
+            plan[(kind, template.format(domain=domain, selector="{selector}", a="{a}", ns="{ns}"))] = None
+    return list(plan)
+
+
+def _wave_pool() -> ThreadPoolExecutor:
+    """Return the shared executor that sends planned lookups."""
+    global _WAVE_POOL
+    with _WAVE_LOCK:
+        if _WAVE_POOL is None:
+            _WAVE_POOL = ThreadPoolExecutor(max_workers=WAVE_WORKERS, thread_name_prefix="dnstool-wave")
+        return _WAVE_POOL
+
+
+def _check_pool() -> ThreadPoolExecutor:
+    """Return the shared executor that runs every domain's checks.
+
+    Check tasks never wait on each other, so domains sharing ``CHECK_WORKERS``
+    threads only queue behind one another and cannot deadlock.
+    """
+    global _CHECK_POOL
+    with _CHECK_LOCK:
+        if _CHECK_POOL is None:
+            _CHECK_POOL = ThreadPoolExecutor(max_workers=CHECK_WORKERS, thread_name_prefix="dnstool-check")
+        return _CHECK_POOL
+
+
+def _size_pools(domains: int, workers: int = 0, max_inflight: int = 0):
+    """Size the shared pools and the per-resolver in-flight cap for ``domains`` checked at once.
+
+    Every pool gets one domain's share per domain in flight, so parallel
+    domains do not queue behind each other. ``workers`` and ``max_inflight``
+    override the check pool and the in-flight cap. Pools already created
+    keep their size, so call this before checking anything.
+    """
+    global CHECK_WORKERS, DKIM_WORKERS, WAVE_WORKERS, HEDGE_WORKERS, AUTHORITATIVE_WORKERS
+    global MAX_INFLIGHT_PER_RESOLVER
+    CHECK_WORKERS = workers or (len(CHECK_NAMES) + 1) * domains
+    DKIM_WORKERS = DKIM_ROUND * domains
+    WAVE_WORKERS = WAVE_WORKERS_PER_DOMAIN * domains
+    HEDGE_WORKERS = HEDGE_WORKERS_PER_DOMAIN * domains
+    AUTHORITATIVE_WORKERS = AUTHORITATIVE_WORKERS_PER_DOMAIN * domains
+    MAX_INFLIGHT_PER_RESOLVER = max_inflight or INFLIGHT_PER_DOMAIN * domains
+
+
+def _second_wave(plan, domain: str) -> list:
+    """Return ``(func, args)`` for the planned lookups that depend on first-wave answers."""
+    calls = []
+    for kind, name in plan:
+        if "{a}" in name:
+            calls += [(ptr_lookup, (ip,)) for ip in dns_query("A", domain)]
+        elif "{ns}" in name:
+            calls += [(dns_query, (kind, host.rstrip("."))) for host in dns_query("NS", domain)]
+        # ``{selector}`` is left to collect_dkim, which fans out on its own
+        # pool as soon as the first wave answers ``_domainkey``.
+    return calls
+
+
+def send_first_wave(plan) -> list:
+    """Send every DNS lookup in ``plan`` whose name is known up front; return their futures.
+
+    Answers land in the query cache, where collectors pick them up or join
+    them in flight. With the cache disabled nothing could be shared, so no
+    lookups are sent ahead.
+    """
+    if QUERY_CACHE.maxsize <= 0:
+        return []
+    pool = _wave_pool()
+    return [pool.submit(dns_query, kind, name) for kind, name in plan if kind.isupper() and "{" not in name]
+
+
+def send_second_wave(first, plan, domain: str):
+    """Wait for the ``first`` wave, then send the lookups that depend on its answers and wait for them."""
+    if not first:
+        return
+    wait(first)
+    pool = _wave_pool()
+    wait([pool.submit(func, *args) for func, args in _second_wave(plan, domain)])
+
+
+def _domain_missing(domain: str, plan) -> bool:
+    """Return True if ``domain`` is NXDOMAIN, probing its NS only when that can save work.
+
+    Nothing below a name that does not exist can answer, so a dead domain
+    costs this single query and the lookup waves wait for it. The probe's
+    NS answer is reused by the first wave. A plan of a single lookup, such
+    as a DMARC-only sweep, would pay double for the probe and skips it.
+    """
+    if len(plan) <= 1 and ("NS", domain) not in plan:
+        return False
+    return _name_missing(domain, "NS")
+
+
+def build_report(domain: str, authoritative: bool = False) -> dict:
+    """Collect the selected checks for ``domain`` concurrently into a structured report.
+
+    ``domain`` must already be ASCII and valid. The report maps check names
+    to the plain data their collectors return, in display order. A domain
+    that does not exist gets ``"status": "nxdomain"`` and no checks.
+    """
+    table = _check_table(authoritative)
+    plan = plan_lookups([name for name, _, _ in table], domain)
+    if _domain_missing(domain, plan):
+        return {"domain": domain, "status": QUERY_NXDOMAIN, "checks": {}}
+    first = send_first_wave(plan)
+    pool = _check_pool()
+    pool.submit(send_second_wave, first, plan, domain)
+    futures = [(name, pool.submit(STATS.call, "check", name, collect, domain)) for name, collect, _ in table]
+    checks = {name: fut.result() for name, fut in futures}
+    return {"domain": domain, "checks": checks}
+
+
+def _print_jsonl(report: dict):
+    """Print ``report`` as one compact JSON line."""
+    _print(json.dumps(report, separators=(",", ":"), ensure_ascii=False), flush=True)
+
+
+def _report_invalid_domain(domain: str):
+    """Tell the user ``domain`` was skipped, in the current output format."""
+    if OUTPUT_FORMAT == "jsonl":
+        _print_jsonl({"domain": domain, "error": "invalid domain"})
+    else:
+        validate_domain(domain)
+
+
+def run_all_checks(domain: str, authoritative: bool = False):
+    """Run all DNS and RDAP checks for ``domain``."""
+    STATS.call("domain", "", _run_all_checks, domain, authoritative)
+    STATS.count("domains")
+
+
+def _run_all_checks(domain: str, authoritative: bool = False):
+    """Check ``domain`` and print the results in the current output format."""
+    ascii_domain = domain_to_ascii(domain)
+    if not _is_valid_domain(ascii_domain):
+        _report_invalid_domain(ascii_domain)
+        return
+    if SNAPSHOT_STORE is not None:
+        _print_report_diff(ascii_domain, authoritative)
+        return
+    if OUTPUT_FORMAT == "jsonl":
+        _print_jsonl(build_report(ascii_domain, authoritative))
+        return
+
+    _print(f"\n{BLUE}{'='*42}{NC}")
+    _print(f"{BLUE}🔍 DNS / RDAP checks for:{NC} {YELLOW}{ascii_domain}{NC}")
+    _print(f"{BLUE}{'='*42}{NC}")
+
+    table = _check_table(authoritative)
+    plan = plan_lookups([name for name, _, _ in table], ascii_domain)
+    if _domain_missing(ascii_domain, plan):
+        _print(f"{SYM_ERR} {ascii_domain} does not exist (NXDOMAIN); skipping all checks.")
+        return
+    first = send_first_wave(plan)
+
+    # Every check is independent, so start them all at once, alongside the
+    # planned lookup waves, and print each section as soon as it and all
+    # sections before it have finished.
+    pool = _check_pool()
+    pool.submit(send_second_wave, first, plan, ascii_domain)
+    futures = [pool.submit(_capture_output, STATS.call, "check", name, render, ascii_domain)
+               for name, _, render in table]
+    for fut in futures:
+        _print(fut.result(), end="")
+
+    _print(f"\n{GREEN}✅ Done with {ascii_domain}.{NC}")
+
+def load_domain_history():
+    """Return a list of previously used domains from history file."""
+    if not os.path.isfile(DOMAIN_HISTORY_FILE):
+        return []
+    lines = []
+    with open(DOMAIN_HISTORY_FILE, "r", encoding="utf-8", errors="ignore") as f:
+        for line in f:
+            line = line.strip()
+            if line and line not in lines:
+                lines.append(line)
+    return lines
+
+def append_domain_history(domain: str):
+    """Append ``domain`` to the domain history file."""
+    with open(DOMAIN_HISTORY_FILE, "a", encoding="utf-8") as f:
+        f.write(domain + "\n")
+
+
+class ResultsStore:
+    """SQLite (WAL mode) record of finished domains and their output, for ``--resume``.
+
+    Results are buffered and written in one transaction every
+    ``RESULTS_BATCH_SIZE`` domains or ``RESULTS_FLUSH_INTERVAL`` seconds, so
+    the store never holds up the checks. Only the batch thread uses it.
+    """
+
+    def __init__(self, path: str):
+        if os.path.dirname(path):
+            os.makedirs(os.path.dirname(path), exist_ok=True)
+        self._db = sqlite3.connect(path)
+        self._db.execute("PRAGMA journal_mode=WAL")
+        self._db.execute("PRAGMA synchronous=NORMAL")
+        self._db.execute("CREATE TABLE IF NOT EXISTS results (domain TEXT PRIMARY KEY, completed REAL, output TEXT)")
+        self._pending = []
+        self._last_flush = time.monotonic()
+
+    def is_done(self, domain: str, max_age: float) -> bool:
+        """Return ``True`` if ``domain`` finished less than ``max_age`` seconds ago."""
+        row = self._db.execute(
+            "SELECT 1 FROM results WHERE domain = ? AND completed > ?",
+            (domain.lower(), time.time() - max_age),
+        ).fetchone()
+        return row is not None
+
+    def pending(self, domains, max_age: float):
+        """Yield the ``domains`` that have no fresh result yet."""
+        for dm in domains:
+            if not self.is_done(dm, max_age):
+                yield dm
+
+    def add(self, domain: str, output: str):
+        """Queue ``domain``'s output, flushing if the batch is full or old enough."""
+        self._pending.append((domain.lower(), time.time(), output))
+        if len(self._pending) >= RESULTS_BATCH_SIZE or \
+           time.monotonic() - self._last_flush >= RESULTS_FLUSH_INTERVAL:
+            self.flush()
+
+    def flush(self):
+        """Write every queued result in a single transaction."""
+        if self._pending:
+            with self._db:
+                self._db.executemany(
+                    "INSERT OR REPLACE INTO results (domain, completed, output) VALUES (?, ?, ?)",
+                    self._pending,
+                )
+            self._pending = []
+        self._last_flush = time.monotonic()
+
+    def close(self):
+        """Flush outstanding results and close the database."""
+        self.flush()
+        self._db.close()
+
+
+class SnapshotStore:
+    """SQLite store of the last DNS answers and per-domain reports for incremental re-scans.
+
+    Answers are reused until their TTL, capped at ``SNAPSHOT_MAX_AGE``, has
+    run out since they were fetched; only expired ones are queried again.
+    Writes are committed every ``SNAPSHOT_COMMIT_EVERY`` changes and on close.
+    """
+
+    def __init__(self, path: str):
+        if os.path.dirname(path):
+            os.makedirs(os.path.dirname(path), exist_ok=True)
+        self._db = sqlite3.connect(path, check_same_thread=False)
+        self._db.execute("PRAGMA journal_mode=WAL")
+        self._db.execute("PRAGMA synchronous=NORMAL")
+        self._db.execute("CREATE TABLE IF NOT EXISTS answers "
+                         "(name TEXT, rdtype TEXT, records TEXT, ttl INTEGER, fetched REAL, status TEXT, "
+                         "PRIMARY KEY (name, rdtype))")
+        self._db.execute("CREATE TABLE IF NOT EXISTS reports (domain TEXT PRIMARY KEY, report TEXT, updated REAL)")
+        self._lock = threading.Lock()
+        self._uncommitted = 0
+
+    def _write(self, sql: str, params):
+        """Run a write under the lock, committing once enough have accumulated."""
+        with self._lock:
+            self._db.execute(sql, params)
+            self._uncommitted += 1
+            if self._uncommitted >= SNAPSHOT_COMMIT_EVERY:
+                self._db.commit()
+                self._uncommitted = 0
+
+    def answer(self, key, fetch):
+        """Return ``(records, ttl)`` for ``key`` from the snapshot if still fresh, else ``fetch()``."""
+        name, rdtype = key
+        with self._lock:
+            row = self._db.execute(
+                "SELECT records, ttl, fetched, status FROM answers WHERE name = ? AND rdtype = ?", (name, rdtype)
+            ).fetchone()
+        if row is not None:
+            records, ttl, fetched, status = row
+            remaining = fetched + min(ttl, SNAPSHOT_MAX_AGE) - time.time()
+            if remaining > 0:
+                return DNSResult(json.loads(records), status), remaining
+        records, ttl = fetch()
+        if ttl > 0:
+            self._write(
+                "INSERT OR REPLACE INTO answers (name, rdtype, records, ttl, fetched, status) "
+                "VALUES (?, ?, ?, ?, ?, ?)",
+                (name, rdtype, json.dumps(list(records)), int(ttl), time.time(), getattr(records, "status", None)),
+            )
+        return records, ttl
+
+    def swap_report(self, domain: str, report: dict):
+        """Store ``report`` as the latest for ``domain`` and return the previous one, if any."""
+        with self._lock:
+            row = self._db.execute("SELECT report FROM reports WHERE domain = ?", (domain,)).fetchone()
+        self._write(
+            "INSERT OR REPLACE INTO reports (domain, report, updated) VALUES (?, ?, ?)",
+            (domain, json.dumps(_canonical(report), separators=(",", ":")), time.time()),
+        )
+        return json.loads(row[0]) if row else None
+
+    def close(self):
+        """Commit outstanding writes and close the database."""
+        with self._lock:
+            self._db.commit()
+            self._db.close()
+
+
+def _canonical(value):
+    """Return ``value`` as plain JSON data with every list sorted.
+
+    Resolvers rotate round-robin RRsets, so the same records can come back
+    in a different order on each scan.
+    """
+    if isinstance(value, dict):
+        return {k: _canonical(v) for k, v in value.items()}
+    if isinstance(value, (list, tuple)):
+        return sorted((_canonical(v) for v in value), key=lambda v: json.dumps(v, sort_keys=True))
+    return value
+
+
+def _report_changes(previous, report: dict) -> dict:
+    """Return ``{check: {"old": ..., "new": ...}}`` for checks that differ from ``previous``."""
+    old_checks = _canonical(previous["checks"]) if previous else {}
+    new_checks = _canonical(report["checks"])
+    return {
+        name: {"old": old_checks.get(name), "new": new_checks.get(name)}
+        for name in {**old_checks, **new_checks}
+        if old_checks.get(name) != new_checks.get(name)
+    }
+
+
+def _print_report_diff(domain: str, authoritative: bool = False):
+    """Re-scan ``domain`` and print only what changed since its last snapshot."""
+    report = build_report(domain, authoritative)
+    previous = SNAPSHOT_STORE.swap_report(domain, report)
+    changes = _report_changes(previous, report)
+    if not changes:
+        return
+    if OUTPUT_FORMAT == "jsonl":
+        _print_jsonl({"domain": domain, "first_scan": previous is None, "changes": changes})
+        return
+    _print(f"\n{BLUE}🔍 Changes for:{NC} {YELLOW}{domain}{NC}")
+    if previous is None:
+        _print(f"{SYM_OK} First snapshot recorded ({len(changes)} checks).")
+        return
+    for name, change in changes.items():
+        _print(f"{SYM_WARN} {name} changed:")
+        _print(f"   - {json.dumps(change['old'], ensure_ascii=False)}")
+        _print(f"   + {json.dumps(change['new'], ensure_ascii=False)}")
+
+
+def _record_result(domain: str, output: str):
+    """Print a finished domain's output and save it to the results store, if any."""
+    _print(output, end="", flush=True)
+    if RESULTS_STORE is not None:
+        RESULTS_STORE.add(domain, output)
+
+
+def _hit_rate(hits: int, misses: int) -> str:
+    """Return ``hits`` out of all lookups as a percentage, with the raw counts."""
+    total = hits + misses
+    return f"{100 * hits / total:5.1f}% ({hits}/{total})" if total else "    - (0/0)"
+
+
+def format_stats(stats: Stats) -> str:
+    """Return the ``--stats`` summary: latency tables, cache hit rates, retries and timeouts."""
+    elapsed = time.monotonic() - stats.started
+    domains = stats.total("domains")
+    lines = [f"\n{BLUE}📊 Run statistics:{NC} {domains} domains in {elapsed:.1f}s"
+             f" ({domains / elapsed if elapsed else 0:.1f}/s)"]
+    titles = {"check": "Checks", "resolver": "Resolvers", "rdtype": "Record types",
+              "rdap": "RDAP endpoints", "whois": "WHOIS servers", "http": "HTTPS fetches"}
+    with stats._lock:
+        histograms = sorted(stats.histograms.items(), key=lambda kv: -kv[1].total)
+        counters = dict(stats.counters)
+    for kind, title in titles.items():
+        rows = [(label, h) for (k, label), h in histograms if k == kind]
+        if not rows:
+            continue
+        lines.append(f"{title:<34} {'count':>7} {'total s':>9} {'mean ms':>8} {'p50 ms':>8} "
+                     f"{'p95 ms':>8} {'max ms':>8}")
+        for label, h in rows:
+            extra = ""
+            if kind == "resolver":
+                extra = (f"  timeouts {counters.get(('timeouts', label), 0)}"
+                         f"  servfails {counters.get(('servfails', label), 0)}"
+                         f"  retries {counters.get(('retries', label), 0)}")
+            elif kind == "rdap" and counters.get(("rdap_throttled", label)):
+                extra = f"  throttled {counters[('rdap_throttled', label)]}"
+            lines.append(f"  {label[:32]:<32} {h.count:>7} {h.total:>9.2f} {1000 * h.total / h.count:>8.1f} "
+                         f"{1000 * h.quantile(0.5):>8.1f} {1000 * h.quantile(0.95):>8.1f} "
+                         f"{1000 * h.max:>8.1f}{extra}")
+    lines.append(f"DNS cache hit rate:   {_hit_rate(QUERY_CACHE.hits, QUERY_CACHE.misses)}")
+    rdap_rate = _hit_rate(counters.get(("rdap_cache", "hit"), 0), counters.get(("rdap_cache", "miss"), 0))
+    lines.append(f"RDAP cache hit rate:  {rdap_rate}")
+    lines.append(f"WHOIS cache hit rate: {_hit_rate(WHOIS_CACHE.hits, WHOIS_CACHE.misses)}")
+    lines.append(f"Retries: {stats.total('retries')}  Timeouts: {stats.total('timeouts')}"
+                 f"  SERVFAILs: {stats.total('servfails')}  RDAP throttled: {stats.total('rdap_throttled')}")
+    return "\n".join(lines)
+
+
+def _run_parallel_batch(domain_list, jobs: int):
+    """Check up to ``jobs`` domains at once, printing each domain's block whole."""
+    pending = {}
+
+    def _flush(done):
+        for fut in done:
+            _record_result(pending.pop(fut), fut.result())
+
+    with ThreadPoolExecutor(max_workers=jobs) as pool:
+        for dm in domain_list:
+            if len(pending) >= jobs:
+                done, _ = wait(pending, return_when=FIRST_COMPLETED)
+                _flush(done)
+            pending[pool.submit(_capture_output, run_all_checks, dm, AUTHORITATIVE)] = dm
+        while pending:
+            done, _ = wait(pending, return_when=FIRST_COMPLETED)
+            _flush(done)
+
+
+def _run_batch_mode(domain_list):
+    """Run DNS checks for an iterable of domains and exit.
+
+    ``domain_list`` is consumed lazily: with ``--jobs`` only a bounded number
+    of domains are pulled ahead of the workers.
+    """
+    try:
+        if JOBS > 1:
+            _run_parallel_batch(domain_list, JOBS)
+        elif RESULTS_STORE is not None:
+            for dm in domain_list:
+                _record_result(dm, _capture_output(run_all_checks, dm, AUTHORITATIVE))
+        else:
+            for dm in domain_list:
+                run_all_checks(dm, AUTHORITATIVE)
+    finally:
+        if RESULTS_STORE is not None:
+            RESULTS_STORE.close()
+        if SNAPSHOT_STORE is not None:
+            SNAPSHOT_STORE.close()
+        if SHOW_STATS:
+            print(format_stats(STATS), file=sys.stderr)
+    sys.exit(0)
+
+
+class CheckService:
+    """Asyncio HTTP/1.1 server answering ``GET /check?domain=`` with ``build_report`` JSON.
+
+    Every request shares this process's resolver pool, HTTP sessions, RDAP
+    bootstrap map and caches. Concurrent requests for the same domain wait
+    on one check, at most ``max_active`` checks run at once, and once
+    ``max_queue`` more are waiting new work is turned away with 503.
+    ``/metrics`` serves the OpenMetrics text and ``/healthz`` a liveness probe.
+    """
+
+    def __init__(self, max_active: int = SERVE_MAX_ACTIVE, max_queue: int = SERVE_MAX_QUEUE):
+        self.max_active = max_active
+        self.max_queue = max_queue
+        self._pool = ThreadPoolExecutor(max_workers=max_active, thread_name_prefix="dnstool-serve")
+        self._inflight = {}
+        self._loop = None
+        self._stop = None
+
+    async def check(self, domain: str, authoritative: bool = False):
+        """Return ``(http_status, body)`` for a check of ``domain``."""
+        import asyncio
+        ascii_domain = domain_to_ascii(domain.strip()).lower()
+        if not _is_valid_domain(ascii_domain):
+            return 400, {"domain": ascii_domain, "error": "invalid domain"}
+        key = (ascii_domain, authoritative)
+        fut = self._inflight.get(key)
+        if fut is not None:
+            STATS.count("serve_coalesced")
+        elif len(self._inflight) >= self.max_active + self.max_queue:
+            STATS.count("serve_rejected")
+            return 503, {"domain": ascii_domain, "error": "too many checks in progress"}
+        else:
+            fut = asyncio.get_running_loop().run_in_executor(self._pool, self._report, ascii_domain, authoritative)
+            self._inflight[key] = fut
+            fut.add_done_callback(lambda _: self._inflight.pop(key, None))
+        try:
+            # Shielded so a client that hangs up does not cancel a shared check.
+            return 200, await asyncio.shield(fut)
+        except Exception as e:
+            logging.error("Check of %s failed: %s", ascii_domain, e)
+            return 500, {"domain": ascii_domain, "error": str(e)}
+
+    @staticmethod
+    def _report(domain: str, authoritative: bool) -> dict:
+        """Build ``domain``'s report on a worker thread, counting it like a batch domain."""
+        report = STATS.call("domain", "", build_report, domain, authoritative)
+        STATS.count("domains")
+        return report
+
+    async def _route(self, method: str, target: str):
+        """Return ``(status, body, content_type)`` for one request."""
+        url = urlsplit(target)
+        if method != "GET":
+            return 405, {"error": "method not allowed"}, None
+        if url.path == "/check":
+            params = parse_qs(url.query)
+            domain = params.get("domain", [""])[0]
+            if not domain:
+                return 400, {"error": "missing domain parameter"}, None
+            authoritative = params.get("authoritative", ["0"])[0].lower() in ("1", "true", "yes")
+            status, body = await self.check(domain, authoritative)
+            return status, body, None
+        if url.path == "/metrics":
+            return 200, render_metrics(STATS), "application/openmetrics-text; version=1.0.0; charset=utf-8"
+        if url.path == "/healthz":
+            return 200, {"status": "ok", "checks_in_progress": len(self._inflight)}, None
+        return 404, {"error": "not found"}, None
+
+    async def _handle(self, reader, writer):
+        """Serve requests on one connection until the client closes it or asks to."""
+        import asyncio
+        try:
+            while True:
+                try:
+                    head = await reader.readuntil(b"\r\n\r\n")
+                except (asyncio.IncompleteReadError, asyncio.LimitOverrunError, ConnectionError):
+                    break
+                lines = head.decode("latin-1").split("\r\n")
+                parts = lines[0].split()
+                if len(parts) != 3:
+                    break
+                method, target, version = parts
+                headers = {}
+                for ln in lines[1:]:
+                    name, _, value = ln.partition(":")
+                    if name:
+                        headers[name.strip().lower()] = value.strip()
+                length = headers.get("content-length", "0")
+                if length.isdigit() and int(length):
+                    await reader.readexactly(int(length))  # bodies are not used; skip them
+                keep_alive = version == "HTTP/1.1" and headers.get("connection", "").lower() != "close"
+                status, body, ctype = await self._route(method, target)
+                if ctype is None:
+                    body, ctype = json.dumps(body, separators=(",", ":"), ensure_ascii=False), "application/json"
+                data = body.encode()
+                head_lines = [
+                    f"HTTP/1.1 {status} {HTTPStatus(status).phrase}",
+                    f"Content-Type: {ctype}",
+                    f"Content-Length: {len(data)}",
+                    f"Connection: {'keep-alive' if keep_alive else 'close'}",
+                ]
+                if status == 503:
+                    head_lines.append("Retry-After: 1")
+                writer.write(("\r\n".join(head_lines) + "\r\n\r\n").encode() + data)
+                await writer.drain()
+                if not keep_alive:
+                    break
+        except ConnectionError:
+            pass
+        finally:
+            writer.close()
+
+    async def serve(self, addr: str, port: int, ready=None):
+        """Accept connections on ``addr:port`` until :meth:`stop`; ``ready(port)`` is called once listening."""
+        import asyncio
+        self._loop = asyncio.get_running_loop()
+        self._stop = asyncio.Event()
+        server = await asyncio.start_server(self._handle, addr, port, backlog=1024)
+        # Warm the RDAP bootstrap map now instead of on the first request.
+        self._loop.run_in_executor(self._pool, _ensure_iana_rdap_data)
+        if ready is not None:
+            ready(server.sockets[0].getsockname()[1])
+        async with server:
+            await self._stop.wait()
+        self._pool.shutdown(wait=False)
+
+    def stop(self):
+        """Stop :meth:`serve`; safe to call from any thread."""
+        if self._loop is not None:
+            self._loop.call_soon_threadsafe(self._stop.set)
+
+
+def _run_serve_mode(addr: str, port: int, max_active: int):
+    """Run the HTTP check service until interrupted."""
+    import asyncio
+    service = CheckService(max_active)
+
+    def ready(bound_port):
+        print(f"{GREEN}Serving checks on http://{addr}:{bound_port}/check?domain=...{NC}", flush=True)
+
+    try:
+        asyncio.run(service.serve(addr, port, ready))
+    except KeyboardInterrupt:
+        print("\nStopping DNS Tool service...")
+
+
+def _run_interactive_mode():
+    """Run the interactive prompt loop for DNS checks."""
+    try:
+        from prompt_toolkit import PromptSession
+        from prompt_toolkit.history import FileHistory
+        from prompt_toolkit.formatted_text import ANSI
+    except ImportError:  # pragma: no cover - environment lacks prompt_toolkit
+        print("Error: the 'prompt_toolkit' package is required for interactive mode.\n"
+              "Install it with 'pip install prompt_toolkit'.")
+        sys.exit(1)
+    print(f"{YELLOW}Interactive Mode. Type a domain and press Enter to run checks immediately.{NC}")
+    print(f"{YELLOW}Type 'exit' or press Enter on a blank line to quit.{NC}")
+    Path(DOMAIN_HISTORY_FILE).touch(exist_ok=True)
+    session = PromptSession(history=FileHistory(DOMAIN_HISTORY_FILE))
+    while True:
+        try:
+            dom = session.prompt(ANSI(f"\n{BOLD}Domain:{NC} ")).strip()
+        except (EOFError, KeyboardInterrupt):
+            print("\nExiting DNS Tool...")
+            break
+        if not dom or dom.lower() == "exit":
+            print("Exiting DNS Tool...")
+            break
+        run_all_checks(dom, AUTHORITATIVE)
+        append_domain_history(dom)
+
+
+def _read_domain_lines(stream):
+    """Yield the non-blank, stripped lines of ``stream`` one at a time."""
+    for line in stream:
+        line = line.strip()
+        if line:
+            yield line
+
+
+def _iter_domain_entries(args):
+    """Yield raw domain entries from ``-f`` and then the positional arguments.
+
+    ``-`` as the file name or as a positional argument reads standard input.
+    """
+    if args.file == "-":
+        yield from _read_domain_lines(sys.stdin)
+    elif args.file:
+        with open(args.file, "r", encoding="utf-8", errors="ignore") as f:
+            yield from _read_domain_lines(f)
+    for dm in args.domains or []:
+        if dm == "-":
+            yield from _read_domain_lines(sys.stdin)
+        else:
+            yield dm
+
+
+class DigestSet:
+    """Set of names stored as 64-bit blake2b digests in one flat table.
+
+    Open addressing with linear probing over a bytearray of 8-byte slots,
+    zero marking an empty one. The table doubles when half full, so each
+    name costs 16-32 bytes, against about 70 for a ``set`` of ints and
+    over 100 for the strings. Two names collide with probability about
+    n**2 / 2**65, around 3e-8 for a million names.
+    """
+
+    def __init__(self, slots: int = 1024):
+        self._table = memoryview(bytearray(8 * slots)).cast("Q")
+        self._mask = slots - 1
+        self._size = 0
+
+    def __len__(self) -> int:
+        return self._size
+
+    def add(self, name: str) -> bool:
+        """Add ``name`` and return True, or return False if it was already present."""
+        key = int.from_bytes(hashlib.blake2b(name.encode(), digest_size=8).digest(), "big") or 1
+        i = key & self._mask
+        while self._table[i]:
+            if self._table[i] == key:
+                return False
+            i = (i + 1) & self._mask
+        self._table[i] = key
+        self._size += 1
+        if 2 * self._size > self._mask:
+            self._grow()
+        return True
+
+    def _grow(self):
+        """Move every digest into a table twice the size."""
+        old = self._table
+        self._table = memoryview(bytearray(16 * len(old))).cast("Q")
+        self._mask = 2 * len(old) - 1
+        for key in old:
+            if key:
+                i = key & self._mask
+                while self._table[i]:
+                    i = (i + 1) & self._mask
+                self._table[i] = key
+
+
+def _iter_domains(entries):
+    """Normalise, validate and deduplicate domain ``entries`` lazily.
+
+    Invalid entries are reported and dropped. Duplicates are detected with
+    a ``DigestSet``, which needs 16-32 bytes per distinct domain.
+    """
+    seen = DigestSet()
+    for raw in entries:
+        dm = domain_to_ascii(raw)
+        if not _is_valid_domain(dm):
+            _report_invalid_domain(dm)
+            continue
+        if seen.add(dm.lower()):
+            yield dm
+
+
+def main():
+    """Entry point for the command-line interface."""
+    global VERBOSE, RESOLVERS, AUTHORITATIVE, JOBS, QUERY_MODE
+    global RDAP_CACHE_MAX_AGE, RDAP_RATE, OUTPUT_FORMAT, RESULTS_STORE, SNAPSHOT_STORE, SNAPSHOT_MAX_AGE
+    global DKIM_SELECTORS, SHOW_STATS, CHECKS
+    parser = argparse.ArgumentParser(
+        description="DNS Tool (Python Edition) + Prompt Toolkit arrow-key history, with ANSI prompt fix."
+    )
+    parser.add_argument("-v", "--verbose", action="store_true", help="Verbose/debug output")
+    parser.add_argument("-f", "--file", type=str, help="Read domains from file ('-' for standard input)")
+    parser.add_argument("-r", "--resolver", action="append",
+                        help="Specify resolver IP, tls://host or https:// URL (can be repeated)")
+    parser.add_argument("-a", "--authoritative", action="store_true", help="Query authoritative nameservers directly")
+    parser.add_argument("--format", choices=OUTPUT_FORMATS, default=OUTPUT_FORMAT,
+                        help="Output format: coloured text, or one JSON object per domain (jsonl)")
+    parser.add_argument("-j", "--jobs", type=int, default=1, help="Number of domains to check in parallel in batch mode")
+    parser.add_argument("--workers", type=int,
+                        help="Threads shared by all domains for running checks (default: enough for every job)")
+    parser.add_argument("--max-inflight", type=int,
+                        help=f"Maximum concurrent queries per resolver (default: {INFLIGHT_PER_DOMAIN} per job)")
+    parser.add_argument("--query-mode", choices=QUERY_MODES, default=QUERY_MODE,
+                        help="How to use multiple resolvers: try them in order, hedge slow ones, or race them all")
+    parser.add_argument("--transport", choices=TRANSPORTS, default=TRANSPORT,
+                        help="How to reach the resolvers: plain DNS, DNS-over-TLS or DNS-over-HTTPS")
+    parser.add_argument("--cache-size", type=int, default=QUERY_CACHE_SIZE,
+                        help="Maximum number of cached DNS answers (0 disables the cache)")
+    parser.add_argument("--rdap-max-age", type=int, default=RDAP_CACHE_MAX_AGE,
+                        help="Reuse cached RDAP responses younger than this many seconds (0 disables)")
+    parser.add_argument("--rdap-rate", type=float, default=RDAP_RATE,
+                        help="Maximum RDAP requests per second to each RDAP server")
+    parser.add_argument("--store", type=str,
+                        help="Record each finished domain in this SQLite results store")
+    parser.add_argument("--resume", action="store_true",
+                        help="Skip domains already in the results store (default store if --store is not given)")
+    parser.add_argument("--resume-max-age", type=int, default=RESUME_MAX_AGE,
+                        help="With --resume, only skip results younger than this many seconds")
+    parser.add_argument("--incremental", action="store_true",
+                        help="Reuse unexpired answers from the last scan and print only what changed")
+    parser.add_argument("--snapshot-file", type=str, default=SNAPSHOT_FILE,
+                        help="SQLite file holding the snapshots used by --incremental")
+    parser.add_argument("--snapshot-max-age", type=int, default=SNAPSHOT_MAX_AGE,
+                        help="With --incremental, re-query answers older than this many seconds even if their TTL is longer")
+    parser.add_argument("--stats", action="store_true",
+                        help="Print timing histograms, cache hit rates, retries and timeouts after batch mode")
+    parser.add_argument("--metrics-port", type=int,
+                        help="Serve OpenMetrics/Prometheus metrics on this local port while running")
+    parser.add_argument("--serve", type=int, metavar="PORT",
+                        help="Run as an HTTP JSON service answering GET /check?domain= on this port")
+    parser.add_argument("--serve-addr", type=str, default=SERVE_ADDR, help="Address for --serve to listen on")
+    parser.add_argument("--serve-max-active", type=int, default=SERVE_MAX_ACTIVE,
+                        help="Checks --serve runs at once; more are queued, then refused with 503")
+    parser.add_argument("--checks", type=str,
+                        help=f"Comma-separated checks to run instead of all of them: {', '.join(CHECK_NAMES)}")
+    parser.add_argument("--profile", action="append", choices=sorted(CHECK_PROFILES),
+                        help="Run the checks of this profile (can be repeated and combined with --checks)")
+    parser.add_argument("--dkim-selectors", type=str,
+                        help="File of DKIM selectors to probe, one per line (replaces the built-in list)")
+    parser.add_argument("domains", nargs="*", help="Domains to check ('-' reads them from standard input)")
+    parser.add_argument('--version', action='version', version=__version__, help="show program's version number and exit")
+    args = parser.parse_args()
+    if args.jobs < 1:
+        parser.error("--jobs must be at least 1")
+    if args.workers is not None and args.workers < 1:
+        parser.error("--workers must be at least 1")
+    if args.max_inflight is not None and args.max_inflight < 1:
+        parser.error("--max-inflight must be at least 1")
+    if args.rdap_rate <= 0:
+        parser.error("--rdap-rate must be positive")
+    if args.serve_max_active < 1:
+        parser.error("--serve-max-active must be at least 1")
+    if args.checks or args.profile:
+        selected = {c.strip().lower() for c in (args.checks or "").split(",") if c.strip()}
+        unknown = selected.difference(CHECK_NAMES)
+        if unknown:
+            parser.error(f"unknown check(s): {', '.join(sorted(unknown))}")
+        for profile in args.profile or ():
+            selected.update(CHECK_PROFILES[profile])
+        if not selected:
+            parser.error("--checks selects no checks")
+        CHECKS = tuple(c for c in CHECK_NAMES if c in selected)
+
+    log_level = logging.ERROR if args.verbose else logging.CRITICAL
+    logging.getLogger().setLevel(log_level)
+
+    VERBOSE = args.verbose
+    if args.resolver:
+        RESOLVERS = args.resolver
+    RESOLVERS = _with_transport(RESOLVERS, args.transport)
+    AUTHORITATIVE = args.authoritative
+    JOBS = args.jobs
+    _size_pools(args.serve_max_active if args.serve is not None else args.jobs, args.workers, args.max_inflight)
+    QUERY_CACHE.maxsize = args.cache_size
+    QUERY_MODE = args.query_mode
+    OUTPUT_FORMAT = args.format
+    RDAP_CACHE_MAX_AGE = args.rdap_max_age
+    RDAP_RATE = args.rdap_rate
+    SNAPSHOT_MAX_AGE = args.snapshot_max_age
+    SHOW_STATS = args.stats
+    if args.metrics_port is not None:
+        try:
+            start_metrics_server(args.metrics_port)
+        except OSError as e:
+            print(f"{RED}Cannot serve metrics on port {args.metrics_port}:{NC} {e}")
+            sys.exit(1)
+
+    if args.dkim_selectors:
+        if not os.path.isfile(args.dkim_selectors):
+            print(f"{RED}File not found:{NC} {args.dkim_selectors}")
+            sys.exit(1)
+        with open(args.dkim_selectors, "r", encoding="utf-8") as fh:
+            DKIM_SELECTORS = list(dict.fromkeys(s for s in _read_domain_lines(fh) if not s.startswith("#")))
+
+    if args.file and args.file != "-" and not os.path.isfile(args.file):
+        print(f"{RED}File not found:{NC} {args.file}")
+        sys.exit(1)
+    if args.serve is not None:
+        _run_serve_mode(args.serve_addr, args.serve, args.serve_max_active)
+    elif args.file or args.domains:
+        domains = _iter_domains(_iter_domain_entries(args))
+        if args.store or args.resume:
+            RESULTS_STORE = ResultsStore(args.store or RESULTS_STORE_FILE)
+        if args.resume:
+            domains = RESULTS_STORE.pending(domains, args.resume_max_age)
+        if args.incremental:
+            SNAPSHOT_STORE = SnapshotStore(args.snapshot_file)
+        _run_batch_mode(domains)
+    else:
+        _run_interactive_mode()
+
+if __name__ == "__main__":
+    main()
@@ -1,4 +1,11 @@
+import io
+import json
+import socket
+import ssl
+import threading
+import time
 import types
+from concurrent.futures import ThreadPoolExecutor
 import pytest
 
 import pathlib, sys
@@ -7,16 +14,54 @@ sys.path.insert(0, str(pathlib.Path(__file__).resolve().parents[1]))
 # Provide minimal dummy modules so dnstool can be imported without optional
 # dependencies such as requests or dnspython. These tests only exercise
 # helper functions that do not require network access.
-sys.modules.setdefault('requests', types.SimpleNamespace())
-dns_stub = types.SimpleNamespace(
-    resolver=types.SimpleNamespace(Resolver=None)
-)
-sys.modules.setdefault('dns', dns_stub)
-sys.modules.setdefault('dns.resolver', dns_stub.resolver)
+try:
+    import requests  # noqa: F401
+except ImportError:
+    sys.modules.setdefault('requests', types.SimpleNamespace())
+try:
+    import dns.resolver  # noqa: F401
+except ImportError:
+    dns_stub = types.SimpleNamespace(
+        resolver=types.SimpleNamespace(Resolver=None),
+        reversename=types.SimpleNamespace(),
+        rdatatype=types.SimpleNamespace(),
+        flags=types.SimpleNamespace(),
+        inet=types.SimpleNamespace(),
+        nameserver=types.SimpleNamespace(Do53Nameserver=object, DoTNameserver=object, DoHNameserver=object),
+        message=types.SimpleNamespace(),
+        query=types.SimpleNamespace(),
+        exception=types.SimpleNamespace(),
+    )
+    sys.modules.setdefault('dns', dns_stub)
+    for _name in ('resolver', 'reversename', 'rdatatype', 'flags', 'inet', 'nameserver', 'message', 'query',
+                  'exception'):
+        sys.modules.setdefault(f'dns.{_name}', getattr(dns_stub, _name))
 
 import dnstool
 
 
+@pytest.fixture(autouse=True)
+def fresh_query_state(monkeypatch, tmp_path):
+    monkeypatch.setattr(dnstool, "IANA_RDAP_CACHE_FILE", str(tmp_path / "iana_rdap.json"))
+    monkeypatch.setattr(dnstool, "IANA_RDAP_MAP", {})
+    monkeypatch.setattr(dnstool, "_IANA_RDAP_LOADED", False)
+    monkeypatch.setattr(dnstool, "_IANA_RDAP_FAILED_AT", None)
+    monkeypatch.setattr(dnstool, "RDAP_CACHE_FILE", str(tmp_path / "rdap_cache.sqlite3"))
+    monkeypatch.setattr(dnstool, "_RDAP_CACHE_DB", None)
+    monkeypatch.setattr(dnstool, "_RDAP_BUCKETS", {})
+    monkeypatch.setattr(dnstool, "_RESOLVER_POOL", {})
+    monkeypatch.setattr(dnstool, "QUERY_CACHE", dnstool.QueryCache())
+    monkeypatch.setattr(dnstool, "_HEALTH", {})
+    monkeypatch.setattr(dnstool, "WHOIS_CACHE", dnstool.QueryCache())
+    monkeypatch.setattr(dnstool, "_WHOIS_SERVERS", {})
+    monkeypatch.setattr(dnstool, "_WHOIS_SLOTS", {})
+    monkeypatch.setattr(dnstool, "_DKIM_HITS", {})
+    monkeypatch.setattr(dnstool, "_DOT_POOL", {})
+    monkeypatch.setattr(dnstool, "_DOH_CLIENT", None)
+    monkeypatch.setattr(dnstool, "STATS", dnstool.Stats())
+    monkeypatch.setattr(dnstool, "CHECKS", None)
+
+
 def test_domain_to_ascii_basic():
     assert dnstool.domain_to_ascii('example.com') == 'example.com'
 
@@ -69,7 +114,8 @@ def test_authoritative_lookup(monkeypatch):
             self.lifetime = None
 
         def resolve(self, domain, rdtype):
-            key = (self.nameservers[0], domain, rdtype)
+            ns = self.nameservers[0]
+            key = (getattr(ns, "address", ns), domain, rdtype)
             data = {
                 # 203.0.113.10 is a TEST-NET address reserved for documentation
                 # per RFC 5737, avoiding use of real-world IPs in tests.
@@ -167,3 +213,1240 @@ def test_run_all_checks_batch_mode(monkeypatch):
 
     for f in funcs:
         assert f in called
+
+
+def test_run_all_checks_concurrent_ordered_output(monkeypatch, capsys):
+    funcs = [
+        "get_registrar",
+        "get_ns_records",
+        "get_mx_records",
+        "get_txt_records",
+        "get_dmarc_record",
+        "get_spf_record",
+        "get_dkim_record",
+        "get_mta_sts",
+        "get_dane_records",
+        "get_bimi_record",
+        "get_dnssec_status",
+        "get_a_record",
+        "get_aaaa_record",
+        "get_caa_record",
+        "get_soa_record",
+        "get_ptr_record",
+    ]
+    # Every check waits for all the others, so this only completes if they
+    # really run at the same time.
+    barrier = threading.Barrier(len(funcs))
+
+    def make_dummy(name):
+        def _dummy(domain):
+            barrier.wait(timeout=5)
+            dnstool._print(f"section {name}")
+        return _dummy
+
+    for f in funcs:
+        monkeypatch.setattr(dnstool, f, make_dummy(f))
+    monkeypatch.setattr(dnstool, "dns_query", lambda *args, **kwargs: [])
+
+    dnstool.run_all_checks("example.com", authoritative=False)
+    out = capsys.readouterr().out
+    positions = [out.index(f"section {f}") for f in funcs]
+    assert positions == sorted(positions)
+
+
+def test_parallel_batch_keeps_domain_blocks_contiguous(monkeypatch, capsys):
+    def fake_run_all_checks(domain, authoritative=False):
+        dnstool._print(f"start {domain}")
+        time.sleep(0.01)
+        dnstool._print(f"end {domain}")
+
+    monkeypatch.setattr(dnstool, "run_all_checks", fake_run_all_checks)
+    monkeypatch.setattr(dnstool, "JOBS", 4)
+
+    domains = [f"d{i}.example" for i in range(10)]
+    with pytest.raises(SystemExit):
+        dnstool._run_batch_mode(domains)
+    lines = capsys.readouterr().out.splitlines()
+    assert len(lines) == 2 * len(domains)
+    for start, end in zip(lines[::2], lines[1::2]):
+        assert start.replace("start", "end") == end
+
+
+def test_resolver_slot_is_shared_per_nameserver(monkeypatch):
+    monkeypatch.setattr(dnstool, "_RESOLVER_SLOTS", {})
+    monkeypatch.setattr(dnstool, "MAX_INFLIGHT_PER_RESOLVER", 1)
+    slot = dnstool._resolver_slot("192.0.2.53")
+    assert dnstool._resolver_slot("192.0.2.53") is slot
+    assert dnstool._resolver_slot("192.0.2.54") is not slot
+    assert slot.acquire(blocking=False)
+    assert not slot.acquire(blocking=False)
+    slot.release()
+
+
+class FakeAnswer(list):
+    def __init__(self, records, ttl):
+        super().__init__(records)
+        self.rrset = types.SimpleNamespace(ttl=ttl)
+
+
+def test_dns_query_uses_ttl_cache(monkeypatch):
+    calls = []
+
+    class CountingResolver:
+        def __init__(self, configure=False):
+            self.nameservers = []
+
+        def resolve(self, domain, rdtype, **kwargs):
+            calls.append((domain, rdtype))
+            if domain == "missing.example.com":
+                raise dnstool.dns.resolver.NXDOMAIN()
+            return FakeAnswer(["v=spf1 -all"], 60)
+
+    cache = dnstool.QUERY_CACHE
+    monkeypatch.setattr(dnstool, "RESOLVERS", ["192.0.2.53"])
+    monkeypatch.setattr(dnstool.dns.resolver, "Resolver", CountingResolver)
+
+    assert dnstool.dns_query("TXT", "example.com") == ["v=spf1 -all"]
+    assert dnstool.dns_query("TXT", "Example.com.") == ["v=spf1 -all"]
+    assert dnstool.dns_query("TXT", "missing.example.com") == []
+    assert dnstool.dns_query("TXT", "missing.example.com") == []
+    assert len(calls) == 2
+    assert cache.stats()["hits"] == 2
+    assert cache.stats()["misses"] == 2
+
+
+def test_query_cache_expiry_and_lru(monkeypatch):
+    now = [1000.0]
+    monkeypatch.setattr(dnstool.time, "monotonic", lambda: now[0])
+    cache = dnstool.QueryCache(maxsize=2)
+
+    cache.lookup("a", lambda: (["1"], 10))
+    cache.lookup("b", lambda: (["2"], 100))
+    cache.lookup("a", lambda: (["x"], 10))  # refreshes "a" in LRU order
+    cache.lookup("c", lambda: (["3"], 100))  # evicts "b"
+    assert cache.lookup("b", lambda: (["2b"], 100)) == ["2b"]
+
+    now[0] += 11
+    assert cache.lookup("a", lambda: (["1b"], 10)) == ["1b"]
+    assert cache.lookup("zero", lambda: (["z"], 0)) == ["z"]
+    assert cache.stats()["size"] == 2
+
+
+def test_resolver_for_reuses_resolver_per_nameserver():
+    first = dnstool._resolver_for("192.0.2.53")
+    assert dnstool._resolver_for("192.0.2.53") is first
+    assert dnstool._resolver_for("192.0.2.53", dnssec=True) is not first
+    assert dnstool._resolver_for("192.0.2.54") is not first
+
+
+def test_pooled_nameserver_uses_fresh_udp_source_ports(monkeypatch):
+    import dns.message
+    import dns.rrset
+
+    monkeypatch.setattr(dnstool, "_SOCKET_POOL", dnstool._SocketPool())
+    server = socket.socket(socket.AF_INET, socket.SOCK_DGRAM)
+    server.bind(("127.0.0.1", 0))
+    sources = []
+
+    def serve():
+        for _ in range(3):
+            wire, addr = server.recvfrom(4096)
+            sources.append(addr)
+            query = dns.message.from_wire(wire)
+            response = dns.message.make_response(query)
+            response.answer.append(dns.rrset.from_text("example.com.", 60, "IN", "A", "203.0.113.10"))
+            server.sendto(response.to_wire(), addr)
+
+    t = threading.Thread(target=serve, daemon=True)
+    t.start()
+    ns = dnstool._PooledNameserver("127.0.0.1", server.getsockname()[1])
+    for _ in range(3):
+        resp = ns.query(dns.message.make_query("example.com", "A"), 2, None, 0, False)
+        assert "203.0.113.10" in resp.to_text()
+    t.join(timeout=2)
+    server.close()
+    assert len({port for _, port in sources}) > 1
+
+
+def test_pooled_tcp_connection_is_closed_after_timeout(monkeypatch):
+    import dns.exception
+    import dns.message
+
+    monkeypatch.setattr(dnstool, "_SOCKET_POOL", dnstool._SocketPool())
+    server = socket.socket()
+    server.bind(("127.0.0.1", 0))
+    server.listen(2)
+    closed = threading.Event()
+
+    def serve():
+        conn = server.accept()[0]
+        wire = conn.recv(int.from_bytes(conn.recv(2), "big"))
+        answer = stand_in_answer(wire)
+        conn.sendall(len(answer).to_bytes(2, "big") + answer)
+        conn.recv(4096)  # the second query goes unanswered
+        if conn.recv(4096) == b"":
+            closed.set()
+        conn.close()
+
+    threading.Thread(target=serve, daemon=True).start()
+    ns = dnstool._PooledNameserver("127.0.0.1", server.getsockname()[1])
+    ns.query(dns.message.make_query("1.example", "A"), 2, None, 0, True)
+    with pytest.raises(dns.exception.Timeout) as timed_out:  # its traceback keeps any leaked socket alive
+        ns.query(dns.message.make_query("2.example", "A"), 0.2, None, 0, True)
+    assert closed.wait(2) and timed_out.value
+    assert dnstool._SOCKET_POOL.acquire(("tcp", "127.0.0.1", server.getsockname()[1])) is None
+    server.close()
+
+
+class SlowFirstResolver:
+    release = threading.Event()  # 192.0.2.1 answers only once this is set
+
+    def __init__(self, configure=False):
+        self.nameservers = []
+
+    def resolve(self, domain, rdtype, **kwargs):
+        ns = self.nameservers[0].address
+        if ns == "192.0.2.1":
+            self.release.wait(5)
+        return FakeAnswer([f"answer from {ns}"], 60)
+
+
+@pytest.mark.parametrize("mode", ["hedged", "race"])
+def test_hedged_query_skips_slow_resolver(monkeypatch, mode):
+    monkeypatch.setattr(dnstool, "RESOLVERS", ["192.0.2.1", "192.0.2.2"])
+    monkeypatch.setattr(dnstool, "QUERY_MODE", mode)
+    monkeypatch.setattr(dnstool, "INITIAL_RTT", 0.01)
+    monkeypatch.setattr(dnstool.dns.resolver, "Resolver", SlowFirstResolver)
+    monkeypatch.setattr(SlowFirstResolver, "release", threading.Event())
+
+    try:
+        # Answered while the first resolver is still holding its query.
+        assert dnstool.dns_query("A", "example.com") == ["answer from 192.0.2.2"]
+    finally:
+        SlowFirstResolver.release.set()
+
+
+def test_hedged_query_moves_on_after_failure(monkeypatch):
+    class FailingFirstResolver(SlowFirstResolver):
+        def resolve(self, domain, rdtype, **kwargs):
+            if self.nameservers[0].address == "192.0.2.1":
+                raise OSError("unreachable")
+            return super().resolve(domain, rdtype, **kwargs)
+
+    monkeypatch.setattr(dnstool, "RESOLVERS", ["192.0.2.1", "192.0.2.2"])
+    monkeypatch.setattr(dnstool, "QUERY_MODE", "hedged")
+    monkeypatch.setattr(dnstool, "INITIAL_RTT", 10.0)
+    monkeypatch.setattr(dnstool.dns.resolver, "Resolver", FailingFirstResolver)
+    real_wait = dnstool.wait
+
+    def wait_without_expiry(fs, timeout=None, return_when=dnstool.FIRST_COMPLETED):
+        done, pending = real_wait(fs, timeout=timeout, return_when=return_when)
+        assert done, "waited out the hedge delay instead of moving on"
+        return done, pending
+
+    monkeypatch.setattr(dnstool, "wait", wait_without_expiry)
+    assert dnstool.dns_query("A", "example.com") == ["answer from 192.0.2.2"]
+
+
+def test_resolver_health_ranks_and_trips_breaker(monkeypatch):
+    monkeypatch.setattr(dnstool, "RESOLVERS", ["192.0.2.1", "192.0.2.2", "192.0.2.3"])
+    slow = dnstool._health_for("192.0.2.1")
+    fast = dnstool._health_for("192.0.2.2")
+    broken = dnstool._health_for("192.0.2.3")
+    for _ in range(3):
+        slow.record_success(0.5)
+        fast.record_success(0.02)
+    assert dnstool._ranked_resolvers()[:2] == ["192.0.2.3", "192.0.2.2"]
+
+    for _ in range(dnstool.BREAKER_THRESHOLD):
+        broken.record_failure("timeout")
+    assert not broken.available()
+    assert broken.timeouts == dnstool.BREAKER_THRESHOLD
+    assert broken.timeout_rate > 0.4
+    assert dnstool._ranked_resolvers() == ["192.0.2.2", "192.0.2.1"]
+
+    broken.open_until = 0.0  # cooldown elapsed: next query is a probe
+    broken.record_success(0.01)
+    assert dnstool._ranked_resolvers()[0] == "192.0.2.3"
+
+
+def test_resolver_health_adaptive_timeout():
+    health = dnstool.ResolverHealth("192.0.2.1")
+    assert health.timeout() == dnstool.DNS_TIME
+    for _ in range(10):
+        health.record_success(0.0005)
+    assert health.timeout() == dnstool.MIN_DNS_TIMEOUT < 1
+    for _ in range(10):
+        health.record_success(2.5)
+    assert dnstool.MIN_DNS_TIMEOUT < health.timeout() <= dnstool.DNS_TIME
+
+
+def test_attempt_timeout_follows_rtt_within_fixed_lifetime(monkeypatch):
+    seen = []
+
+    class TimedResolver:
+        timeout = dnstool.DNS_TIME
+
+        def resolve(self, qname, rdtype, lifetime=None):
+            seen.append((self.timeout, lifetime))
+            return FakeAnswer(["192.0.2.1"], 60)
+
+    monkeypatch.setattr(dnstool, "_resolver_for", lambda ns, dnssec=False: TimedResolver())
+    health = dnstool._health_for("192.0.2.53")
+    for _ in range(10):
+        health.record_success(0.02)
+    dnstool._attempt_query("192.0.2.53", "example.com", "A", str)
+    assert seen == [(dnstool.MIN_DNS_TIMEOUT, dnstool.DNS_TIME * dnstool.DNS_TRIES)]
+
+
+class FakeResponse:
+    def __init__(self, status_code=200, data=None, headers=None):
+        self.status_code = status_code
+        self._data = data or {}
+        self.headers = headers or {}
+
+    def json(self):
+        return self._data
+
+    def raise_for_status(self):
+        if self.status_code >= 400:
+            raise RuntimeError(f"HTTP {self.status_code}")
+
+
+def test_iana_rdap_data_cached_on_disk(monkeypatch):
+    calls = []
+
+    def fake_get(url, timeout=None, headers=None):
+        calls.append(headers)
+        data = {"services": [[["com", "NET"], ["https://rdap.example/"]]]}
+        return FakeResponse(200, data, {"ETag": '"v1"'})
+
+    monkeypatch.setattr(dnstool, "_http_session", lambda kind: types.SimpleNamespace(get=fake_get))
+    dnstool.fetch_iana_rdap_data()
+    assert dnstool.IANA_RDAP_MAP["net"] == ["https://rdap.example/"]
+
+    dnstool.IANA_RDAP_MAP.clear()
+    dnstool.fetch_iana_rdap_data()
+    assert dnstool.IANA_RDAP_MAP["com"] == ["https://rdap.example/"]
+    assert len(calls) == 1
+
+
+def test_iana_rdap_data_revalidated_when_stale(monkeypatch):
+    pathlib.Path(dnstool.IANA_RDAP_CACHE_FILE).write_text(
+        '{"fetched": 0, "etag": "\\"v1\\"", "map": {"com": ["https://rdap.example/"]}}'
+    )
+    calls = []
+
+    def fake_get(url, timeout=None, headers=None):
+        calls.append(headers)
+        return FakeResponse(304)
+
+    monkeypatch.setattr(dnstool, "_http_session", lambda kind: types.SimpleNamespace(get=fake_get))
+    dnstool.fetch_iana_rdap_data()
+    assert calls == [{"If-None-Match": '"v1"'}]
+    assert dnstool.IANA_RDAP_MAP["com"] == ["https://rdap.example/"]
+    assert dnstool._load_iana_cache()["fetched"] > 0
+
+
+def test_iana_rdap_failure_is_retried_after_interval(monkeypatch):
+    attempts = []
+
+    def fake_get(url, timeout=None, headers=None):
+        attempts.append(url)
+        if len(attempts) == 1:
+            raise OSError("network unreachable")
+        return FakeResponse(200, {"services": [[["com"], ["https://rdap.example/"]]]})
+
+    monkeypatch.setattr(dnstool, "_http_session", lambda kind: types.SimpleNamespace(get=fake_get))
+    dnstool._ensure_iana_rdap_data()
+    dnstool._ensure_iana_rdap_data()
+    assert len(attempts) == 1 and not dnstool.IANA_RDAP_MAP
+    monkeypatch.setattr(dnstool, "_IANA_RDAP_FAILED_AT", dnstool._IANA_RDAP_FAILED_AT - dnstool.IANA_RDAP_RETRY_INTERVAL)
+    dnstool._ensure_iana_rdap_data()
+    dnstool._ensure_iana_rdap_data()
+    assert len(attempts) == 2 and dnstool.IANA_RDAP_MAP["com"] == ["https://rdap.example/"]
+
+
+def test_http_session_shared_per_kind(monkeypatch):
+    monkeypatch.setattr(dnstool, "_HTTP_SESSIONS", {})
+    rdap = dnstool._http_session("rdap")
+    assert dnstool._http_session("rdap") is rdap
+    assert dnstool._http_session("mta-sts") is not rdap
+    adapter = rdap.get_adapter("https://rdap.verisign.com/")
+    assert adapter._pool_maxsize == dnstool.HTTP_POOL_MAXSIZE
+
+
+def test_rdap_lookup_uses_response_cache(monkeypatch):
+    calls = []
+
+    def fake_get(url, timeout=None, headers=None):
+        calls.append(url)
+        return FakeResponse(200, {"ldhName": "example.com"})
+
+    monkeypatch.setattr(dnstool, "_http_session", lambda kind: types.SimpleNamespace(get=fake_get))
+    monkeypatch.setattr(dnstool, "_IANA_RDAP_LOADED", True)
+    dnstool.IANA_RDAP_MAP["com"] = ["https://rdap.example/"]
+
+    assert dnstool.rdap_lookup("example.com") == {"ldhName": "example.com"}
+    assert dnstool.rdap_lookup("Example.com") == {"ldhName": "example.com"}
+    assert calls == ["https://rdap.example/domain/example.com"]
+
+    monkeypatch.setattr(dnstool, "RDAP_CACHE_MAX_AGE", 0)
+    dnstool.rdap_lookup("example.com")
+    assert len(calls) == 2
+
+
+def test_rdap_get_honours_retry_after(monkeypatch):
+    responses = [FakeResponse(429, headers={"Retry-After": "0.2"}), FakeResponse(200)]
+    sent = []
+
+    def fake_get(url, timeout=None, headers=None):
+        sent.append(time.monotonic())
+        return responses.pop(0)
+
+    monkeypatch.setattr(dnstool, "_http_session", lambda kind: types.SimpleNamespace(get=fake_get))
+    assert dnstool._rdap_get("https://rdap.example/domain/example.com").status_code == 200
+    assert sent[1] - sent[0] >= 0.2
+    assert dnstool._retry_after_seconds("Wed, 21 Oct 2015 07:28:00 GMT") == 0.0
+
+
+def test_rdap_get_gives_up_on_long_or_repeated_429(monkeypatch):
+    sent = []
+    paused = []
+
+    def fake_get(url, timeout=None, headers=None):
+        sent.append(url)
+        return FakeResponse(429, headers={"Retry-After": retry_after})
+
+    monkeypatch.setattr(dnstool, "_http_session", lambda kind: types.SimpleNamespace(get=fake_get))
+    monkeypatch.setattr(dnstool._TokenBucket, "pause", lambda self, seconds: paused.append(seconds))
+    retry_after = "3600"
+    assert dnstool._rdap_get("https://rdap.example/domain/a.example").status_code == 429
+    dnstool._rdap_get("https://rdap.example/domain/b.example")
+    assert len(sent) == 2 and paused == []  # the server is not held for an hour
+
+    retry_after = "0"
+    assert dnstool._rdap_get("https://rdap.slow.example/domain/a.example").status_code == 429
+    assert len(sent) == 2 + dnstool.RDAP_MAX_RETRIES + 1
+
+
+def test_token_bucket_limits_rate():
+    bucket = dnstool._TokenBucket(rate=50, burst=1)
+    start = time.monotonic()
+    for _ in range(6):
+        bucket.acquire()
+    assert time.monotonic() - start >= 0.09
+
+
+def test_authoritative_answers_per_server(monkeypatch, capsys):
+    query_map = {
+        ("NS", "example.com"): ["ns1.example.com.", "ns2.example.com."],
+        ("A", "ns1.example.com"): ["192.0.2.1"],
+        ("A", "ns2.example.com"): ["192.0.2.2"],
+        ("AAAA", "ns2.example.com"): ["2001:db8::2"],
+    }
+    served = {
+        "192.0.2.1": ["203.0.113.10"],
+        "192.0.2.2": ["203.0.113.10", "203.0.113.11"],
+        "2001:db8::2": ["203.0.113.10", "203.0.113.11"],
+    }
+
+    class ZoneResolver:
+        def __init__(self, configure=False):
+            self.nameservers = []
+
+        def resolve(self, domain, rdtype):
+            return served[self.nameservers[0].address]
+
+    monkeypatch.setattr(dnstool, "dns_query", lambda rdtype, domain: query_map.get((rdtype, domain), []))
+    monkeypatch.setattr(dnstool.dns.resolver, "Resolver", ZoneResolver)
+
+    answers = dnstool.authoritative_answers("example.com", ["A"])
+    assert answers["A"] == served
+    assert dnstool.authoritative_lookup("example.com", ["A"])["A"] == ["203.0.113.10", "203.0.113.11"]
+
+    dnstool.print_authoritative_results("example.com", ["A"])
+    out = capsys.readouterr().out
+    assert "A: nameservers disagree" in out
+    assert "192.0.2.1: 203.0.113.10\n" in out
+
+
+def test_run_all_checks_jsonl_report(monkeypatch, capsys):
+    records = {
+        ("TXT", "example.com"): ["v=spf1 -all"],
+        ("TXT", "_dmarc.example.com"): ["v=DMARC1; p=quarantine;"],
+        ("MX", "example.com"): ["10 mail.example.com."],
+        ("A", "example.com"): ["203.0.113.10"],
+    }
+
+    def failing_get(url, timeout=None):
+        raise OSError("offline")
+
+    monkeypatch.setattr(dnstool, "dns_query", lambda rdtype, domain: records.get((rdtype, domain), []))
+    monkeypatch.setattr(dnstool, "ptr_lookup", lambda ip: [])
+    monkeypatch.setattr(dnstool, "rdap_lookup", lambda domain: {})
+    monkeypatch.setattr(dnstool, "whois_lookup_registrar", lambda domain: "Example Registrar")
+    monkeypatch.setattr(dnstool, "collect_dnssec", lambda domain: {"status": "unsigned"})
+    monkeypatch.setattr(dnstool, "_http_session", lambda kind: types.SimpleNamespace(get=failing_get))
+    monkeypatch.setattr(dnstool, "OUTPUT_FORMAT", "jsonl")
+
+    dnstool.run_all_checks("example.com")
+    dnstool.run_all_checks("not_a_domain")
+    lines = capsys.readouterr().out.splitlines()
+    assert len(lines) == 2
+    report = json.loads(lines[0])
+    checks = report["checks"]
+    assert report["domain"] == "example.com"
+    assert list(checks)[:3] == ["registrar", "ns", "mx"]
+    assert checks["registrar"]["source"] == "whois"
+    assert checks["spf"]["valid"] == ["v=spf1 -all"]
+    assert checks["dmarc"]["policy"] == "quarantine"
+    assert checks["mta_sts"]["policy_status"] == 0
+    assert checks["ptr"]["addresses"] == {"203.0.113.10": []}
+    assert json.loads(lines[1]) == {"domain": "not_a_domain", "error": "invalid domain"}
+
+
+def test_renderers_accept_collected_data(capsys):
+    dnstool.get_mta_sts("example.com", {
+        "records": [],
+        "policy_url": "https://mta-sts.example.com/.well-known/mta-sts.txt",
+        "policy_status": 0,
+    })
+    dnstool.get_registrar("example.com", {
+        "rdap_found": True, "rdap_registrar": "1234", "registrar": "1234", "source": "rdap-handle",
+    })
+    out = capsys.readouterr().out
+    assert "No policy file (HTTP 000)." in out
+    assert "Registrar (RDAP handle)" in out
+
+
+def test_iter_domains_streams_normalises_and_dedupes(monkeypatch, tmp_path, capsys):
+    path = tmp_path / "domains.txt"
+    path.write_text("example.com\n\n  exämple.test \nexample.com.\nbad_domain\n")
+    monkeypatch.setattr(sys, "stdin", io.StringIO("example.org\nexample.com\n"))
+    args = types.SimpleNamespace(file=str(path), domains=["-", "example.net"])
+
+    domains = dnstool._iter_domains(dnstool._iter_domain_entries(args))
+    assert next(domains) == "example.com"
+    assert capsys.readouterr().out == ""  # nothing read past the first domain yet
+    assert list(domains) == ["xn--exmple-cua.test", "example.org", "example.net"]
+    assert "Invalid domain" in capsys.readouterr().out
+
+
+def test_digest_set_grows_and_stays_exact():
+    seen = dnstool.DigestSet(slots=8)
+    names = [f"site{i}.example" for i in range(5000)]
+    assert all(seen.add(name) for name in names)
+    assert not any(seen.add(name) for name in names)
+    assert len(seen) == 5000 and seen._table.nbytes <= 32 * len(seen)
+
+
+def test_results_store_batches_writes_and_resumes(monkeypatch, tmp_path, capsys):
+    path = str(tmp_path / "results.sqlite3")
+    checked = []
+
+    def fake_run_all_checks(domain, authoritative=False):
+        checked.append(domain)
+        dnstool._print(f"report {domain}")
+
+    monkeypatch.setattr(dnstool, "run_all_checks", fake_run_all_checks)
+    monkeypatch.setattr(dnstool, "RESULTS_FLUSH_INTERVAL", 3600)
+
+    store = dnstool.ResultsStore(path)
+    store.add("a.example", "old report\n")
+    assert not dnstool.ResultsStore(path).is_done("a.example", 60)  # still buffered
+    store.close()
+
+    monkeypatch.setattr(dnstool, "RESULTS_STORE", dnstool.ResultsStore(path))
+    domains = dnstool.RESULTS_STORE.pending(["a.example", "b.example"], 60)
+    with pytest.raises(SystemExit):
+        dnstool._run_batch_mode(domains)
+    assert checked == ["b.example"]
+    assert capsys.readouterr().out == "report b.example\n"
+    assert dnstool.ResultsStore(path).is_done("b.example", 60)
+    assert not dnstool.ResultsStore(path).is_done("a.example", -1)
+
+
+def test_snapshot_store_reuses_unexpired_answers(monkeypatch, tmp_path):
+    now = [1000.0]
+    monkeypatch.setattr(dnstool.time, "time", lambda: now[0])
+    monkeypatch.setattr(dnstool, "SNAPSHOT_MAX_AGE", 600)
+    store = dnstool.SnapshotStore(str(tmp_path / "snap.sqlite3"))
+    fetches = []
+
+    def fetch():
+        fetches.append(now[0])
+        return ["10 mx.example.com."], 3600
+
+    key = ("example.com", "MX")
+    assert store.answer(key, fetch) == (["10 mx.example.com."], 3600)
+    now[0] += 500
+    assert store.answer(key, fetch) == (["10 mx.example.com."], 100)
+    now[0] += 200  # TTL still valid, but older than SNAPSHOT_MAX_AGE
+    store.answer(key, fetch)
+    assert fetches == [1000.0, 1700.0]
+    store.close()
+
+
+def test_incremental_scan_prints_only_changes(monkeypatch, tmp_path, capsys):
+    records = {("TXT", "example.com"): ["v=spf1 -all", "site-verification=1"],
+               ("MX", "example.com"): ["10 mx.example.com."]}
+    monkeypatch.setattr(dnstool, "dns_query", lambda rdtype, domain: records.get((rdtype, domain), []))
+    monkeypatch.setattr(dnstool, "_check_table", lambda authoritative=False: [
+        ("txt", dnstool.collect_txt, dnstool.get_txt_records),
+        ("mx", dnstool.collect_mx, dnstool.get_mx_records),
+    ])
+    monkeypatch.setattr(dnstool, "SNAPSHOT_STORE", dnstool.SnapshotStore(str(tmp_path / "snap.sqlite3")))
+    monkeypatch.setattr(dnstool, "OUTPUT_FORMAT", "jsonl")
+
+    dnstool.run_all_checks("example.com")
+    first = json.loads(capsys.readouterr().out)
+    assert first["first_scan"] and set(first["changes"]) == {"txt", "mx"}
+
+    dnstool.run_all_checks("example.com")
+    assert capsys.readouterr().out == ""
+
+    records[("TXT", "example.com")].reverse()  # round-robin rotation is not a change
+    dnstool.run_all_checks("example.com")
+    assert capsys.readouterr().out == ""
+
+    records[("MX", "example.com")] = ["20 mx2.example.com."]
+    dnstool.run_all_checks("example.com")
+    changes = json.loads(capsys.readouterr().out)["changes"]
+    assert list(changes) == ["mx"]
+    assert changes["mx"]["old"]["records"] == ["10 mx.example.com."]
+    assert changes["mx"]["new"]["records"] == ["20 mx2.example.com."]
+
+
+def start_whois_stub(replies, log):
+    """Serve ``replies[query]`` on an ephemeral 127.0.0.1 port, appending ``(port, query)`` to ``log``."""
+    srv = socket.socket()
+    srv.bind(("127.0.0.1", 0))
+    srv.listen(8)
+    port = srv.getsockname()[1]
+
+    def serve():
+        while True:
+            try:
+                conn, _ = srv.accept()
+            except OSError:
+                return
+            with conn:
+                query = conn.recv(1024).decode().strip()
+                log.append((port, query))
+                conn.sendall(replies.get(query, "").encode())
+
+    threading.Thread(target=serve, daemon=True).start()
+    return srv
+
+
+def test_whois_follows_registry_referral(monkeypatch):
+    log = []
+    registrar = start_whois_stub({
+        "example.com": "Registrar URL: https://r.example\nRegistrar: Example Registrar, Inc.\n",
+    }, log)
+    registrar_port = registrar.getsockname()[1]
+    registry = start_whois_stub({
+        "com": "domain: COM\nrefer: 127.0.0.1\n",
+        "example.com": f"Domain Name: EXAMPLE.COM\nRegistrar WHOIS Server: whois://127.0.0.1:{registrar_port}\n",
+    }, log)
+    registry_port = registry.getsockname()[1]
+    monkeypatch.setattr(dnstool, "WHOIS_IANA_SERVER", "127.0.0.1")
+    monkeypatch.setattr(dnstool, "WHOIS_PORT", registry_port)
+    try:
+        assert dnstool.whois_lookup_registrar("example.com") == "Example Registrar, Inc."
+        assert dnstool.whois_lookup_registrar("EXAMPLE.com") == "Example Registrar, Inc."
+    finally:
+        registry.close()
+        registrar.close()
+    # IANA, registry and registrar each asked once; the repeat came from the cache.
+    assert log == [(registry_port, "com"), (registry_port, "example.com"), (registrar_port, "example.com")]
+
+
+def test_whois_per_server_connection_limit(monkeypatch):
+    active = []
+    peak = []
+    lock = threading.Lock()
+
+    class FakeSocket:
+        def __init__(self, addr, timeout=None):
+            with lock:
+                active.append(addr)
+                peak.append(len(active))
+            time.sleep(0.02)
+
+        def __enter__(self):
+            return self
+
+        def __exit__(self, *exc):
+            with lock:
+                active.pop()
+
+        def sendall(self, data):
+            pass
+
+        def recv(self, n):
+            return b""
+
+    monkeypatch.setattr(dnstool.socket, "create_connection", FakeSocket)
+    monkeypatch.setattr(dnstool, "WHOIS_PER_SERVER", 2)
+    threads = [threading.Thread(target=dnstool._whois_query, args=("whois.example", "x.example")) for _ in range(8)]
+    for t in threads:
+        t.start()
+    for t in threads:
+        t.join()
+    assert max(peak) == 2
+
+
+def test_whois_busy_server_does_not_starve_others(monkeypatch):
+    release = threading.Event()
+
+    class FakeSocket:
+        def __init__(self, addr, timeout=None):
+            if addr[0] == "slow.example":
+                release.wait(5)
+
+        def __enter__(self):
+            return self
+
+        def __exit__(self, *exc):
+            pass
+
+        def sendall(self, data):
+            pass
+
+        def recv(self, n):
+            return b""
+
+    monkeypatch.setattr(dnstool.socket, "create_connection", FakeSocket)
+    monkeypatch.setattr(dnstool, "WHOIS_PER_SERVER", 1)
+    monkeypatch.setattr(dnstool, "_WHOIS_LIMIT", threading.BoundedSemaphore(2))
+    threads = [threading.Thread(target=dnstool._whois_query, args=("slow.example", "x.example")) for _ in range(4)]
+    for t in threads:
+        t.start()
+    time.sleep(0.05)
+    fast = threading.Thread(target=dnstool._whois_query, args=("fast.example", "x.example"))
+    fast.start()
+    fast.join(1)
+    alive = fast.is_alive()
+    release.set()
+    for t in threads + [fast]:
+        t.join()
+    assert not alive
+
+
+def test_dkim_short_circuits_on_missing_domainkey(monkeypatch):
+    queried = []
+    monkeypatch.setattr(dnstool, "_name_missing", lambda qname: queried.append(qname) or True)
+    monkeypatch.setattr(dnstool, "dns_query", lambda rdtype, domain: pytest.fail("selector probed"))
+    assert dnstool.collect_dkim("example.com") == {"selectors": {}}
+    assert queried == ["_domainkey.example.com"]
+
+
+def test_dkim_probes_dictionary_and_ranks_hits(monkeypatch):
+    keys = {"mandrill._domainkey.a.example": ["v=DKIM1; p=A"], "s1._domainkey.a.example": ["v=DKIM1; p=B"]}
+    probed = []
+    monkeypatch.setattr(dnstool, "_name_missing", lambda qname: False)
+    monkeypatch.setattr(dnstool, "dns_query", lambda rdtype, domain: probed.append(domain) or keys.get(domain, []))
+
+    data = dnstool.collect_dkim("a.example")
+    assert list(data["selectors"]) == ["s1._domainkey", "mandrill._domainkey"]
+    assert len(probed) == dnstool.DKIM_ROUND  # both keys are in the first round
+    assert set(dnstool._ranked_selectors()[:2]) == {"s1", "mandrill"}
+
+
+def test_dkim_probes_later_rounds_one_round_at_a_time(monkeypatch):
+    sels = dnstool.DKIM_SELECTORS
+    late = sels[2 * dnstool.DKIM_ROUND + 1]
+    in_flight = []
+    peak = []
+    lock = threading.Lock()
+
+    def fake_query(rdtype, name):
+        with lock:
+            in_flight.append(name)
+            peak.append(len(in_flight))
+        time.sleep(0.001)
+        with lock:
+            in_flight.remove(name)
+        return ["v=DKIM1; p=C"] if name == f"{late}._domainkey.b.example" else []
+
+    monkeypatch.setattr(dnstool, "_name_missing", lambda qname: False)
+    monkeypatch.setattr(dnstool, "dns_query", fake_query)
+    assert list(dnstool.collect_dkim("b.example")["selectors"]) == [f"{late}._domainkey"]
+    assert max(peak) <= dnstool.DKIM_ROUND
+
+
+def test_query_outcomes_are_classified(monkeypatch):
+    class OutcomeResolver:
+        def __init__(self, ns):
+            self.ns = ns
+
+        def resolve(self, qname, rdtype, **kwargs):
+            raise {"1.1.1.1": dnstool.dns.exception.Timeout(),
+                   "8.8.8.8": dnstool.dns.resolver.NoNameservers(),
+                   "9.9.9.9": dnstool.dns.resolver.NXDOMAIN()}[self.ns]
+
+    monkeypatch.setattr(dnstool, "_resolver_for", lambda ns, dnssec=False: OutcomeResolver(ns))
+    monkeypatch.setattr(dnstool, "RESOLVERS", ["1.1.1.1", "8.8.8.8"])
+    assert dnstool.dns_query("A", "gone.example").status == dnstool.QUERY_SERVFAIL
+    monkeypatch.setattr(dnstool, "RESOLVERS", ["1.1.1.1"])
+    assert dnstool.dns_query("A", "slow.example").status == dnstool.QUERY_TIMEOUT
+    monkeypatch.setattr(dnstool, "RESOLVERS", ["9.9.9.9", "1.1.1.1"])
+    result = dnstool.dns_query("A", "gone.example")
+    assert result == [] and result.status == dnstool.QUERY_NXDOMAIN
+    # Failures are not cached; the NXDOMAIN is, with the same outcome.
+    assert dnstool.dns_query("A", "gone.example").status == dnstool.QUERY_NXDOMAIN
+    assert ("slow.example", "A") not in dnstool.QUERY_CACHE._entries
+
+
+def test_nxdomain_apex_skips_all_checks(monkeypatch, capsys):
+    queries = []
+
+    def fake_query(rdtype, domain):
+        queries.append((rdtype, domain))
+        return dnstool.DNSResult(status=dnstool.QUERY_NXDOMAIN)
+
+    monkeypatch.setattr(dnstool, "dns_query", fake_query)
+    monkeypatch.setattr(dnstool, "rdap_lookup", lambda domain: pytest.fail("RDAP queried"))
+    dnstool.run_all_checks("expired.example")
+    assert "does not exist (NXDOMAIN)" in capsys.readouterr().out
+    assert queries == [("NS", "expired.example")]
+
+    monkeypatch.setattr(dnstool, "OUTPUT_FORMAT", "jsonl")
+    dnstool.run_all_checks("expired.example")
+    assert json.loads(capsys.readouterr().out) == {"domain": "expired.example", "status": "nxdomain", "checks": {}}
+
+
+def test_checks_share_one_bounded_pool_across_domains(monkeypatch):
+    threads = set()
+    lock = threading.Lock()
+
+    def collect(domain):
+        with lock:
+            threads.add(threading.current_thread().name)
+        return domain
+
+    monkeypatch.setattr(dnstool, "CHECK_WORKERS", 2)
+    monkeypatch.setattr(dnstool, "_CHECK_POOL", None)
+    monkeypatch.setattr(dnstool, "_check_table", lambda authoritative=False: [
+        (name, collect, None) for name in ("a", "aaaa", "mx", "txt")])
+    monkeypatch.setattr(dnstool, "dns_query", lambda rdtype, domain: dnstool.DNSResult(["192.0.2.1"]))
+    with ThreadPoolExecutor(max_workers=3) as batch:
+        reports = list(batch.map(dnstool.build_report, [f"d{i}.example" for i in range(6)]))
+    assert reports[5]["checks"]["mx"] == "d5.example"
+    assert len(threads) <= 2 and all(name.startswith("dnstool-check") for name in threads)
+
+
+def test_pools_and_inflight_cap_scale_with_parallel_domains(monkeypatch):
+    for name in ("CHECK_WORKERS", "DKIM_WORKERS", "WAVE_WORKERS", "HEDGE_WORKERS", "AUTHORITATIVE_WORKERS",
+                 "MAX_INFLIGHT_PER_RESOLVER"):
+        monkeypatch.setattr(dnstool, name, getattr(dnstool, name))
+    dnstool._size_pools(4)
+    assert dnstool.CHECK_WORKERS == 4 * (len(dnstool.CHECK_NAMES) + 1)
+    assert dnstool.DKIM_WORKERS == 4 * dnstool.DKIM_ROUND
+    assert dnstool.MAX_INFLIGHT_PER_RESOLVER == 4 * dnstool.INFLIGHT_PER_DOMAIN
+    dnstool._size_pools(4, workers=5, max_inflight=7)
+    assert dnstool.CHECK_WORKERS == 5 and dnstool.MAX_INFLIGHT_PER_RESOLVER == 7
+    assert dnstool.WAVE_WORKERS == 4 * dnstool.WAVE_WORKERS_PER_DOMAIN
+
+
+@pytest.fixture
+def tls_cert(tmp_path, monkeypatch):
+    """Write a self-signed certificate for 127.0.0.1 and make dnstool trust it."""
+    import shutil
+    import subprocess
+    if shutil.which("openssl") is None:
+        pytest.skip("openssl not available")
+    cert, key = tmp_path / "cert.pem", tmp_path / "key.pem"
+    subprocess.run(["openssl", "req", "-x509", "-newkey", "rsa:2048", "-nodes", "-days", "1",
+                    "-subj", "/CN=127.0.0.1", "-addext", "subjectAltName=IP:127.0.0.1",
+                    "-keyout", str(key), "-out", str(cert)], check=True, capture_output=True)
+    monkeypatch.setattr(dnstool, "DNS_TLS_CAFILE", str(cert))
+    ctx = ssl.SSLContext(ssl.PROTOCOL_TLS_SERVER)
+    ctx.load_cert_chain(str(cert), str(key))
+    return ctx
+
+
+def stand_in_answer(wire):
+    """Answer a wire-format A query with 192.0.2.<first letter of the name>."""
+    import dns.message
+    import dns.rrset
+    query = dns.message.from_wire(wire)
+    response = dns.message.make_response(query)
+    name = query.question[0].name
+    response.answer.append(dns.rrset.from_text(name, 60, "IN", "A", f"192.0.2.{name.to_text()[0]}"))
+    return response.to_wire()
+
+
+def test_dot_pipelines_queries_over_one_connection(monkeypatch, tls_cert):
+    srv = socket.socket()
+    srv.bind(("127.0.0.1", 0))
+    srv.listen(4)
+    accepted = []
+
+    def serve():
+        conn = tls_cert.wrap_socket(srv.accept()[0], server_side=True)
+        accepted.append(conn)
+        queries = []
+        while len(queries) < 2:
+            n = int.from_bytes(conn.recv(2), "big")
+            queries.append(conn.recv(n))
+        for wire in reversed(queries):  # answer out of order
+            answer = stand_in_answer(wire)
+            conn.sendall(len(answer).to_bytes(2, "big") + answer)
+
+    threading.Thread(target=serve, daemon=True).start()
+    monkeypatch.setattr(dnstool, "RESOLVERS", [f"tls://127.0.0.1:{srv.getsockname()[1]}"])
+    monkeypatch.setattr(dnstool, "DOT_CONNECTIONS", 1)
+    results = {}
+    threads = [threading.Thread(target=lambda n=n: results.update({n: dnstool.dns_query("A", f"{n}.example")}))
+               for n in ("1", "2")]
+    for t in threads:
+        t.start()
+    for t in threads:
+        t.join()
+    srv.close()
+    assert results == {"1": ["192.0.2.1"], "2": ["192.0.2.2"]}
+    assert len(accepted) == 1
+
+
+def test_dot_handshake_with_stalled_server_does_not_block_others(tls_cert):
+    stalled = socket.socket()
+    stalled.bind(("127.0.0.1", 0))
+    stalled.listen(4)  # accepts TCP but never answers the TLS handshake
+    fast = socket.socket()
+    fast.bind(("127.0.0.1", 0))
+    fast.listen(4)
+    served = []  # keep the server end open so the client connection stays live
+    threading.Thread(target=lambda: served.append(tls_cert.wrap_socket(fast.accept()[0], server_side=True)),
+                     daemon=True).start()
+    stalled_done = threading.Event()
+
+    def connect_stalled():
+        try:
+            dnstool._dot_connection("127.0.0.1", stalled.getsockname()[1], "127.0.0.1", 30)
+        except Exception:
+            pass
+        stalled_done.set()
+
+    threading.Thread(target=connect_stalled, daemon=True).start()
+    stalled_key = ("127.0.0.1", stalled.getsockname()[1], "127.0.0.1")
+    for _ in range(500):
+        if stalled_key in dnstool._DOT_POOL:  # its handshake has started
+            break
+        time.sleep(0.01)
+    conn = dnstool._dot_connection("127.0.0.1", fast.getsockname()[1], "127.0.0.1", 30)
+    assert not conn.closed and not stalled_done.is_set()  # connected while the other handshake hangs
+    stalled.close()
+    fast.close()
+    for sock in served:
+        sock.close()
+
+
+def test_dot_io_failure_fails_pending_queries_at_once(monkeypatch, tls_cert):
+    import dns.message
+    srv = socket.socket()
+    srv.bind(("127.0.0.1", 0))
+    srv.listen(1)
+    served = []
+
+    def serve():
+        conn = tls_cert.wrap_socket(srv.accept()[0], server_side=True)
+        served.append(conn)
+        wire = conn.recv(int.from_bytes(conn.recv(2), "big"))
+        answer = stand_in_answer(wire)
+        conn.sendall(len(answer).to_bytes(2, "big") + answer)
+
+    def broken_deliver(self, inbuf):
+        raise ValueError("malformed reply")
+
+    threading.Thread(target=serve, daemon=True).start()
+    monkeypatch.setattr(dnstool._DoTConnection, "_deliver", broken_deliver)
+    conn = dnstool._dot_connection("127.0.0.1", srv.getsockname()[1], "127.0.0.1", 5)
+    with pytest.raises(ConnectionError):
+        conn.query(dns.message.make_query("1.example", "A"), 30)  # not left to time out
+    assert conn.closed
+    srv.close()
+    for sock in served:
+        sock.close()
+
+
+def test_doh_transport_posts_wire_queries(monkeypatch, tls_cert):
+    from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+    seen = []
+
+    class Handler(BaseHTTPRequestHandler):
+        protocol_version = "HTTP/1.1"
+
+        def do_POST(self):
+            seen.append((self.path, self.headers["Content-Type"]))
+            answer = stand_in_answer(self.rfile.read(int(self.headers["Content-Length"])))
+            self.send_response(200)
+            self.send_header("Content-Type", "application/dns-message")
+            self.send_header("Content-Length", str(len(answer)))
+            self.end_headers()
+            self.wfile.write(answer)
+
+        def log_message(self, *args):
+            pass
+
+    httpd = ThreadingHTTPServer(("127.0.0.1", 0), Handler)
+    httpd.socket = tls_cert.wrap_socket(httpd.socket, server_side=True)
+    threading.Thread(target=httpd.serve_forever, daemon=True).start()
+    monkeypatch.setattr(dnstool, "_doh_client", lambda: None)
+    monkeypatch.setattr(dnstool, "RESOLVERS", [f"https://127.0.0.1:{httpd.server_address[1]}/dns-query"])
+    try:
+        assert dnstool.dns_query("A", "7.example") == ["192.0.2.7"]
+    finally:
+        httpd.shutdown()
+    assert seen == [("/dns-query", "application/dns-message")]
+
+
+def test_with_transport_rewrites_plain_resolvers():
+    assert dnstool._with_transport(["1.1.1.1", "10.0.0.1", "2606:4700::1111"], "dot") == [
+        "tls://1.1.1.1", "tls://10.0.0.1", "tls://[2606:4700::1111]"]
+    assert dnstool._with_transport(["1.1.1.1", "10.0.0.1", "tls://9.9.9.9"], "doh") == [
+        "https://cloudflare-dns.com/dns-query", "https://10.0.0.1/dns-query", "tls://9.9.9.9"]
+
+
+def test_bench_scenario_against_stand_ins():
+    import bench
+    resolvers = dnstool.RESOLVERS
+    env = bench.BenchEnvironment()
+    try:
+        result = bench.run_scenario(env, "batch", bench.bench_domains(3), jobs=3)
+        with env.configured():
+            report = dnstool.build_report("site4.bench")
+    finally:
+        env.close()
+    assert dnstool.RESOLVERS is resolvers
+    assert result["domains"] == 3 and result["queries"] > 0
+    assert 0 < result["p50_ms"] <= result["p95_ms"] <= result["p99_ms"]
+    assert result["queries_per_domain"] <= bench.QUERY_BUDGET_PER_DOMAIN and result["slowest_check"]
+    checks = report["checks"]
+    assert checks["registrar"]["registrar"] == "Bench Registrar"
+    assert checks["dmarc"]["records"] and list(checks["dkim"]["selectors"]) == ["default._domainkey"]
+    assert checks["mta_sts"]["policy_status"] == 200
+    assert checks["ptr"]["addresses"] == {"192.0.2.5": ["mail.site4.bench"]}
+
+
+def test_check_profile_plans_and_sends_only_needed_lookups():
+    import bench
+    plan = dnstool.plan_lookups(dnstool.CHECK_PROFILES["mail"], "site2.bench")
+    assert len(plan) == len(set(plan))
+    assert plan.count(("TXT", "site2.bench")) == 1 and ("PTR", "{a}") in plan
+    assert ("TXT", "{selector}._domainkey.site2.bench") in plan and ("rdap", "site2.bench") not in plan
+    env = bench.BenchEnvironment()
+    try:
+        with env.configured(CHECKS=("dmarc",)):
+            before = env.dns.queries
+            report = dnstool.build_report("site2.bench")
+            dmarc_queries = env.dns.queries - before
+            before = env.dns.queries
+            dnstool.build_report("nosuch.bench")
+            missing_queries = env.dns.queries - before
+        with env.configured(CHECKS=dnstool.CHECK_PROFILES["dns"]):
+            dns_report = dnstool.build_report("site3.bench")
+    finally:
+        env.close()
+    assert list(report["checks"]) == ["dmarc"] and report["checks"]["dmarc"]["policy"] == "reject"
+    assert dmarc_queries == 1 and missing_queries == 1
+    assert list(dns_report["checks"]) == ["ns", "txt", "dnssec", "a", "aaaa", "caa", "soa"]
+
+
+def test_run_waves_sends_dependent_lookups_after_first_wave(monkeypatch):
+    answers = {("A", "example.com"): ["192.0.2.1", "192.0.2.2"], ("NS", "example.com"): ["ns1.example.net."]}
+    sent = []
+
+    first = {("NS", "example.com"), ("A", "example.com"), ("MX", "example.com"), ("TXT", "example.com"),
+             ("TLSA", "_25._tcp.example.com"), ("TLSA", "_443._tcp.example.com"), ("TXT", "_dmarc.example.com"),
+             ("TXT", "_domainkey.example.com")}
+    second = {("PTR", "192.0.2.1"), ("PTR", "192.0.2.2"), ("A", "ns1.example.net"), ("AAAA", "ns1.example.net")}
+    # Each first-wave lookup waits for all the others, so the wave only
+    # completes if every lookup in it is in flight at once.
+    together = threading.Barrier(len(first), timeout=5)
+    lock = threading.Lock()
+
+    def fake_dns_query(rdtype, name):
+        with lock:
+            join = (rdtype, name) in first and (rdtype, name) not in sent
+            sent.append((rdtype, name))
+        if join:
+            together.wait()
+        return dnstool.DNSResult(answers.get((rdtype, name), []))
+
+    monkeypatch.setattr(dnstool, "dns_query", fake_dns_query)
+    monkeypatch.setattr(dnstool, "ptr_lookup", lambda ip: sent.append(("PTR", ip)) or [])
+    plan = dnstool.plan_lookups(("authoritative", "ptr", "dane", "dmarc", "dkim"), "example.com")
+    dnstool.send_second_wave(dnstool.send_first_wave(plan), plan, "example.com")
+    assert not together.broken
+    assert set(sent[:len(first)]) == first
+    assert second <= set(sent[len(first):])
+
+
+def test_unknown_check_name_is_rejected(monkeypatch, capsys):
+    monkeypatch.setattr(sys, "argv", ["dnstool", "--checks", "dmarc,nope", "example.com"])
+    with pytest.raises(SystemExit) as exc:
+        dnstool.main()
+    assert exc.value.code == 2 and "unknown check(s): nope" in capsys.readouterr().err
+
+
+def test_empty_check_selection_is_rejected(monkeypatch, capsys):
+    monkeypatch.setattr(sys, "argv", ["dnstool", "--checks", ",", "example.com"])
+    with pytest.raises(SystemExit) as exc:
+        dnstool.main()
+    assert exc.value.code == 2 and "selects no checks" in capsys.readouterr().err
+
+
+def test_startup_defers_heavy_imports():
+    import subprocess
+    import bench
+    root = pathlib.Path(__file__).resolve().parents[1]
+    loaded = subprocess.run(
+        [sys.executable, "-c", "import sys, dnstool; print(sorted(m for m in "
+         "('requests', 'prompt_toolkit', 'asyncio', 'http.server') if m in sys.modules))"],
+        cwd=root, capture_output=True, text=True, check=True).stdout.strip()
+    assert loaded == "[]"
+    env = bench.BenchEnvironment()
+    try:
+        result = bench.run_startup(env, runs=3)
+    finally:
+        env.close()
+    assert result["scenario"] == "startup" and result["runs"] == 3 and result["p50_ms"] > 0
+
+
+def test_stats_record_resolver_latency_timeouts_and_retries(monkeypatch):
+    class FlakyResolver:
+        def __init__(self, ns):
+            self.ns = ns
+
+        def resolve(self, qname, rdtype, **kwargs):
+            if self.ns == "1.1.1.1":
+                raise dnstool.dns.exception.Timeout()
+            return FakeAnswer(["192.0.2.1"], 60)
+
+    monkeypatch.setattr(dnstool, "_resolver_for", lambda ns, dnssec=False: FlakyResolver(ns))
+    monkeypatch.setattr(dnstool, "RESOLVERS", ["1.1.1.1", "8.8.8.8"])
+    assert dnstool.dns_query("A", "example.com") == ["192.0.2.1"]
+    assert dnstool.dns_query("A", "example.com") == ["192.0.2.1"]
+
+    stats = dnstool.STATS
+    assert stats.histograms[("resolver", "1.1.1.1")].count == 1
+    assert stats.histograms[("rdtype", "A")].count == 2
+    assert stats.counters[("timeouts", "1.1.1.1")] == 1 and stats.counters[("retries", "8.8.8.8")] == 1
+    assert stats.total("retries") == 1 and stats.total("inflight") == 0
+    summary = dnstool.format_stats(stats)
+    assert "timeouts 1" in summary and "retries 1" in summary
+    assert "DNS cache hit rate:    50.0% (1/2)" in summary
+
+
+def test_stats_time_each_check(monkeypatch):
+    monkeypatch.setattr(dnstool, "dns_query", lambda rdtype, domain: [])
+    monkeypatch.setattr(dnstool, "_check_table", lambda authoritative=False: [
+        ("txt", dnstool.collect_txt, dnstool.get_txt_records),
+        ("mx", dnstool.collect_mx, dnstool.get_mx_records),
+    ])
+    dnstool.build_report("example.com")
+    dnstool.run_all_checks("example.com")
+    hist = dnstool.STATS.histograms
+    assert hist[("check", "txt")].count == 2 and hist[("check", "mx")].count == 2
+    assert dnstool.STATS.total("domains") == 1
+
+    h = dnstool.Histogram()
+    for v in (0.002, 0.003, 0.004, 0.2):
+        h.observe(v)
+    assert h.quantile(0.5) == 0.005 and h.quantile(1.0) == 0.2
+
+
+def test_metrics_endpoint_serves_openmetrics(monkeypatch):
+    monkeypatch.setattr(dnstool, "_resolver_for", lambda ns, dnssec=False: types.SimpleNamespace(
+        resolve=lambda qname, rdtype, **kwargs: FakeAnswer(["192.0.2.1"], 60)))
+    monkeypatch.setattr(dnstool, "RESOLVERS", ["1.1.1.1"])
+    dnstool.dns_query("A", "example.com")
+    dnstool.dns_query("A", "example.com")
+    dnstool.STATS.count("domains")
+
+    server = dnstool.start_metrics_server(0)
+    try:
+        resp = requests.get(f"http://127.0.0.1:{server.server_address[1]}/metrics", timeout=5)
+    finally:
+        server.shutdown()
+    assert resp.headers["Content-Type"].startswith("application/openmetrics-text")
+    lines = resp.text.splitlines()
+    assert lines[-1] == "# EOF"
+    assert "dnstool_domains_completed_total 1" in lines
+    assert 'dnstool_resolver_queries_total{resolver="1.1.1.1"} 1' in lines
+    assert 'dnstool_queries_in_flight{resolver="1.1.1.1"} 0' in lines
+    assert 'dnstool_dns_query_duration_seconds_count{rdtype="A"} 2' in lines
+    assert "dnstool_dns_cache_hit_ratio 0.5" in lines
+
+
+@pytest.fixture
+def check_service():
+    """Run a CheckService on an ephemeral port in a background thread."""
+    import asyncio
+    started = threading.Event()
+    services = []
+
+    def start(**kwargs):
+        service = dnstool.CheckService(**kwargs)
+        port = []
+
+        def ready(p):
+            port.append(p)
+            started.set()
+
+        threading.Thread(target=asyncio.run, args=(service.serve("127.0.0.1", 0, ready),), daemon=True).start()
+        assert started.wait(5)
+        services.append(service)
+        return f"http://127.0.0.1:{port[0]}"
+
+    yield start
+    for service in services:
+        service.stop()
+
+
+def test_serve_coalesces_identical_checks(monkeypatch, check_service):
+    calls = []
+
+    def slow_report(domain, authoritative=False):
+        calls.append(domain)
+        time.sleep(0.3)
+        return {"domain": domain, "checks": {}}
+
+    monkeypatch.setattr(dnstool, "build_report", slow_report)
+    monkeypatch.setattr(dnstool, "_ensure_iana_rdap_data", lambda: None)
+    base = check_service()
+    responses = []
+    threads = [threading.Thread(target=lambda: responses.append(
+        requests.get(f"{base}/check?domain=Example.COM", timeout=5))) for _ in range(5)]
+    for t in threads:
+        t.start()
+    for t in threads:
+        t.join()
+    assert calls == ["example.com"]
+    assert [r.status_code for r in responses] == [200] * 5
+    assert responses[0].json() == {"domain": "example.com", "checks": {}}
+    assert requests.get(f"{base}/check?domain=bad_domain", timeout=5).status_code == 400
+
+
+def test_serve_rejects_work_beyond_admission_limit(monkeypatch, check_service):
+    release = threading.Event()
+
+    def blocking_report(domain, authoritative=False):
+        release.wait(5)
+        return {"domain": domain, "checks": {}}
+
+    monkeypatch.setattr(dnstool, "build_report", blocking_report)
+    monkeypatch.setattr(dnstool, "_ensure_iana_rdap_data", lambda: None)
+    base = check_service(max_active=1, max_queue=0)
+    first = []
+    t = threading.Thread(target=lambda: first.append(requests.get(f"{base}/check?domain=a.example", timeout=5)))
+    t.start()
+    time.sleep(0.2)
+    refused = requests.get(f"{base}/check?domain=b.example", timeout=5)
+    release.set()
+    t.join()
+    assert refused.status_code == 503 and refused.headers["Retry-After"] == "1"
+    assert first[0].status_code == 200